@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Daemon del bus de eventos local.
+Los receptores (contenedor) publican "file_committed" al terminar de
+recibir un archivo y msg-monitor.py / video-monitor.py se suscriben, sin
+escanear Descargas. El socket vive en Descargas para que el contenedor
+(que la monta como /root/Downloads) lo vea.
+"""
+import os
+import sys
+
+# localbus.py se comparte con la app del contenedor (solo usa stdlib)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "quic-file-transfer", "app"))
+import localbus
+import logs
+
+log = logs.get_logger("event-bus")
+
+def get_downloads_folder():
+    """Obtiene la carpeta de descargas del usuario"""
+    home = os.path.expanduser("~")
+
+    if os.path.exists(os.path.join(home, "Descargas")):
+        return os.path.join(home, "Descargas")
+    return os.path.join(home, "Downloads")
+
+if __name__ == "__main__":
+    logs.setup()
+    if not localbus.available():
+        log.error("❌ Este sistema no soporta sockets Unix; los monitores usarán DirWatcher")
+        sys.exit(1)
+
+    path = localbus.default_socket_path(get_downloads_folder())
+    try:
+        localbus.BusBroker(path).serve_forever()
+    except RuntimeError as e:
+        log.error("❌ %s", e)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        log.info("✓ Bus detenido")
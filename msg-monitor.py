@@ -5,10 +5,25 @@ Solo procesa ARCHIVOS NUEVOS que llegan.
 Ejecuta TTS, notificación y elimina el archivo.
 """
 import os
+import sys
 import time
+import queue
+import threading
+import shutil
+import hashlib
+import itertools
 import subprocess
 import platform
-from datetime import datetime
+from collections import OrderedDict
+
+# dirwatch.py se comparte con la app del contenedor (solo usa stdlib)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "quic-file-transfer", "app"))
+from dirwatch import DirWatcher, CLOSED, MOVED_IN, IN_CLOSE_WRITE, IN_MOVED_TO
+import localbus
+import filemeta
+import logs
+
+log = logs.get_logger("msg-monitor")
 
 def get_downloads_folder():
     """Obtiene la carpeta de descargas del usuario"""
@@ -21,15 +36,6 @@ def get_downloads_folder():
     
     return os.path.join(home, "Downloads")
 
-def log_message(msg):
-    """Escribe en log con timestamp"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = f"[{timestamp}] {msg}"
-    print(log_entry, flush=True)
-    
-    with open("/tmp/msg-monitor.log", "a") as f:
-        f.write(log_entry + "\n")
-
 def show_notification(title, message):
     """Muestra notificación del SO (desaparece después de 5 segundos)"""
     system = platform.system()
@@ -42,7 +48,7 @@ def show_notification(title, message):
                     ["terminal-notifier", "-title", title, "-message", message, "-timeout", "5"],
                     timeout=10
                 )
-                log_message(f"[📢] Notificación macOS (terminal-notifier, 5s)")
+                log.info("[📢] Notificación macOS (terminal-notifier, 5s)")
             except FileNotFoundError:
                 # Fallback a osascript con script para cerrar automáticamente
                 import time
@@ -53,16 +59,16 @@ def show_notification(title, message):
                     subprocess.run(["osascript", "-e", 'tell application "System Events" to keystroke "q" using command down'], timeout=2)
                 except:
                     pass
-                log_message(f"[📢] Notificación macOS (osascript, 5s)")
+                log.info("[📢] Notificación macOS (osascript, 5s)")
         
         elif system == "Linux":
             # notify-send formato exacto: notify-send "título" "mensaje"
             try:
                 cmd = f'notify-send "{title}" "{message}"'
                 subprocess.run(cmd, shell=True, timeout=5)
-                log_message(f"[📢] Notificación Linux enviada")
+                log.info("[📢] Notificación Linux enviada")
             except Exception as e:
-                log_message(f"[!] Error con notify-send: {e}")
+                log.error("[!] Error con notify-send: %s", e)
         
         elif system == "Windows":
             # Toast notification con duración corta en Windows
@@ -89,157 +95,367 @@ $toast.Group = "alertas"
 Start-Sleep -Seconds 5
 """
             subprocess.run(["powershell", "-Command", ps_script], timeout=10)
-            log_message(f"[📢] Notificación Windows (5s)")
+            log.info("[📢] Notificación Windows (5s)")
     
     except Exception as e:
-        log_message(f"[!] Error notificación: {e}")
+        log.error("[!] Error notificación: %s", e)
 
-def speak_message(message, repetitions=1):
-    """Lee el mensaje en voz alta con máxima calidad"""
-    system = platform.system()
+# Caché de audio sintetizado: persiste entre reinicios, acotada por LRU
+TTS_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "msg-monitor-tts")
+TTS_CACHE_MAX_ENTRIES = 64
+TTS_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+class TTSCache:
+    """
+    Archivos de audio indexados por (motor, voz, texto). Se sintetiza una
+    sola vez y todas las repeticiones (y alertas futuras idénticas)
+    reproducen el archivo cacheado. El orden LRU se guarda en el mtime.
+    """
+    def __init__(self, directory, max_entries=TTS_CACHE_MAX_ENTRIES, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # ruta → tamaño, del menos al más reciente
+        os.makedirs(directory, exist_ok=True)
+        existing = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.startswith(".tmp"):
+                os.remove(path)
+                continue
+            st = os.stat(path)
+            existing.append((st.st_mtime, path, st.st_size))
+        for _, path, size in sorted(existing):
+            self._entries[path] = size
     
-    try:
-        if system == "Darwin":  # macOS
-            for i in range(repetitions):
-                subprocess.run(
-                    ["say", "-v", "es", message],
-                    timeout=30
-                )
-                log_message(f"[🔊] macOS: '{message}' ({i+1}/{repetitions})")
-        
-        elif system == "Linux":
-            for i in range(repetitions):
-                # Intentar pico2wave primero (mejor calidad)
+    def _path_for(self, engine, voice, text, ext):
+        key = hashlib.sha1(f"{engine}\0{voice}\0{text}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{engine}-{key}{ext}")
+    
+    def get(self, engine, voice, text, ext, synthesize):
+        """
+        Devuelve la ruta del audio cacheado; si no existe llama a
+        synthesize(ruta_destino) y lo guarda. None si la síntesis falla.
+        """
+        path = self._path_for(engine, voice, text, ext)
+        with self._lock:
+            if path in self._entries and os.path.exists(path):
+                self._entries.move_to_end(path)
                 try:
-                    cmd = f'pico2wave -l=es-ES -w /tmp/msg.wav "{message}" && aplay /tmp/msg.wav && rm -f /tmp/msg.wav'
-                    subprocess.run(cmd, shell=True, timeout=30)
-                    log_message(f"[🔊] Linux pico2wave: '{message}' ({i+1}/{repetitions})")
-                    continue
-                except Exception:
+                    os.utime(path)
+                except OSError:
                     pass
-                
-                # Fallback a espeak-ng
-                try:
-                    subprocess.run(
-                        ["espeak-ng", "-v", "es", "-s", "150", "-p", "45", "-a", "200", message],
-                        timeout=30
-                    )
-                    log_message(f"[🔊] Linux espeak-ng: '{message}' ({i+1}/{repetitions})")
-                except FileNotFoundError:
-                    # Último recurso: espeak antiguo
-                    try:
-                        subprocess.run(
-                            ["espeak", "-v", "es", message],
-                            timeout=30
-                        )
-                        log_message(f"[🔊] Linux espeak: '{message}' ({i+1}/{repetitions})")
-                    except Exception:
-                        log_message(f"[❌] No hay TTS disponible en Linux")
+                return path
         
-        elif system == "Windows":
-            ps_script = f"""Add-Type –AssemblyName System.Speech
+        tmp_path = os.path.join(self.directory, f".tmp-{os.getpid()}-{threading.get_ident()}{ext}")
+        try:
+            synthesize(tmp_path)
+            if not os.path.exists(tmp_path) or os.path.getsize(tmp_path) == 0:
+                return None
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        
+        with self._lock:
+            self._entries[path] = os.path.getsize(path)
+            self._entries.move_to_end(path)
+            self._evict()
+        return path
+    
+    def _evict(self):
+        """Llamar con self._lock tomado"""
+        total = sum(self._entries.values())
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or total > self.max_bytes):
+            old_path, size = self._entries.popitem(last=False)
+            total -= size
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+_tts_cache = None
+
+def get_tts_cache():
+    global _tts_cache
+    if _tts_cache is None:
+        _tts_cache = TTSCache(TTS_CACHE_DIR)
+    return _tts_cache
+
+def _run_tts(cmd):
+    subprocess.run(cmd, timeout=30, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def synthesize_cached(message):
+    """
+    Sintetiza `message` con el primer motor disponible y devuelve
+    (motor, ruta_audio), usando la caché. (None, None) si no hay motor.
+    """
+    system = platform.system()
+    cache = get_tts_cache()
+    
+    if system == "Darwin":
+        engines = [("say", "es", ".aiff", lambda out: _run_tts(["say", "-v", "es", "-o", out, message]))]
+    elif system == "Linux":
+        engines = [
+            ("pico2wave", "es-ES", ".wav",
+             lambda out: _run_tts(["pico2wave", "-l=es-ES", f"-w={out}", message])),
+            ("espeak-ng", "es", ".wav",
+             lambda out: _run_tts(["espeak-ng", "-v", "es", "-s", "150", "-p", "45", "-a", "200", "-w", out, message])),
+            ("espeak", "es", ".wav",
+             lambda out: _run_tts(["espeak", "-v", "es", "-w", out, message])),
+        ]
+    elif system == "Windows":
+        def synth_windows(out):
+            text = message.replace("'", "''")
+            ps_script = f"""Add-Type -AssemblyName System.Speech
 $speak = New-Object System.Speech.Synthesis.SpeechSynthesizer
 $speak.Volume = 100
 $speak.Rate = 0
 $speak.SelectVoiceByHints([System.Speech.Synthesis.VoiceGender]::NotSpecified, [System.Speech.Synthesis.VoiceAge]::NotSpecified, 0, [System.Globalization.CultureInfo]'es-ES')
-for ($i = 0; $i -lt {repetitions}; $i++) {{
-    $speak.Speak(\"{message}\")
-}}
+$speak.SetOutputToWaveFile('{out}')
+$speak.Speak('{text}')
+$speak.Dispose()
 """
-            subprocess.run(["powershell", "-Command", ps_script], timeout=30)
-            log_message(f"[🔊] Windows TTS: '{message}' ({repetitions}x)")
+            _run_tts(["powershell", "-Command", ps_script])
+        engines = [("sapi", "es-ES", ".wav", synth_windows)]
+    else:
+        engines = []
+    
+    for engine, voice, ext, synthesize in engines:
+        if system != "Windows" and not shutil.which(engine):
+            continue
+        try:
+            path = cache.get(engine, voice, message, ext, synthesize)
+            if path:
+                return engine, path
+        except Exception as e:
+            log.warning("[!] Síntesis con %s falló: %s", engine, e)
+    return None, None
+
+def play_audio(path):
+    """Reproduce un archivo de audio ya sintetizado (bloquea hasta terminar)"""
+    system = platform.system()
+    if system == "Darwin":
+        subprocess.run(["afplay", path], timeout=60)
+    elif system == "Windows":
+        import winsound
+        winsound.PlaySound(path, winsound.SND_FILENAME)
+    else:
+        subprocess.run(["aplay", "-q", path], timeout=60)
+
+def speak_message(message, repetitions=1):
+    """Lee el mensaje en voz alta con máxima calidad (audio cacheado)"""
+    try:
+        engine, path = synthesize_cached(message)
+        if not path:
+            log.error("[❌] No hay TTS disponible en %s", platform.system())
+            return
+        for i in range(repetitions):
+            play_audio(path)
+            log.info("[🔊] %s: '%s' (%s/%s)", engine, message, i+1, repetitions)
     
     except Exception as e:
-        log_message(f"[❌] Error TTS: {e}")
+        log.error("[❌] Error TTS: %s", e)
+
+# Prioridades de voz: menor valor = se atiende antes
+PRIORITIES = {"alta": 0, "normal": 1}
+
+# Ventana en la que una notificación idéntica no se vuelve a mostrar
+NOTIFY_COALESCE_SECONDS = 10
+
+NOTIFY_WORKERS = 3
 
-def process_msg_file(filepath):
-    """Procesa un archivo .msg y lo elimina"""
+def parse_msg_file(filepath):
+    """
+    Lee un .msg y lo elimina. Formatos:
+      repeticiones|mensaje
+      repeticiones|prioridad|mensaje   (prioridad: alta | normal)
+    Devuelve (repeticiones, prioridad, mensaje, recibido_en) o None si no se
+    pudo leer. recibido_en (epoch) sale del sidecar o, si no hay, del mtime.
+    """
+    log.info("[📬] Archivo .msg detectado: %s", os.path.basename(filepath))
     try:
-        log_message(f"[📬] Archivo .msg detectado: {os.path.basename(filepath)}")
-        
-        # Leer contenido
+        received_at = (filemeta.read_sidecar(filepath) or {}).get("received_at") or os.path.getmtime(filepath)
         with open(filepath, "r", encoding="utf-8") as f:
             content = f.read().strip()
-        
-        log_message(f"[DEBUG] Contenido bruto del archivo: '{content}'")
-        
-        # Parsear formato: repeticiones|mensaje
-        parts = content.split("|", 1)
-        log_message(f"[DEBUG] Partes después de split: {parts}")
-        
-        if len(parts) == 2:
-            try:
-                repetitions = int(parts[0].strip())
-                message = parts[1].strip()
-            except ValueError as e:
-                log_message(f"[ERROR] No se pudo parsear repeticiones: {e}")
-                repetitions = 1
-                message = content
-        else:
-            repetitions = 1
-            message = content
-        
-        log_message(f"[📝] Parseo final: {repetitions} repeticiones x '{message}'")
-        
-        # Mostrar notificación
-        show_notification("🚨 ALERTA URGENTE", message)
-        
-        # Reproducir en voz alta
-        speak_message(message, repetitions)
-        
-        # Eliminar archivo
+    except Exception as e:
+        log.error("[❌] Error leyendo %s: %s", filepath, e)
+        return None
+    
+    try:
+        os.remove(filepath)
+        filemeta.remove_sidecar(filepath)
+        log.info("[🗑️] Archivo eliminado")
+    except Exception as e:
+        log.error("[!] Error eliminando archivo: %s", e)
+    
+    repetitions = 1
+    priority = "normal"
+    message = content
+    parts = content.split("|", 2)
+    if len(parts) >= 2:
         try:
-            os.remove(filepath)
-            log_message(f"[🗑️] Archivo eliminado")
-        except Exception as e:
-            log_message(f"[!] Error eliminando archivo: {e}")
+            repetitions = max(1, min(int(parts[0].strip()), 10))
+            message = content.split("|", 1)[1].strip()
+            if len(parts) == 3 and parts[1].strip().lower() in PRIORITIES:
+                priority = parts[1].strip().lower()
+                message = parts[2].strip()
+        except ValueError as e:
+            log.error("[ERROR] No se pudo parsear repeticiones: %s", e)
+    
+    log.info("[📝] Parseo final: %s repeticiones x '%s' (prioridad %s)", repetitions, message, priority)
+    return repetitions, priority, message, received_at
+
+class AlertJob:
+    """Alerta pendiente de voz; `remaining` crece si llega un duplicado"""
+    def __init__(self, message, repetitions, priority):
+        self.message = message
+        self.remaining = repetitions
+        self.priority = priority
+        self.token = 0  # invalida entradas viejas del heap al re-encolar
+
+class AlertPipeline:
+    """
+    Detección → notificación → voz en hilos separados:
+    - las notificaciones (que bloquean ~5 s en macOS/Windows) corren en un
+      pool y se descartan si el mismo texto se mostró hace poco;
+    - la voz usa una cola con prioridad que se atiende de a UNA repetición:
+      tras cada repetición la alerta vuelve al final de su prioridad, así
+      una alerta nueva suena sin esperar las 10 repeticiones de otra;
+    - un mensaje idéntico a uno aún en cola se fusiona (se toma el máximo de
+      repeticiones y la prioridad más alta) en vez de encolarse dos veces.
+    Al mostrar cada notificación se reporta por el bus local (tópico
+    "alert_delivered") cuánto tardó desde que el .msg quedó en Descargas.
+    """
+    def __init__(self, bus=None):
+        self.bus = bus
+        self.notify_queue = queue.Queue()
+        self.speech_queue = queue.PriorityQueue()
+        self._lock = threading.Lock()
+        self._jobs = {}          # mensaje → AlertJob en cola o sonando
+        self._last_notified = {}
+        self._seq = itertools.count()
+    
+    def start(self):
+        for i in range(NOTIFY_WORKERS):
+            threading.Thread(target=self._notify_worker, name=f"notify-{i}", daemon=True).start()
+        threading.Thread(target=self._speech_worker, name="speech", daemon=True).start()
+        return self
     
+    def submit(self, message, repetitions=1, priority="normal", received_at=None):
+        """Encola una alerta; nunca bloquea al hilo de detección"""
+        now = time.monotonic()
+        with self._lock:
+            if len(self._last_notified) > 100:
+                self._last_notified = {m: t for m, t in self._last_notified.items()
+                                       if now - t <= NOTIFY_COALESCE_SECONDS}
+            last = self._last_notified.get(message)
+            if last is None or now - last > NOTIFY_COALESCE_SECONDS:
+                self._last_notified[message] = now
+                self.notify_queue.put((message, priority, received_at))
+            else:
+                log.info("[🔁] Notificación duplicada omitida: '%s'", message)
+            
+            job = self._jobs.get(message)
+            if job is not None:
+                job.remaining = max(job.remaining, repetitions)
+                if PRIORITIES[priority] < PRIORITIES[job.priority]:
+                    job.priority = priority
+                    self._enqueue(job)
+                log.info("[🔁] Alerta fusionada con una pendiente: '%s' (%s restantes)", message, job.remaining)
+                return
+            job = AlertJob(message, repetitions, priority)
+            self._jobs[message] = job
+            self._enqueue(job)
+    
+    def _enqueue(self, job):
+        """Llamar con self._lock tomado"""
+        job.token += 1
+        self.speech_queue.put((PRIORITIES[job.priority], next(self._seq), job.token, job))
+    
+    def _notify_worker(self):
+        while True:
+            message, priority, received_at = self.notify_queue.get()
+            if self.bus is not None and received_at:
+                latency = max(0.0, time.time() - received_at)
+                self.bus.publish("alert_delivered", {"latency": latency, "priority": priority})
+            show_notification("🚨 ALERTA URGENTE", message)
+    
+    def _speech_worker(self):
+        while True:
+            _, _, token, job = self.speech_queue.get()
+            with self._lock:
+                if token != job.token or job.remaining <= 0:
+                    continue  # entrada reemplazada al cambiar de prioridad
+                job.remaining -= 1
+            
+            speak_message(job.message, 1)
+            
+            with self._lock:
+                if job.remaining > 0:
+                    self._enqueue(job)
+                else:
+                    self._jobs.pop(job.message, None)
+
+def process_msg_file(filepath, pipeline):
+    """Parsea un archivo .msg, lo elimina y entrega la alerta al pipeline"""
+    try:
+        parsed = parse_msg_file(filepath)
+        if parsed:
+            repetitions, priority, message, received_at = parsed
+            pipeline.submit(message, repetitions, priority, received_at)
     except Exception as e:
-        log_message(f"[❌] Error procesando: {e}")
+        log.error("[❌] Error procesando: %s", e)
 
 def monitor_downloads():
-    """Monitorea la carpeta Descargas por NUEVOS archivos .msg"""
+    """
+    Monitorea la carpeta Descargas por NUEVOS archivos .msg.
+    El receptor escribe en `.<nombre>.partial` (ignorado por el filtro) y lo
+    renombra al terminar, así que IN_MOVED_TO solo llega con el .msg
+    completo; IN_CLOSE_WRITE cubre archivos copiados por otros medios.
+    Sin inotify, DirWatcher compara snapshots y avisa cuando el archivo
+    deja de crecer.
+    """
     downloads_path = get_downloads_folder()
-    previous_files = set()
+    pending = queue.Queue()
+    bus = localbus.BusClient(localbus.default_socket_path(downloads_path))
+    pipeline = AlertPipeline(bus).start()
     
-    log_message(f"[*] Monitor iniciado en: {downloads_path}")
-    log_message(f"[*] Escuchando archivos .msg nuevos...")
+    def on_event(kind, filename):
+        if kind in (CLOSED, MOVED_IN):
+            pending.put(os.path.join(downloads_path, filename))
     
-    # Obtener archivos existentes al iniciar (no procesarlos)
-    try:
-        for filename in os.listdir(downloads_path):
-            if filename.endswith(".msg"):
-                previous_files.add(filename)
-        log_message(f"[*] Ignorando {len(previous_files)} archivos .msg existentes")
-    except:
-        pass
+    log.info("[*] Monitor iniciado en: %s", downloads_path)
+    
+    # Los .msg que ya existían al iniciar no generan eventos: se ignoran
+    watcher = DirWatcher(
+        downloads_path,
+        on_event,
+        mask=IN_CLOSE_WRITE | IN_MOVED_TO,
+        poll_interval=1.0,
+        name_filter=lambda name: name.endswith(".msg"),
+    ).start()
+    log.info("[*] Escuchando archivos .msg nuevos (%s)...", watcher.backend)
+    
+    # Bus local (event-bus.py): el receptor avisa apenas publica el archivo.
+    # El watcher queda de respaldo; un .msg duplicado ya no existe al 2º aviso.
+    def on_bus_event(topic, data):
+        name = os.path.basename(data.get("name", ""))
+        if name.endswith(".msg"):
+            pending.put(os.path.join(downloads_path, name))
+    
+    if bus.subscribe(["file_committed"], on_bus_event):
+        log.info("[*] Suscrito al bus local de eventos")
     
     while True:
         try:
-            # Buscar SOLO archivos nuevos
-            current_files = set()
-            for filename in os.listdir(downloads_path):
-                if filename.endswith(".msg"):
-                    current_files.add(filename)
-            
-            # Detectar archivos NUEVOS (que no estaban antes)
-            new_files = current_files - previous_files
-            
-            for filename in new_files:
-                filepath = os.path.join(downloads_path, filename)
-                
-                # Esperar a que se complete la escritura
-                time.sleep(1)
-                
-                if os.path.exists(filepath):
-                    process_msg_file(filepath)
-            
-            previous_files = current_files
-            time.sleep(1)  # Revisar cada segundo
-        
+            filepath = pending.get()
+            # Un mismo .msg puede cerrarse varias veces; tras procesarlo ya no existe
+            if os.path.exists(filepath):
+                process_msg_file(filepath, pipeline)
         except Exception as e:
-            log_message(f"[⚠️] Error: {e}")
-            time.sleep(5)
+            log.error("[⚠️] Error: %s", e)
 
 if __name__ == "__main__":
     # Limpiar log anterior
@@ -247,10 +463,11 @@ if __name__ == "__main__":
         os.remove("/tmp/msg-monitor.log")
     except:
         pass
+    logs.setup(logfile="/tmp/msg-monitor.log")
     
-    log_message("=" * 60)
-    log_message("MONITOR DE ARCHIVOS .MSG INICIADO")
-    log_message("=" * 60)
+    log.info("%s", "=" * 60)
+    log.info("MONITOR DE ARCHIVOS .MSG INICIADO")
+    log.info("%s", "=" * 60)
     
     monitor_downloads()
 
@@ -224,12 +224,17 @@ echo.
 echo [*] Step 6: Starting monitors...
 
 taskkill /F /FI "WINDOWTITLE eq *Monitor*" 2>nul
+taskkill /F /FI "WINDOWTITLE eq Event Bus*" 2>nul
 timeout /t 1
 
 start "Tailscale Monitor" /min python "%SCRIPT_DIR%\tailscale-monitor.py"
 timeout /t 1
 start "Tailscale API" /min python "%SCRIPT_DIR%\tailscale-api.py"
 timeout /t 1
+REM Bus de eventos local (receptores -> monitores). Sin sockets Unix en este
+REM Python termina solo y los monitores siguen con DirWatcher.
+start "Event Bus" /min python "%SCRIPT_DIR%\event-bus.py"
+timeout /t 1
 start "Monitor de Alertas" /min python "%SCRIPT_DIR%\msg-monitor.py"
 timeout /t 1
 start "Monitor de Videos" /min python "%SCRIPT_DIR%\video-monitor.py"
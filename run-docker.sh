@@ -378,6 +378,20 @@ TAILSCALE_API_PID=$!
 echo "✅ Servicio iniciado (PID: $TAILSCALE_API_PID)"
 sleep 1  # Dar tiempo a que inicie
 
+# Iniciar el bus de eventos local (receptores → monitores)
+echo ""
+echo "Iniciando bus de eventos local..."
+
+# Matar proceso viejo del bus si existe
+pkill -f "event-bus.py" 2>/dev/null || true
+sleep 1
+
+# Iniciar nuevo bus
+python3 "$SCRIPT_DIR/event-bus.py" > /tmp/event-bus.log 2>&1 &
+EVENT_BUS_PID=$!
+echo "✅ Bus de eventos iniciado (PID: $EVENT_BUS_PID)"
+sleep 1  # Dar tiempo a que inicie
+
 # Iniciar el monitor de alertas .msg
 echo ""
 echo "Iniciando monitor de alertas .msg..."
@@ -0,0 +1,410 @@
+"""
+Control de admisión en los receptores: tamaño máximo, espacio libre,
+cuotas por emisor y retención de videos ya reproducidos.
+
+Antes de aceptar un archivo se compara el tamaño anunciado (header
+quic-file/2, manifest de un lote, Content-Length en HTTP) con:
+- QUIC_MAX_UPLOAD: tamaño máximo de un archivo (default 20 GiB, la
+  ventana de datos del servidor QUIC);
+- el espacio libre en Descargas, menos QUIC_MIN_FREE (reserva, default
+  1 GiB) y lo ya reservado por recepciones en curso;
+- QUIC_SENDER_QUOTA: bytes por emisor cada QUIC_QUOTA_WINDOW segundos
+  (default sin cuota; ventana de un día).
+
+Si falta espacio, antes de rechazar se cuentan los videos ya reproducidos
+(`.PLAYED_` en el nombre o sidecar con played_at): si alcanzan, se admite y
+se borran del más viejo al más nuevo. admit() corre en el event loop de
+QUIC y no recorre el disco (un statvfs y una transacción corta del
+ledger): los reproducidos los escanea y los borra un hilo de
+mantenimiento (start()), que reescanea cada
+PLAYED_RESCAN_INTERVAL. Con QUIC_RETENTION_DAYS el mismo hilo borra los
+reproducidos más viejos que eso cada RETENTION_SWEEP_INTERVAL.
+
+El rechazo viaja por el protocolo (ACK con estado "rechazado", HTTP
+413 / 429 / 507) para que el emisor salte este peer sin probar los otros
+transportes. Si el tamaño no se conoce (emisor legado, HTTP/3 sin
+Content-Length), Ticket.grow() lo controla a medida que llegan los datos.
+
+Con el supervisor (QUIC_SUPERVISE / QUIC_WORKERS) Flask y cada worker QUIC
+admiten en su proceso, pero contra el mismo ledger (QUIC_ADMISSION_DB, ver
+AdmissionController): una cuota o el espacio libre no se multiplican por
+la cantidad de procesos.
+"""
+import os
+import time
+import queue
+import shutil
+import sqlite3
+import logging
+import threading
+import contextlib
+
+from . import filemeta
+from .video_index import VIDEO_EXTENSIONS
+
+log = logging.getLogger("envio.admission")
+
+GiB = 1024 ** 3
+
+MAX_UPLOAD = int(os.environ.get("QUIC_MAX_UPLOAD", 20 * GiB))
+MIN_FREE = int(os.environ.get("QUIC_MIN_FREE", GiB))
+SENDER_QUOTA = int(os.environ.get("QUIC_SENDER_QUOTA", 0))  # 0 = sin cuota
+QUOTA_WINDOW = float(os.environ.get("QUIC_QUOTA_WINDOW", 24 * 3600))
+RETENTION_DAYS = float(os.environ.get("QUIC_RETENTION_DAYS", 0))  # 0 = sin barrido por edad
+RETENTION_SWEEP_INTERVAL = 3600.0
+# Reescaneo de los reproducidos (el monitor los marca mientras tanto)
+PLAYED_RESCAN_INTERVAL = 60.0
+
+# Recepciones sin tamaño anunciado reservan de a este bloque
+GROW_STEP = 64 * 1024 * 1024
+
+# Códigos HTTP (y motivo en el ACK de quic-file/2)
+TOO_LARGE = 413
+OVER_QUOTA = 429
+NO_SPACE = 507
+
+
+class Rejected(Exception):
+    """El receptor no acepta el archivo: no reintentar por otro transporte"""
+
+    def __init__(self, reason, status=NO_SPACE):
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+
+
+class Ticket:
+    """Reserva de espacio (y cuota) de una recepción en curso"""
+
+    def __init__(self, controller, directory, sender, reserved, row):
+        self._controller = controller
+        self.directory = directory
+        self.sender = sender
+        self.reserved = reserved
+        self.received = 0
+        self._row = row  # fila en reservations
+        self._closed = False
+
+    def grow(self, nbytes):
+        """Cuenta bytes recibidos; lanza Rejected si se pasan de lo admitido"""
+        self.received += nbytes
+        if self.received > self.reserved:
+            self._controller._extend(self, max(GROW_STEP, self.received - self.reserved))
+
+    def commit(self):
+        """Recepción publicada: lo recibido cuenta para la cuota del emisor"""
+        if not self._closed:
+            self._closed = True
+            self._controller._close(self, used=max(self.received, 0))
+
+    def release(self):
+        """Recepción descartada: se libera la reserva sin consumir cuota"""
+        if not self._closed:
+            self._closed = True
+            self._controller._close(self, used=0)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reservations (id INTEGER PRIMARY KEY AUTOINCREMENT, pid INTEGER, sender TEXT, bytes INTEGER);
+CREATE TABLE IF NOT EXISTS usage (sender TEXT PRIMARY KEY, start REAL, used INTEGER);
+CREATE TABLE IF NOT EXISTS played (directory TEXT PRIMARY KEY, evictable INTEGER);
+CREATE TABLE IF NOT EXISTS evicting (id INTEGER PRIMARY KEY AUTOINCREMENT, pid INTEGER, directory TEXT, bytes INTEGER);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER);
+"""
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class AdmissionController:
+    """
+    Reservas, uso por emisor, reproducidos por borrar y contadores viven en
+    un ledger SQLite: en memoria con un solo proceso, o en el archivo
+    QUIC_ADMISSION_DB que comparten Flask y los workers QUIC del supervisor
+    (transacciones BEGIN IMMEDIATE), así las cuotas y el espacio libre se
+    cuentan una sola vez. Las filas de procesos muertos se descartan.
+    """
+
+    def __init__(self, max_upload=MAX_UPLOAD, min_free=MIN_FREE, sender_quota=SENDER_QUOTA,
+                 quota_window=QUOTA_WINDOW, retention_days=RETENTION_DAYS, path=None):
+        self.max_upload = max_upload
+        self.min_free = min_free
+        self.sender_quota = sender_quota
+        self.quota_window = quota_window
+        self.retention_days = retention_days
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+        self._directories = set()
+        self._requests = queue.Queue()
+        self._thread = None
+
+    def _open(self):
+        """Conexión al ledger (con el lock tomado); se abre en el proceso que la usa"""
+        if self._db is not None and self._pid == os.getpid():
+            return self._db
+        path = self.path or os.environ.get("QUIC_ADMISSION_DB") or ":memory:"
+        db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        if path != ":memory:":
+            db.execute("PRAGMA journal_mode=WAL")
+        # Estado efímero: se reconstruye al arrancar, no hace falta fsync
+        db.execute("PRAGMA synchronous=OFF")
+        db.executescript(_SCHEMA)
+        self._db, self._pid = db, os.getpid()
+        with self._transaction() as db:
+            self._forget_dead(db)
+        return db
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Transacción del ledger con el lock tomado; un Rejected igual guarda su contador"""
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except Rejected:
+            db.execute("COMMIT")
+            raise
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    @contextlib.contextmanager
+    def _ledger(self):
+        with self._lock:
+            self._open()
+            with self._transaction() as db:
+                yield db
+
+    def _forget_dead(self, db):
+        """Reservas y desalojos pendientes de procesos que ya no existen (reinicios)"""
+        for table in ("reservations", "evicting"):
+            for (pid,) in db.execute(f"SELECT DISTINCT pid FROM {table}").fetchall():
+                if pid != self._pid and not _alive(pid):
+                    db.execute(f"DELETE FROM {table} WHERE pid = ?", (pid,))
+
+    def start(self, directory):
+        """Arranca el hilo de mantenimiento (una vez) y el escaneo de `directory`"""
+        with self._lock:
+            known = directory in self._directories
+            self._directories.add(directory)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._maintain, name="admission", daemon=True)
+                self._thread.start()
+        if not known:
+            self._requests.put((directory, 0, None))
+        return self
+
+    def admit(self, directory, sender, size):
+        """Ticket para recibir `size` bytes (None = desconocido) o Rejected"""
+        self.start(directory)
+        reserve = GROW_STEP if size is None else size
+        with self._ledger() as db:
+            evict = self._check(db, directory, sender, reserve, size, evict=True)
+            row = db.execute("INSERT INTO reservations (pid, sender, bytes) VALUES (?, ?, ?)",
+                             (self._pid, sender, reserve)).lastrowid
+        self._request_eviction(directory, evict)
+        return Ticket(self, directory, sender, reserve, row)
+
+    def check(self, directory, sender, total, largest=None):
+        """
+        Solo verifica, sin reservar: un lote de `total` bytes cuyo archivo
+        más grande tiene `largest`. Cada archivo se admite después por separado.
+        """
+        self.start(directory)
+        with self._ledger() as db:
+            self._check(db, directory, sender, total, largest)
+
+    def _check(self, db, directory, sender, nbytes, announced=None, evict=False):
+        """
+        Lanza Rejected si no se admite. Con `evict` descuenta de los
+        reproducidos lo que falta y devuelve (bytes a borrar, fila en
+        evicting), o None si no hace falta borrar.
+        """
+        if announced is not None and announced > self.max_upload:
+            self._reject(db, f"archivo demasiado grande ({announced} > {self.max_upload} bytes)", TOO_LARGE)
+        if self.sender_quota:
+            window = db.execute("SELECT start, used FROM usage WHERE sender = ?", (sender,)).fetchone()
+            used = window[1] if window and time.time() - window[0] < self.quota_window else 0
+            pending = db.execute("SELECT COALESCE(SUM(bytes), 0) FROM reservations WHERE sender = ?",
+                                 (sender,)).fetchone()[0]
+            if used + pending + nbytes > self.sender_quota:
+                self._reject(db, f"cuota del emisor agotada ({self.sender_quota} bytes por "
+                                 f"{self.quota_window / 3600:.0f} h)", OVER_QUOTA)
+        available = self._available(db, directory)
+        if available >= nbytes:
+            return None
+        need = nbytes - available
+        if need > self._evictable(db, directory):
+            self._reject(db, f"sin espacio en disco (libres {max(available, 0)} bytes, se piden {nbytes})", NO_SPACE)
+        if not evict:
+            return None
+        # Quedan comprometidos: el hilo los borra y el próximo escaneo ya no los cuenta
+        db.execute("UPDATE played SET evictable = evictable - ? WHERE directory = ?", (need, directory))
+        row = db.execute("INSERT INTO evicting (pid, directory, bytes) VALUES (?, ?, ?)",
+                         (self._pid, directory, need)).lastrowid
+        return need, row
+
+    def _available(self, db, directory):
+        try:
+            free = shutil.disk_usage(directory).free
+        except OSError:
+            return 0
+        reserved = db.execute("SELECT COALESCE(SUM(bytes), 0) FROM reservations").fetchone()[0]
+        return free - self.min_free - reserved
+
+    def _evictable(self, db, directory):
+        row = db.execute("SELECT evictable FROM played WHERE directory = ?", (directory,)).fetchone()
+        return row[0] if row else 0
+
+    def _count(self, db, name, n=1):
+        db.execute("INSERT INTO counters (name, value) VALUES (?, ?) "
+                   "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, n))
+
+    def _reject(self, db, reason, status):
+        self._count(db, f"rejected_{status}")
+        raise Rejected(reason, status)
+
+    def _extend(self, ticket, nbytes):
+        with self._ledger() as db:
+            if ticket.received > self.max_upload:
+                self._reject(db, f"archivo demasiado grande (> {self.max_upload} bytes)", TOO_LARGE)
+            evict = self._check(db, ticket.directory, ticket.sender, nbytes, evict=True)
+            db.execute("UPDATE reservations SET bytes = bytes + ? WHERE id = ?", (nbytes, ticket._row))
+            ticket.reserved += nbytes
+        self._request_eviction(ticket.directory, evict)
+
+    def _close(self, ticket, used):
+        with self._ledger() as db:
+            db.execute("DELETE FROM reservations WHERE id = ?", (ticket._row,))
+            if used and self.sender_quota:
+                now = time.time()
+                window = db.execute("SELECT start FROM usage WHERE sender = ?", (ticket.sender,)).fetchone()
+                if window is None or now - window[0] >= self.quota_window:
+                    db.execute("INSERT OR REPLACE INTO usage (sender, start, used) VALUES (?, ?, ?)",
+                               (ticket.sender, now, used))
+                else:
+                    db.execute("UPDATE usage SET used = used + ? WHERE sender = ?", (used, ticket.sender))
+
+    def _request_eviction(self, directory, evict):
+        if evict:
+            need, row = evict
+            self._requests.put((directory, need, row))
+
+    def _maintain(self):
+        """
+        Hilo de mantenimiento: borra lo que pidió admit(), barre por edad y
+        reescanea los reproducidos. Es el único que recorre Descargas.
+        """
+        last_sweep = time.monotonic()
+        while True:
+            try:
+                directory, need, row = self._requests.get(timeout=PLAYED_RESCAN_INTERVAL)
+                directories = [directory]
+            except queue.Empty:
+                need = 0
+                with self._lock:
+                    directories = list(self._directories)
+                with self._ledger() as db:
+                    self._forget_dead(db)
+            if need:
+                freed = evict_played(directory, need=need)
+                with self._ledger() as db:
+                    db.execute("DELETE FROM evicting WHERE id = ?", (row,))
+                    self._count(db, "evicted_bytes", freed)
+                if freed < need:
+                    log.warning("[ADM] Se pidieron %s bytes de reproducidos y se liberaron %s", need, freed)
+            if self.retention_days and time.monotonic() - last_sweep >= RETENTION_SWEEP_INTERVAL:
+                last_sweep = time.monotonic()
+                with self._lock:
+                    directories = list(self._directories)
+                for swept in directories:
+                    freed = evict_played(swept, max_age=self.retention_days * 86400)
+                    with self._ledger() as db:
+                        self._count(db, "evicted_bytes", freed)
+            for scanned in directories:
+                total = sum(size for _, _, size in played_videos(scanned))
+                with self._ledger() as db:
+                    evicting = db.execute("SELECT COALESCE(SUM(bytes), 0) FROM evicting WHERE directory = ?",
+                                          (scanned,)).fetchone()[0]
+                    db.execute("INSERT OR REPLACE INTO played (directory, evictable) VALUES (?, ?)",
+                               (scanned, max(total - evicting, 0)))
+
+    def stats(self, directory):
+        with self._ledger() as db:
+            counters = dict(db.execute("SELECT name, value FROM counters").fetchall())
+            return {
+                "available": self._available(db, directory),
+                "reserved": db.execute("SELECT COALESCE(SUM(bytes), 0) FROM reservations").fetchone()[0],
+                "max_upload": self.max_upload,
+                "min_free": self.min_free,
+                "sender_quota": self.sender_quota or None,
+                "usage": dict(db.execute("SELECT sender, used FROM usage").fetchall()),
+                "rejections": {str(code): counters.get(f"rejected_{code}", 0)
+                               for code in (TOO_LARGE, OVER_QUOTA, NO_SPACE)},
+                "evictable": self._evictable(db, directory),
+                "evicted_bytes": counters.get("evicted_bytes", 0),
+                "ledger": self.path or os.environ.get("QUIC_ADMISSION_DB") or "memoria",
+            }
+
+
+def played_videos(directory):
+    """[(reproducido_en, ruta, tamaño)] de los videos ya reproducidos, más viejos primero"""
+    found = []
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return found
+    for entry in entries:
+        name = entry.name
+        # Sin los flags legados: video.mp4.PLAYED_14:30_monday es un .mp4
+        legacy = filemeta.from_legacy_name(name)
+        if name.startswith(".") or not legacy["name"].lower().endswith(tuple(VIDEO_EXTENSIONS)):
+            continue
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        if not entry.is_file():
+            continue
+        if legacy.get("played"):
+            found.append((st.st_mtime, entry.path, st.st_size))
+            continue
+        played_at = (filemeta.read_sidecar(entry.path) or {}).get("played_at")
+        if played_at:
+            found.append((float(played_at), entry.path, st.st_size))
+    found.sort()
+    return found
+
+
+def evict_played(directory, need=None, max_age=None):
+    """
+    Borra videos reproducidos: los más viejos que `max_age` segundos, o del
+    más viejo al más nuevo hasta liberar `need` bytes. Devuelve bytes liberados.
+    """
+    freed = 0
+    now = time.time()
+    for played_at, path, size in played_videos(directory):
+        if max_age is not None and now - played_at < max_age:
+            break
+        if need is not None and freed >= need:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        filemeta.remove_sidecar(path)
+        freed += size
+    return freed
+
+
+controller = AdmissionController()
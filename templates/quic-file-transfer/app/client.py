@@ -7,14 +7,27 @@ import requests
 import time
 import uuid
 import io
-from flask import Flask, request, redirect, render_template, flash, jsonify
-from aioquic.asyncio import connect, serve, QuicConnectionProtocol
+import queue
+import hashlib
+import shutil
+import tempfile
+from flask import Flask, Response, request, redirect, render_template, flash, jsonify, stream_with_context
+from aioquic.asyncio import QuicConnectionProtocol
 from aioquic.quic.configuration import QuicConfiguration
-from aioquic.quic.events import StreamDataReceived, StreamReset
+from aioquic.quic.events import StreamDataReceived, StreamReset, ConnectionTerminated, ProtocolNegotiated, HandshakeCompleted
 from aioquic.h3.connection import H3Connection
 from aioquic.h3.events import HeadersReceived, DataReceived
 import socket
 
+from .video_index import VideoIndex, VIDEO_EXTENSIONS
+from .events import bus, format_sse, TransferTracker
+from . import handoff, localbus, filemeta, qos, tuning, metrics, logs, tracing, admission, sharding, loops, udpio, resumption
+
+logs.setup()
+log = logs.get_logger("client")
+# uvloop si está disponible (QUIC_LOOP): aplica al servidor y a cada envío
+loops.install()
+
 # Establecer umask para que todos los archivos se creen con permisos públicos (666)
 os.umask(0o000)
 
@@ -42,48 +55,213 @@ def get_downloads_folder():
     os.makedirs(descargas_path, exist_ok=True)
     return descargas_path
 
+_local_bus = None
+
+def get_local_bus():
+    """Cliente del bus local (broker: event-bus.py en el host)"""
+    global _local_bus
+    if _local_bus is None:
+        _local_bus = localbus.BusClient(localbus.default_socket_path(get_downloads_folder()))
+    return _local_bus
+
+def commit_received(tmp_path, full_path, meta, fileobj=None):
+    """
+    Guarda el sidecar con la metadata y publica el archivo (rename atómico).
+    El sidecar va primero: cuando el monitor ve el archivo, ya tiene su
+    metadata.
+    """
+    meta = dict(meta, name=os.path.basename(full_path), received_at=time.time())
+    filemeta.write_sidecar(full_path, meta)
+    try:
+        with tracing.span("fsync_commit"):
+            handoff.commit(tmp_path, full_path, fileobj)
+    except Exception:
+        filemeta.remove_sidecar(full_path)
+        raise
+    return meta
+
+def announce_committed(meta, transport):
+    """
+    Avisa que un archivo quedó completo en Descargas: a la web por SSE y a
+    los monitores por el bus local (si el broker no corre, lo verán por
+    DirWatcher igualmente).
+    """
+    data = dict(meta, transport=transport)
+    bus.publish("file_committed", **data)
+    # Desde el event loop de QUIC: sin esperar al socket del broker
+    get_local_bus().publish_nowait("file_committed", data)
+
+def _run_traced(trace, fn, *args):
+    """
+    fn(*args) en el pool de hilos del loop con `trace` activa (run_in_executor
+    no copia el contexto). Para fsync y hashing que no deben frenar el loop.
+    """
+    def run():
+        with tracing.activate(trace):
+            return fn(*args)
+    return asyncio.get_event_loop().run_in_executor(None, run)
+
 # ...existing code...
 
-class FileServerProtocol(QuicConnectionProtocol):
+class FileServerProtocol(loops.PacedTimers, QuicConnectionProtocol):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._files = {}
         self._names = {}
         self._received = {}
+        self._trackers = {}
+        self._meta = {}
+        self._hashers = {}
+        self._paths = {}
+        self._rejected = set()
+        self._tickets = {}
+        # Header todavía incompleto por stream
+        self._tmp = {}
+        # Lotes: stream del manifest en curso y carpeta destino por id de lote
+        self._manifests = {}
+        self._batches = {}
+        # QUIC_TRACE: traza por stream e instantes del handshake de la conexión
+        self._traces = {}
+        self._created = time.perf_counter()
+        self._handshake_done = None
+        # Commits en el pool de hilos: referencia hasta que terminan
+        self._tasks = set()
         
         # ✅ HTTP/3 support
         self._is_http3 = False
         self._h3_connection = None
         self._h3_streams = {}
         self._http3_responses = {}
-        
-        # Detectar protocolo por ALPN negotiated
+        self._alpn = None
+    
+    def _on_protocol_negotiated(self, alpn):
+        """Elegir el manejador según el ALPN negociado con ESTE peer"""
+        self._alpn = alpn
+        if alpn == "h3":
+            self._is_http3 = True
+            self._h3_connection = H3Connection(self._quic)
+            log.info("[HTTP/3] ✅ Protocolo HTTP/3 detectado")
+        else:
+            log.info("[QUIC-FILE] 📦 Protocolo binario detectado (%s)", alpn)
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _peer_ip(self):
+        """IP del emisor según el camino de red activo de la conexión"""
         try:
-            alpn = self._quic_connection.configuration.alpn_protocols
-            if "h3" in alpn or (hasattr(self._quic_connection, 'alpn_protocol') and self._quic_connection.alpn_protocol == "h3"):
-                self._is_http3 = True
-                self._h3_connection = H3Connection(self._quic_connection)
-                print(f"[HTTP/3] ✅ Protocolo HTTP/3 detectado")
-            else:
-                print(f"[QUIC-FILE] 📦 Protocolo binario detectado")
-        except Exception as e:
-            print(f"[DEBUG] ALPN detection: {e}")
+            return self._quic._network_paths[0].addr[0]
+        except Exception:
+            return "?"
 
     def quic_event_received(self, event):
+        if not tracing.ENABLED:
+            self._dispatch_event(event)
+            return
+        started = time.perf_counter()
+        trace = self._traces.get(getattr(event, "stream_id", None))
+        try:
+            self._dispatch_event(event)
+        finally:
+            trace = trace or self._traces.get(getattr(event, "stream_id", None))
+            if trace is not None:
+                trace.add("handler_seconds", time.perf_counter() - started)
+                trace.add("events")
+
+    def _start_trace(self, stream_id, name):
+        """Traza de una recepción (QUIC_TRACE); incluye el handshake de la conexión"""
+        trace = tracing.start("receive", name, self._peer_ip())
+        if trace is not None:
+            self._traces[stream_id] = trace
+            if self._handshake_done:
+                trace.add_span("handshake", self._created, self._handshake_done, alpn=self._alpn)
+            trace.mark("first_byte")
+        return trace
+
+    def _dispatch_event(self, event):
+        if isinstance(event, HandshakeCompleted):
+            self._handshake_done = time.perf_counter()
+            if resumption.record("server", event) == resumption.EARLY_DATA:
+                log.debug("[TLS] ⚡ %s reanudó con 0-RTT", self._peer_ip())
+            return
+        if isinstance(event, ProtocolNegotiated):
+            self._on_protocol_negotiated(event.alpn_protocol)
+            return
+        
+        if isinstance(event, ConnectionTerminated):
+            # Reservas de admisión de recepciones que no van a terminar
+            for stream_id in list(self._tickets):
+                if stream_id not in self._files:
+                    self._tickets.pop(stream_id).release()
+
         # ✅ Si es HTTP/3, manejar con H3Connection
         if self._is_http3 and self._h3_connection:
             try:
                 self._handle_http3_event(event)
             except Exception as e:
-                print(f"[HTTP/3] Error en handler: {e}")
-                import traceback
-                traceback.print_exc()
+                log.exception("[HTTP/3] Error en handler: %s", e)
             return
         
         # 📦 Si es protocolo binario, manejar normalmente
         if isinstance(event, StreamDataReceived):
             self._handle_binary_stream(event)
+        elif isinstance(event, StreamReset):
+            self._abort_binary_stream(event.stream_id, "stream reset")
+        elif isinstance(event, ConnectionTerminated):
+            for stream_id in list(self._files):
+                self._abort_binary_stream(stream_id, "conexión cerrada")
+    
+    def _send_ack(self, stream_id, ok, size, sha256=None, error=None, rejected=False):
+        """
+        ACK de aplicación tras el fsync (solo quic-file/2: el emisor legado
+        no lee el stream). Cierra nuestro lado del stream.
+        """
+        if self._alpn != filemeta.ALPN_V2:
+            return
+        try:
+            ack = filemeta.encode_ack(ok, size, sha256, error, rejected)
+            self._quic.send_stream_data(stream_id, ack, end_stream=True)
+            self.transmit()
+        except Exception as e:
+            log.warning("[QUIC-FILE] [-] No se pudo enviar ACK en stream %s: %s", stream_id, e)
     
+    def _abort_binary_stream(self, stream_id, reason):
+        """Descarta la recepción incompleta: el .partial nunca se publica"""
+        if self._tmp.pop(stream_id, None) is not None:
+            log.error("[QUIC-FILE] ❌ Header incompleto en stream %s (%s)", stream_id, reason)
+            self._send_ack(stream_id, False, 0, error=f"header incompleto ({reason})")
+        self._manifests.pop(stream_id, None)
+        self._rejected.discard(stream_id)
+        ticket = self._tickets.pop(stream_id, None)
+        if ticket is not None:
+            ticket.release()
+        f = self._files.pop(stream_id, None)
+        filename = self._names.pop(stream_id, None)
+        full_path = self._paths.pop(stream_id, None)
+        self._received.pop(stream_id, None)
+        self._meta.pop(stream_id, None)
+        self._hashers.pop(stream_id, None)
+        tracker = self._trackers.pop(stream_id, None)
+        if f is None:
+            return
+        f.close()
+        handoff.discard(handoff.partial_path(full_path))
+        log.error("[QUIC-FILE] ❌ Recepción abortada (%s): %s", reason, filename)
+        if tracker:
+            tracker.fail(reason)
+        trace = self._traces.pop(stream_id, None)
+        if trace is not None:
+            trace.finish("error")
+    
+    def _reject_binary_stream(self, stream_id, error, end_stream):
+        """Admisión denegada: ACK "rechazado" ya mismo y se ignora el resto del stream"""
+        log.warning("[QUIC-FILE] ⛔ Rechazado stream %s de %s: %s", stream_id, self._peer_ip(), error)
+        self._send_ack(stream_id, False, 0, error=error, rejected=True)
+        if not end_stream:
+            self._rejected.add(stream_id)
+
     def _handle_http3_event(self, event):
         """Procesar eventos HTTP/3"""
         if not isinstance(event, StreamDataReceived):
@@ -91,12 +269,13 @@ class FileServerProtocol(QuicConnectionProtocol):
             
         try:
             # Procesar bytes con H3Connection
-            for h3_event in self._h3_connection.receive_bytes(event.data):
+            for h3_event in self._h3_connection.handle_event(event):
                 if isinstance(h3_event, HeadersReceived):
                     stream_id = h3_event.stream_id
                     headers = {name.decode(): value.decode() for name, value in h3_event.headers}
                     
-                    print(f"[HTTP/3] 📨 Headers {stream_id}: {headers.get(':method')} {headers.get(':path')}")
+                    log.debug("[HTTP/3] 📨 Headers %s: %s %s", stream_id,
+                              headers.get(':method'), headers.get(':path'))
                     
                     if stream_id not in self._h3_streams:
                         self._h3_streams[stream_id] = {
@@ -104,9 +283,24 @@ class FileServerProtocol(QuicConnectionProtocol):
                             "body": b"",
                             "complete": False
                         }
+                        total = headers.get("content-length")
+                        self._trackers[stream_id] = TransferTracker(
+                            bus, "receive", self._peer_ip(), headers.get(":path"),
+                            total=int(total) if total and total.isdigit() else None,
+                            transport="http3",
+                        )
+                        tracing.link(self._start_trace(stream_id, headers.get(":path")),
+                                     self._trackers[stream_id].id)
+                        if headers.get(":method") == "POST" and headers.get(":path") == "/api/upload":
+                            self._admit_http3(stream_id, int(total) if total and total.isdigit() else None)
                         
                 elif isinstance(h3_event, DataReceived):
                     stream_id = h3_event.stream_id
+                    if self._h3_streams.get(stream_id, {}).get("rejected"):
+                        # Ya se respondió el rechazo: se descarta el body
+                        if h3_event.stream_ended:
+                            del self._h3_streams[stream_id]
+                        continue
                     if stream_id not in self._h3_streams:
                         self._h3_streams[stream_id] = {
                             "headers": {},
@@ -114,23 +308,63 @@ class FileServerProtocol(QuicConnectionProtocol):
                             "complete": False
                         }
                     
+                    ticket = self._tickets.get(stream_id)
+                    if ticket is not None:
+                        try:
+                            ticket.grow(len(h3_event.data))
+                        except admission.Rejected as e:
+                            self._reject_http3(stream_id, e)
+                            continue
                     self._h3_streams[stream_id]["body"] += h3_event.data
-                    print(f"[HTTP/3] 📥 Body data {stream_id}: {len(h3_event.data)} bytes")
+                    if stream_id in self._trackers:
+                        self._trackers[stream_id].update(len(h3_event.data))
+                    log.debug("[HTTP/3] 📥 Body data %s: %s bytes", stream_id, len(h3_event.data))
                     
                     # Si es fin del stream, procesar
-                    if getattr(h3_event, 'end_stream', False):
+                    if h3_event.stream_ended:
                         self._h3_streams[stream_id]["complete"] = True
                         self._process_http3_request(stream_id)
                         
         except Exception as e:
-            print(f"[HTTP/3] Error en _handle_http3_event: {e}")
+            log.error("[HTTP/3] Error en _handle_http3_event: %s", e)
     
+    def _admit_http3(self, stream_id, size):
+        """Admisión de un upload HTTP/3 con el Content-Length, antes de leer el body"""
+        try:
+            self._tickets[stream_id] = admission.controller.admit(get_downloads_folder(), self._peer_ip(), size)
+        except admission.Rejected as e:
+            self._reject_http3(stream_id, e)
+
+    def _reject_http3(self, stream_id, error):
+        """Responde el rechazo (413 / 429 / 507) sin esperar el resto del body"""
+        log.warning("[HTTP/3] ⛔ Upload rechazado de %s: %s", self._peer_ip(), error.reason)
+        ticket = self._tickets.pop(stream_id, None)
+        if ticket is not None:
+            ticket.release()
+        stream = self._h3_streams[stream_id]
+        stream["rejected"] = True
+        stream["body"] = b""
+        tracker = self._trackers.pop(stream_id, None)
+        if tracker:
+            tracker.fail(f"HTTP {error.status}")
+        trace = self._traces.pop(stream_id, None)
+        if trace is not None:
+            trace.finish("rejected")
+        body = json.dumps({"error": error.reason, "rejected": True}).encode()
+        self._send_http3_response(stream_id, error.status, body)
+
     def _process_http3_request(self, stream_id):
-        """Procesar request HTTP/3 completado"""
+        """Procesar request HTTP/3 completado (el guardado corre fuera del loop)"""
         if stream_id not in self._h3_streams:
             return
-        
-        stream_data = self._h3_streams[stream_id]
+        # Fuera de la conexión: ConnectionTerminated no debe liberar la
+        # reserva mientras se guarda
+        self._spawn(self._finish_http3_request(
+            stream_id, self._h3_streams.pop(stream_id), self._tickets.pop(stream_id, None),
+            self._trackers.pop(stream_id, None), self._traces.pop(stream_id, None),
+        ))
+
+    async def _finish_http3_request(self, stream_id, stream_data, ticket, tracker, trace):
         headers = stream_data["headers"]
         body = stream_data["body"]
         
@@ -138,22 +372,39 @@ class FileServerProtocol(QuicConnectionProtocol):
         path = headers.get(":path", "/")
         content_type = headers.get("content-type", "")
         
-        print(f"[HTTP/3] 🔄 Procesando {method} {path} ({len(body)} bytes)")
+        log.debug("[HTTP/3] 🔄 Procesando %s %s (%s bytes)", method, path, len(body))
         
         response_body = b""
         response_status = 404
+        if trace is not None:
+            trace.add_span("steady_state", trace.perf_start, time.perf_counter(), bytes=len(body))
         
         if method == "POST" and path == "/api/upload" and "multipart/form-data" in content_type:
-            response_status, response_body = self._parse_http3_multipart(body, content_type)
+            def parse():
+                with tracing.span("multipart_parse", bytes=len(body)):
+                    return self._parse_http3_multipart(body, content_type)
+            parse_started = time.monotonic()
+            response_status, response_body = await _run_traced(trace, parse)
+            metrics.upload_parse.observe(time.monotonic() - parse_started, transport="http3")
         else:
             response_status = 404
             response_body = b"Not Found"
+        if trace is not None:
+            trace.finish("ok" if response_status == 200 else f"HTTP {response_status}")
+        if ticket is not None:
+            if response_status == 200:
+                ticket.commit()
+            else:
+                ticket.release()
+        
+        if tracker:
+            if response_status == 200:
+                tracker.done(status=response_status)
+            else:
+                tracker.fail(f"HTTP {response_status}")
         
         # Enviar respuesta HTTP/3
         self._send_http3_response(stream_id, response_status, response_body)
-        
-        # Limpiar
-        del self._h3_streams[stream_id]
     
     def _parse_http3_multipart(self, body, content_type):
         """Parsear multipart/form-data desde HTTP/3"""
@@ -162,7 +413,7 @@ class FileServerProtocol(QuicConnectionProtocol):
             boundary_str = content_type.split("boundary=")[-1].strip()
             boundary = boundary_str.encode() if isinstance(boundary_str, str) else boundary_str
             
-            print(f"[HTTP/3] 🔍 Boundary: {boundary}")
+            log.debug("[HTTP/3] 🔍 Boundary: %s", boundary)
             
             # Parsear multipart manualmente
             parts = body.split(b"--" + boundary)
@@ -187,7 +438,7 @@ class FileServerProtocol(QuicConnectionProtocol):
                         key, val = line.split(b":", 1)
                         part_headers[key.decode().lower().strip()] = val.decode().strip()
                 
-                print(f"[HTTP/3] Part headers: {part_headers}")
+                log.debug("[HTTP/3] Part headers: %s", part_headers)
                 
                 # Si tiene Content-Disposition
                 if "content-disposition" in part_headers:
@@ -200,7 +451,7 @@ class FileServerProtocol(QuicConnectionProtocol):
                             end = cd.find('"', start)
                             filename = cd[start:end]
                             file_data = part_body.rstrip(b"\r\n")
-                            print(f"[HTTP/3] 📄 Archivo: {filename} ({len(file_data)} bytes)")
+                            log.debug("[HTTP/3] 📄 Archivo: %s (%s bytes)", filename, len(file_data))
                     else:
                         # Es un campo form
                         match_name = cd.find("name=")
@@ -210,28 +461,20 @@ class FileServerProtocol(QuicConnectionProtocol):
                             field_name = cd[start:end]
                             field_value = part_body.rstrip(b"\r\n").decode('utf-8', errors='ignore')
                             form_data[field_name] = field_value
-                            print(f"[HTTP/3] 📝 Form field: {field_name}={field_value}")
+                            log.debug("[HTTP/3] 📝 Form field: %s=%s", field_name, field_value)
             
             # Procesar archivo si existe
             if file_data and filename:
-                video_action = form_data.get("videoAction", "silent").lower()
-                video_time = form_data.get("videoTime", "")
-                video_days = form_data.get("videoDays", "")
-                
-                # Construir nombre final con flags
-                final_filename = filename
-                action_desc = ""
-                
-                filename_lower = filename.lower()
-                is_video = any(filename_lower.endswith(ext) for ext in {'.mp4', '.webm', '.mkv', '.avi', '.mov', '.flv', '.m4v', '.ts', '.m3u8'})
-                
-                if is_video:
-                    if video_action == "schedule" and video_time and video_days:
-                        final_filename = f"{filename}.SCHED_{video_time}_{video_days}"
-                        action_desc = f"programado para {video_time}"
-                    elif video_action == "silent":
-                        final_filename = f"{filename}.SILENT"
-                        action_desc = "silenciosamente"
+                # Metadata estructurada: campos del form (o flags legados en el nombre)
+                meta = filemeta.apply_form(
+                    filemeta.from_legacy_name(os.path.basename(filename)),
+                    form_data.get("videoAction"),
+                    form_data.get("videoTime", ""),
+                    form_data.get("videoDays", ""),
+                )
+                meta.update(size=len(file_data), sender=self._peer_ip(),
+                            sha256=hashlib.sha256(file_data).hexdigest())
+                final_filename = meta["name"]
                 
                 # Guardar archivo
                 download_dir = get_downloads_folder()
@@ -246,11 +489,15 @@ class FileServerProtocol(QuicConnectionProtocol):
                     final_filename = f"{base}_{counter}{ext}"
                     full_path = os.path.join(download_dir, final_filename)
                 
-                with open(full_path, "wb") as f:
-                    f.write(file_data)
-                os.chmod(full_path, 0o666)
+                # Escribir en .partial y publicar con rename atómico
+                tmp_path = handoff.partial_path(full_path)
+                f = open(tmp_path, "wb")
+                f.write(file_data)
+                meta = commit_received(tmp_path, full_path, meta, f)
+                announce_committed(meta, "http3")
                 
-                print(f"[HTTP/3] ✅ EXITOSO: '{final_filename}' ({len(file_data)} bytes) {action_desc}")
+                log.info("[HTTP/3] ✅ EXITOSO: '%s' (%s bytes) acción=%s",
+                         final_filename, len(file_data), meta.get('action'))
                 
                 response = {
                     "status": "success",
@@ -263,9 +510,7 @@ class FileServerProtocol(QuicConnectionProtocol):
                 return 400, b'{"error": "No file uploaded"}'
                 
         except Exception as e:
-            print(f"[HTTP/3] ❌ Error parsing multipart: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception("[HTTP/3] ❌ Error parsing multipart: %s", e)
             return 500, b'{"error": "Error processing upload"}'
     
     def _send_http3_response(self, stream_id, status, body):
@@ -274,8 +519,6 @@ class FileServerProtocol(QuicConnectionProtocol):
             if not self._h3_connection:
                 return
             
-            status_text = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}.get(status, "Unknown")
-            
             headers = [
                 (b":status", str(status).encode()),
                 (b"content-type", b"application/json"),
@@ -286,9 +529,88 @@ class FileServerProtocol(QuicConnectionProtocol):
             self._h3_connection.send_data(stream_id, body, end_stream=True)
             self.transmit()
             
-            print(f"[HTTP/3] 📤 Response {stream_id}: {status} ({len(body)} bytes)")
+            log.debug("[HTTP/3] 📤 Response %s: %s (%s bytes)", stream_id, status, len(body))
         except Exception as e:
-            print(f"[HTTP/3] ❌ Error sending response: {e}")
+            log.error("[HTTP/3] ❌ Error sending response: %s", e)
+    
+    def _parse_stream_header(self, stream_id):
+        """
+        Header del stream: quic-file/2 (binario, ver filemeta) o el legado
+        "nombre\\0". Devuelve (meta, primer_chunk) o None si faltan bytes.
+        """
+        buf = self._tmp[stream_id]
+        if filemeta.has_magic(buf) or filemeta.MAGIC.startswith(buf):
+            parsed = filemeta.parse_header(buf)
+            if parsed is None:
+                return None
+            meta, consumed = parsed
+            return meta, buf[consumed:]
+        if b"\0" in buf:
+            header, first_chunk = buf.split(b"\0", 1)
+            header_str = header.decode("utf-8", errors="ignore").strip()
+            return filemeta.from_legacy_name(header_str), first_chunk
+        return None
+    
+    def _finish_manifest(self, stream_id):
+        """
+        Manifest de un lote: crea la carpeta destino (o usa Descargas si el
+        lote no tiene carpeta raíz) y la asocia al id del lote.
+        """
+        meta, body = self._manifests.pop(stream_id)
+        try:
+            if not meta.get("batch"):
+                raise ValueError("manifest sin id de lote")
+            files = filemeta.parse_manifest(body)
+            download_dir = get_downloads_folder()
+            sizes = [item.get("size", 0) for item in files]
+            admission.controller.check(download_dir, self._peer_ip(), sum(sizes), max(sizes, default=0))
+            root = download_dir
+            if meta["name"] != BATCH_NO_ROOT:
+                folder = os.path.basename(filemeta.safe_relpath(meta["name"]))
+                root = os.path.join(download_dir, folder)
+                counter = 1
+                while os.path.exists(root):
+                    root = os.path.join(download_dir, f"{folder}_{counter}")
+                    counter += 1
+            os.makedirs(root, exist_ok=True)
+        except admission.Rejected as e:
+            self._reject_binary_stream(stream_id, e.reason, True)
+            return
+        except (ValueError, OSError) as e:
+            log.error("[QUIC-FILE] ❌ Manifest inválido en stream %s: %s", stream_id, e)
+            self._send_ack(stream_id, False, len(body), error=e)
+            return
+        self._batches[meta["batch"]] = {
+            "root": root,
+            "expected": len(files),
+            "done": 0,
+            "bytes": sum(sizes),
+        }
+        log.info("[QUIC-FILE] 📦 Lote %s: %s archivos → %s", meta['batch'], len(files), root)
+        self._send_ack(stream_id, True, len(body))
+    
+    def _resolve_path(self, meta):
+        """Ruta destino: Descargas/<nombre>, o <carpeta del lote>/<ruta relativa>"""
+        if not meta.get("batch"):
+            # Nunca confiar en rutas enviadas por el peer
+            return os.path.join(get_downloads_folder(), os.path.basename(meta["name"]))
+        batch = self._batches.get(meta["batch"])
+        if batch is None:
+            raise ValueError(f"lote desconocido {meta['batch']}")
+        full_path = os.path.join(batch["root"], filemeta.safe_relpath(meta["name"]))
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        return full_path
+    
+    def _batch_file_done(self, meta):
+        batch = self._batches.get(meta.get("batch"))
+        if batch is None:
+            return
+        batch["done"] += 1
+        if batch["done"] == batch["expected"]:
+            self._batches.pop(meta["batch"])
+            log.info("[QUIC-FILE] 📦 Lote completo: %s archivos en %s", batch['done'], batch['root'])
+            bus.publish("batch_committed", batch=meta["batch"], root=batch["root"],
+                        files=batch["done"], bytes=batch["bytes"], peer=self._peer_ip())
     
     def _handle_binary_stream(self, event):
         """Manejar protocolo binario QUIC (P2P laptops)"""
@@ -296,73 +618,333 @@ class FileServerProtocol(QuicConnectionProtocol):
         data = event.data
         length = len(data)
         
-        print(f"[QUIC-FILE] Stream {stream_id}: {len(data)} bytes, end_stream={event.end_stream}")
+        if stream_id in self._rejected:
+            if event.end_stream:
+                self._rejected.discard(stream_id)
+            return
+
+        if stream_id in self._manifests:
+            self._manifests[stream_id][1].extend(data)
+            if event.end_stream:
+                self._finish_manifest(stream_id)
+            return
 
-        # ARCHIVO: protocolo normal con \0 separator
+        # ARCHIVO: header (quic-file/2 o legado) + contenido
         if stream_id not in self._names:
-            if not hasattr(self, '_tmp'):
-                self._tmp = {}
             if stream_id not in self._tmp:
                 self._tmp[stream_id] = b""
             self._tmp[stream_id] += data
 
-            if b"\0" in self._tmp[stream_id]:
-                header, first_chunk = self._tmp[stream_id].split(b"\0", 1)
-                header_str = header.decode("utf-8", errors="ignore").strip()
+            try:
+                parsed = self._parse_stream_header(stream_id)
+            except ValueError as e:
+                log.error("[QUIC-FILE] ❌ Header inválido en stream %s: %s", stream_id, e)
+                del self._tmp[stream_id]
+                self._send_ack(stream_id, False, 0, error=f"header inválido: {e}")
+                if not event.end_stream:
+                    self._rejected.add(stream_id)
+                return
+            if parsed is None and event.end_stream:
+                self._abort_binary_stream(stream_id, "stream terminado")
+                return
+            
+            if parsed:
+                meta, first_chunk = parsed
+                del self._tmp[stream_id]
+                
+                if meta.get("kind") == "manifest":
+                    self._manifests[stream_id] = (meta, bytearray(first_chunk))
+                    if event.end_stream:
+                        self._finish_manifest(stream_id)
+                    return
                 
-                print(f"[QUIC-FILE] Header: {header_str}")
+                try:
+                    full_path = self._resolve_path(meta)
+                except (ValueError, OSError) as e:
+                    log.error("[QUIC-FILE] ❌ Destino inválido en stream %s: %s", stream_id, e)
+                    self._send_ack(stream_id, False, 0, error=e)
+                    if not event.end_stream:
+                        self._rejected.add(stream_id)
+                    return
+                try:
+                    ticket = admission.controller.admit(get_downloads_folder(), self._peer_ip(), meta.get("size"))
+                except admission.Rejected as e:
+                    self._reject_binary_stream(stream_id, e.reason, event.end_stream)
+                    return
+                try:
+                    ticket.grow(len(first_chunk))
+                except admission.Rejected as e:
+                    ticket.release()
+                    self._reject_binary_stream(stream_id, e.reason, event.end_stream)
+                    return
+                self._tickets[stream_id] = ticket
+                filename = os.path.basename(full_path)
+                if meta.get("batch"):
+                    meta["path"] = os.path.relpath(full_path, get_downloads_folder())
+                meta["name"] = filename
+                meta.setdefault("sender", self._peer_ip())
+                
+                log.debug("[QUIC-FILE] Header: %s", meta)
                 
-                filename = header_str
                 self._names[stream_id] = filename
+                self._paths[stream_id] = full_path
+                self._meta[stream_id] = meta
+                # quic-file/2 siempre hashea: el ACK devuelve el sha256 de lo escrito
+                wants_hash = meta.get("sha256") or self._alpn == filemeta.ALPN_V2
+                self._hashers[stream_id] = hashlib.sha256() if wants_hash else None
                 self._received[stream_id] = 0
 
-                download_dir = get_downloads_folder()
-                full_path = os.path.join(download_dir, filename)
-                print(f"[QUIC-FILE] Descargando → {filename}")
+                log.debug("[QUIC-FILE] Descargando → %s", full_path)
 
-                f = open(full_path, "wb")
+                # Los monitores solo ven el archivo cuando se renombra al final
+                f = open(handoff.partial_path(full_path), "wb")
+                self._trackers[stream_id] = TransferTracker(
+                    bus, "receive", self._peer_ip(), filename, total=meta.get("size"), transport="quic"
+                )
+                tracing.link(self._start_trace(stream_id, filename), self._trackers[stream_id].id)
                 if first_chunk:
                     f.write(first_chunk)
                     f.flush()
+                    if self._hashers[stream_id]:
+                        self._hashers[stream_id].update(first_chunk)
+                    self._trackers[stream_id].update(len(first_chunk))
+                    self._received[stream_id] = len(first_chunk)
                 self._files[stream_id] = f
-                del self._tmp[stream_id]
-            return
+            # Archivos pequeños (.msg) llegan con header y end_stream en un solo evento
+            if not event.end_stream:
+                return
 
         # Continuar recibiendo datos del archivo
-        if stream_id in self._files:
+        elif stream_id in self._files:
+            try:
+                self._tickets[stream_id].grow(length)
+            except admission.Rejected as e:
+                # Tamaño no anunciado (emisor legado) que se pasó de lo admisible
+                self._abort_binary_stream(stream_id, e.reason)
+                self._reject_binary_stream(stream_id, e.reason, event.end_stream)
+                self.transmit()
+                return
             self._files[stream_id].write(data)
             self._files[stream_id].flush()
+            if self._hashers[stream_id]:
+                self._hashers[stream_id].update(data)
             self._received[stream_id] += length
+            self._trackers[stream_id].update(length)
 
             if self._received[stream_id] % (100 * 1024 * 1024) < length:
-                print(f"  [QUIC-FILE] {self._names[stream_id]} → {self._received[stream_id]/(1024**3):.2f} GB")
+                log.info("  [QUIC-FILE] %s → %.2f GB", self._names[stream_id],
+                         self._received[stream_id] / (1024**3))
 
         self.transmit()
 
         if event.end_stream:
             if stream_id in self._files:
+                received = self._received.get(stream_id, 0)
+                meta = self._meta.get(stream_id, {})
+                hasher = self._hashers.get(stream_id)
+                
+                digest = hasher.hexdigest() if hasher else None
+                
+                # Verificar tamaño y hash anunciados en el header
+                error = None
+                if meta.get("size") is not None and meta["size"] != received:
+                    error = f"tamaño {received} != {meta['size']}"
+                elif meta.get("sha256") and digest != meta["sha256"]:
+                    error = "sha256 no coincide"
+                if error:
+                    self._send_ack(stream_id, False, received, digest, error)
+                    self._abort_binary_stream(stream_id, error)
+                    return
+                
                 f = self._files.pop(stream_id)
-                os.fsync(f.fileno())
-                f.close()
                 filename = self._names.pop(stream_id)
-                download_dir = get_downloads_folder()
-                full_path = os.path.join(download_dir, filename)
-                
+                full_path = self._paths.pop(stream_id)
+                self._meta.pop(stream_id, None)
+                self._hashers.pop(stream_id, None)
+                trace = self._traces.pop(stream_id, None)
+                if trace is not None:
+                    trace.add_span("steady_state", trace.perf_start, time.perf_counter(), bytes=received)
+                self._received.pop(stream_id, None)
+                # Fuera de la conexión: ConnectionTerminated no debe liberar
+                # la reserva mientras se publica
+                ticket = self._tickets.pop(stream_id)
+                tracker = self._trackers.pop(stream_id)
+                # fsync + rename en el pool de hilos; el ACK sale al terminar
+                self._spawn(self._commit_binary_stream(stream_id, f, filename, full_path, meta,
+                                                       received, digest, trace, ticket, tracker))
+
+    async def _commit_binary_stream(self, stream_id, f, filename, full_path, meta, received, digest,
+                                    trace, ticket, tracker):
+        """Publica una recepción completa sin bloquear los demás streams ni los timers"""
+        try:
+            meta = await _run_traced(trace, commit_received, handoff.partial_path(full_path), full_path,
+                                     dict(meta, size=received), f)
+            ticket.commit()
+            self._send_ack(stream_id, True, received, digest)
+            log.info("[QUIC-FILE] ✅ Publicado: %s", full_path)
+            announce_committed(meta, "quic")
+            self._batch_file_done(meta)
+            if trace is not None:
+                trace.finish("ok")
+        except Exception as e:
+            ticket.release()
+            self._send_ack(stream_id, False, received, digest, e)
+            log.error("[QUIC-FILE] [-] Error publicando: %s", e)
+            if trace is not None:
+                trace.finish("error")
+            tracker.fail(e)
+            return
+        
+        log.info("[QUIC-FILE] ✅ COMPLETADO → %s (%.2f GB)", filename, received / (1024**3))
+        tracker.done()
+
+class FileSenderProtocol(loops.PacedTimers, QuicConnectionProtocol):
+    """Lado emisor de quic-file/2: entrega el ACK del receptor como future por stream"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._ack_buffers = {}
+        self._ack_waiters = {}
+        self._progress = asyncio.Event()
+        # full / resumed / early_data (resumption) al completar el handshake
+        self.handshake = None
+    
+    def datagram_received(self, data, addr):
+        super().datagram_received(data, addr)
+        # Cada datagrama puede traer ACKs que liberan buffer de envío
+        self._progress.set()
+    
+    async def drain(self):
+        """
+        Backpressure: si la conexión tiene más de high_water bytes sin
+        confirmar (sumando sus streams), esperar a que baje a la mitad antes
+        de leer más del disco.
+        """
+        high = tuning.high_water(self._quic)
+        buffered = tuning.buffered_bytes(self._quic)
+        if buffered is None or buffered <= high:
+            await asyncio.sleep(0)
+            return
+        while buffered is not None and buffered > high // 2:
+            self._progress.clear()
+            try:
+                await asyncio.wait_for(self._progress.wait(), 0.1)
+            except asyncio.TimeoutError:
+                self.transmit()
+            buffered = tuning.buffered_bytes(self._quic)
+    
+    def wait_ack(self, stream_id):
+        """Future que se resuelve con el ACK (dict de filemeta.parse_ack)"""
+        waiter = self._ack_waiters.get(stream_id)
+        if waiter is None:
+            waiter = asyncio.get_event_loop().create_future()
+            self._ack_waiters[stream_id] = waiter
+        return waiter
+    
+    def _resolve(self, stream_id, result=None, error=None):
+        waiter = self.wait_ack(stream_id)
+        if waiter.done():
+            return
+        if error is not None:
+            waiter.set_exception(error)
+        else:
+            waiter.set_result(result)
+    
+    def quic_event_received(self, event):
+        if isinstance(event, StreamDataReceived):
+            buf = self._ack_buffers.get(event.stream_id, b"") + event.data
+            self._ack_buffers[event.stream_id] = buf
+            if event.end_stream:
+                del self._ack_buffers[event.stream_id]
                 try:
-                    os.chmod(full_path, 0o666)
-                    print(f"[QUIC-FILE] ✅ Permisos: {full_path}")
-                except Exception as e:
-                    print(f"[QUIC-FILE] [-] Error permisos: {e}")
-                
-                total_gb = self._received.pop(stream_id, 0) / (1024**3)
-                print(f"[QUIC-FILE] ✅ COMPLETADO → {filename} ({total_gb:.2f} GB)")
+                    self._resolve(event.stream_id, filemeta.parse_ack(buf))
+                except ValueError as e:
+                    self._resolve(event.stream_id, error=e)
+        elif isinstance(event, StreamReset):
+            self._resolve(event.stream_id, error=ConnectionError("el receptor reseteó el stream"))
+        elif isinstance(event, HandshakeCompleted):
+            self.handshake = resumption.record("client", event)
+        elif isinstance(event, ConnectionTerminated):
+            for stream_id in list(self._ack_waiters):
+                self._resolve(stream_id, error=ConnectionError(f"conexión cerrada: {event.reason_phrase}"))
+
+async def stream_file(client, stream_id, filepath, sizer, priority, peer, tracker, label):
+    """
+    Envía el contenido de un archivo por un stream ya abierto (header
+    enviado) y lo cierra. Devuelve los bytes enviados.
+    """
+    sent = 0
+    report_step = 10 * 1024 * 1024
+    next_report = report_step
+    ack = client.wait_ack(stream_id)
+    with open(filepath, "rb") as f:
+        while True:
+            if ack.done():
+                # El receptor ya respondió (rechazo de admisión): no seguir enviando
+                break
+            paused = await qos.scheduler.await_turn(priority, peer)
+            if paused > 0.1:
+                log.info("[QoS] ⏸️ %s cedió %.1fs a envíos prioritarios", label, paused)
+            chunk = f.read(sizer.next_size(client._quic))
+            if not chunk:
+                break
+            client._quic.send_stream_data(stream_id, chunk, end_stream=False)
+            client.transmit()
+            if not sent:
+                tracing.mark("first_byte", once=True)
+            sent += len(chunk)
+            tracker.update(len(chunk))
+            # Cede el loop en cada chunk (ACKs, RTT/cwnd) y espera si el
+            # buffer de envío pasó el nivel alto
+            await client.drain()
+            if sent >= next_report:
+                log.debug("[=] %s :: %.1f MB enviados", label, sent/1024/1024)
+                next_report += report_step
+    client._quic.send_stream_data(stream_id, b"", end_stream=True)
+    client.transmit()
+    return sent
+
+class Nacked(Exception):
+    """
+    El receptor recibió el archivo y respondió NACK (hash, escritura o commit
+    fallidos): la respuesta es definitiva, no se reintenta por otro transporte
+    """
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+async def confirm_ack(client, stream_id, sent, sha256):
+    """El receptor confirma tras el fsync con tamaño y hash de lo escrito"""
+    ack = await wait_for_ack(client, stream_id)
+    if ack.get("rejected"):
+        raise admission.Rejected(ack.get("error") or "rechazado por el receptor")
+    if not ack["ok"]:
+        raise Nacked(ack.get("error") or "NACK del receptor")
+    if ack["size"] != sent or (sha256 and ack.get("sha256") != sha256):
+        raise RuntimeError(f"ACK no coincide: {ack['size']} bytes, sha256 {ack.get('sha256')}")
+    return ack
+
+# Sin ACK en este tiempo se verifica con un PING que el receptor sigue vivo
+ACK_PING_INTERVAL = 30.0
+
+async def wait_for_ack(client, stream_id):
+    """Espera el ACK de aplicación; mientras el peer responda PINGs se sigue esperando"""
+    waiter = client.wait_ack(stream_id)
+    while True:
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter), ACK_PING_INTERVAL)
+        except asyncio.TimeoutError:
+            await asyncio.wait_for(client.ping(), ACK_PING_INTERVAL)
 
 app = Flask(__name__)
 app.secret_key = "multicast-secret"
+# Tope del body (margen para el multipart); /api/upload además admite antes de leerlo
+app.config["MAX_CONTENT_LENGTH"] = admission.controller.max_upload + 1024 * 1024
 
 config_client = QuicConfiguration(
     is_client=True,
-    alpn_protocols=["quic-file"],  # Para conexiones P2P laptop-to-laptop
+    # Para conexiones P2P laptop-to-laptop; quic-file/2 lleva header con metadata
+    alpn_protocols=[filemeta.ALPN_V2, filemeta.ALPN_LEGACY],
 )
 config_client.verify_mode = False
 config_client.idle_timeout = 600.0
@@ -377,14 +959,14 @@ def get_tailscale_ips():
     status_path = "/app/tailscale_status.json"
     
     if not os.path.exists(status_path):
-        print("[!] No hay JSON de Tailscale en", status_path, flush=True)
+        log.warning("[!] No hay JSON de Tailscale en %s", status_path)
         return []
     
     try:
         with open(status_path, "r", encoding="utf-8") as f:
             data = json.load(f)
     except Exception as e:
-        print(f"[ERROR] Leyendo JSON: {e}", flush=True)
+        log.error("[ERROR] Leyendo JSON: %s", e)
         return []
     
     if not data:
@@ -409,90 +991,238 @@ def get_tailscale_ips():
         if is_online or is_in_magicsock or is_in_netmap:
             peers.append(ip)
             status = "online" if is_online else ("magicsock" if is_in_magicsock else "netmap")
-            print(f"[✓] Peer: {hostname} ({ip}) [{status}]", flush=True)
+            log.debug("[✓] Peer: %s (%s) [%s]", hostname, ip, status)
     
-    print(f"[✓] Total peers: {len(peers)}", flush=True)
+    log.debug("[✓] Total peers: %s", len(peers))
     return peers
 
-async def send_file_to_ip(ip: str, filepath: str, filename: str = None):
-    """Envía un archivo a través de HTTP/3 (primer intento) o QUIC (fallback)"""
-    if filename is None:
-        filename = os.path.basename(filepath)
-    
-    print(f"[>] Enviando '{filename}' a {ip} ...")
+def build_send_meta(filepath, filename=None, meta=None):
+    """Metadata de envío (nombre, tamaño, sha256); se calcula una vez por archivo"""
+    meta = dict(meta or {})
+    meta.setdefault("name", filename or os.path.basename(filepath))
+    meta["size"] = os.path.getsize(filepath)
+    if not meta.get("sha256"):
+        meta["sha256"] = filemeta.sha256_file(filepath)
+    return meta
+
+# Puertos del peer. Normalmente todos 9999; el benchmark los apunta a
+# proxies locales que emulan latencia y pérdida.
+PEER_HTTP_PORT = 9999
+PEER_QUIC_PORT = 9999
+PEER_TCP_PORT = 9999
+
+# Solo transportes con confirmación del receptor. "tcp" queda en _SENDERS
+# para elegirlo a mano (benchmark), pero no es fallback: 9999/tcp del peer
+# es Flask y nadie confirma lo que llega por ahí.
+TRANSPORTS = ("http", "quic")
+# Archivos chicos (alertas .msg) con ticket guardado del peer prueban QUIC
+# primero: van en 0-RTT, y la conexión deja el ticket para la próxima
+SMALL_TRANSPORTS = ("quic", "http")
+
+def default_transports(ip, size):
+    """Orden de intentos cuando el llamador no fija `transports`"""
+    if resumption.ENABLED and size <= resumption.EARLY_DATA_MAX and \
+            resumption.client_tickets.has(ip, PEER_QUIC_PORT):
+        return SMALL_TRANSPORTS
+    return TRANSPORTS
+
+async def send_file_to_ip(ip: str, filepath: str, filename: str = None, meta: dict = None,
+                          priority: int = None, transports=None):
+    """
+    Envía un archivo a través de HTTP/3 (primer intento) o QUIC (fallback).
+    Con envíos de mayor prioridad en curso (alertas > programados > bulk)
+    este envío pausa entre chunks y cede el enlace.
+    `transports` limita/ordena los intentos (el benchmark fuerza uno solo);
+    sin él, default_transports().
+    Devuelve el transporte que entregó el archivo, o None. Si el peer lo
+    rechaza por admisión (tamaño, cuota, disco) o responde NACK no se
+    prueban los demás transportes.
+    """
+    trace = tracing.start("send", filename or os.path.basename(filepath), ip)
+    delivered = None
+    try:
+        with tracing.activate(trace):
+            with tracing.span("prepare"):
+                meta = build_send_meta(filepath, filename, meta)
+            if priority is None:
+                priority = qos.classify(meta)
+            if transports is None:
+                transports = default_transports(ip, meta["size"])
+            log.info("[>] Enviando '%s' a %s (%s) ...", meta['name'], ip, qos.CLASS_NAMES[priority])
+            with qos.scheduler.transfer(priority, ip):
+                for i, transport in enumerate(transports):
+                    try:
+                        with tracing.span(transport):
+                            ok = await _SENDERS[transport](ip, filepath, meta, priority)
+                    except admission.Rejected as e:
+                        log.warning("[⛔] %s rechazó '%s' (%s): %s", ip, meta['name'], transport, e.reason)
+                        if trace is not None:
+                            trace.finish("rejected")
+                        return None
+                    except Nacked as e:
+                        log.error("[❌] %s respondió NACK a '%s' (%s): %s", ip, meta['name'], transport, e.reason)
+                        if trace is not None:
+                            trace.finish("nacked")
+                        return None
+                    if ok:
+                        delivered = transport
+                        return transport
+                    fallback = transports[i + 1] if i + 1 < len(transports) else "none"
+                    metrics.fallbacks.inc(from_transport=transport, to_transport=fallback)
+    finally:
+        if trace is not None:
+            trace.finish(delivered or "failed")
+    return None
+
+# Respuestas de admisión del receptor (tamaño, cuota, disco): no hay fallback
+REJECT_STATUSES = (admission.TOO_LARGE, admission.OVER_QUOTA, admission.NO_SPACE)
+
+async def _send_via_http(ip, filepath, meta, priority):
+    """POST a /api/upload del peer (Flask)"""
+    filename = meta["name"]
+    file_size = meta["size"]
     
-    # ✅ PRIMER INTENTO: HTTP/3 REAL (compatible con Android vía Cronet)
+    # ✅ HTTP/3 REAL (compatible con Android vía Cronet)
+    tracker = None
     try:
-        print(f"[DEBUG] Intentando HTTP/3 POST a {ip}:9999/api/upload")
+        log.debug("[DEBUG] Intentando HTTP/3 POST a %s:%s/api/upload", ip, PEER_HTTP_PORT)
         import httpx
         
+        tracker = TransferTracker(bus, "send", ip, filename, total=file_size, transport="http")
+        url = f"http://{ip}:{PEER_HTTP_PORT}/api/upload"
         with open(filepath, 'rb') as f:
             files = {'file': (filename, f, 'application/octet-stream')}
-            data = {'videoAction': 'silent'}  # default silencioso
+            data = filemeta.to_form(meta)
+            # httpx arma el multipart (y su Content-Length, que usa la admisión
+            # del receptor); los chunks salen de a uno cediendo el turno
+            encoded = httpx.Request("POST", url, files=files, data=data)
+            headers = {name: encoded.headers[name] for name in ("Content-Type", "Content-Length")}
             
             # Usar httpx con HTTP/3
             async with httpx.AsyncClient(http2=False, verify=False) as client:
                 response = await client.post(
-                    f"http://{ip}:9999/api/upload",
-                    files=files,
-                    data=data,
+                    url,
+                    content=qos.scheduler.paced(encoded.stream, priority, ip),
+                    headers=headers,
                     timeout=60.0
                 )
             
             if response.status_code >= 200 and response.status_code < 300:
-                print(f"[✅] HTTP/3 EXITOSO: '{filename}' enviado a {ip}")
-                return
+                log.info("[✅] HTTP/3 EXITOSO: '%s' enviado a %s", filename, ip)
+                tracker.update(file_size)
+                tracker.done()
+                return True
+            elif response.status_code in REJECT_STATUSES:
+                tracker.fail(f"HTTP {response.status_code}")
+                try:
+                    reason = response.json().get("error")
+                except ValueError:
+                    reason = None
+                raise admission.Rejected(reason or f"HTTP {response.status_code}", response.status_code)
             else:
-                print(f"[!] HTTP/3 falló: {response.status_code}")
+                log.warning("[!] HTTP/3 falló: %s", response.status_code)
+                tracker.fail(f"HTTP {response.status_code}")
+    except admission.Rejected:
+        raise
     except Exception as e:
-        print(f"[!] HTTP/3 error a {ip}: {type(e).__name__}: {str(e)}")
+        log.warning("[!] HTTP/3 error a %s: %s: %s", ip, type(e).__name__, str(e))
+        if tracker:
+            tracker.fail(e)
+    return False
+    
+
+def _resumption_args(ip, config):
+    """
+    Pone en `config` el ticket TLS guardado del peer (si hay) y devuelve los
+    kwargs de connect() para guardar el que emita en esta conexión.
+    """
+    if not resumption.ENABLED:
+        return {}
+    config.session_ticket = resumption.client_tickets.take(ip, PEER_QUIC_PORT)
+    return {"session_ticket_handler": resumption.client_tickets.handler(ip, PEER_QUIC_PORT)}
+
+async def _send_via_quic(ip, filepath, meta, priority):
+    """Protocolo binario quic-file (con ACK si el peer habla quic-file/2)"""
+    filename = meta["name"]
+    file_size = meta["size"]
     
-    # ✅ SEGUNDO INTENTO: QUIC binario (para laptop-to-laptop con protocolo quic-file)
-    print("[i] Intentando fallback QUIC binario...")
+    # ✅ QUIC binario (para laptop-to-laptop con protocolo quic-file)
+    log.info("[i] Intentando QUIC binario...")
+    tracker = None
     try:
-        print(f"[DEBUG] Intentando conectar QUIC a {ip}:9999")
-        async with connect(ip, 9999, configuration=config_client) as client:
-            print(f"[DEBUG] Conexión QUIC exitosa a {ip}")
+        log.debug("[DEBUG] Intentando conectar QUIC a %s:%s", ip, PEER_QUIC_PORT)
+        profile = tuning.profiles.get(ip)
+        config = tuning.client_configuration(config_client, profile)
+        resume = _resumption_args(ip, config)
+        # Con ticket del peer y archivo chico (alertas): header y datos salen
+        # en 0-RTT con el ClientHello, sin esperar el handshake
+        early = config.session_ticket is not None and file_size <= resumption.EARLY_DATA_MAX
+        connect_started = time.perf_counter()
+        async with udpio.connect(ip, PEER_QUIC_PORT, configuration=config, create_protocol=FileSenderProtocol,
+                                 wait_connected=not early, **resume) as client:
+            log.debug("[DEBUG] Conexión QUIC exitosa a %s", ip)
+            trace = tracing.current()
+            if trace is not None and not early:
+                trace.add_span("handshake", connect_started, time.perf_counter())
+            sizer = tuning.ChunkSizer(profile)
+            tracker = TransferTracker(bus, "send", ip, filename, total=file_size, transport="quic")
             stream_id = client._quic.get_next_available_stream_id()
-            header = filename.encode(errors="ignore") + b"\0"
+            # En 0-RTT el ALPN aún no se negoció; solo los receptores con
+            # quic-file/2 emiten tickets
+            with_ack = early or client._quic.tls.alpn_negotiated == filemeta.ALPN_V2
+            if with_ack:
+                header = filemeta.encode_header(meta)
+            else:
+                # Receptor viejo: flags en el nombre
+                header = filemeta.to_legacy_name(meta).encode(errors="ignore") + b"\0"
             client._quic.send_stream_data(stream_id, header, end_stream=False)
-            sent = 0
-            report_step = 10 * 1024 * 1024
-            next_report = report_step
-            with open(filepath, "rb") as f:
-                while True:
-                    chunk = f.read(65536)
-                    if not chunk:
-                        break
-                    client._quic.send_stream_data(stream_id, chunk, end_stream=False)
-                    sent += len(chunk)
-                    if sent % (1024 * 1024) == 0:
-                        await asyncio.sleep(0)
-                    if sent >= next_report:
-                        print(f"[=] {ip} :: {sent/1024/1024:.1f} MB enviados")
-                        next_report += report_step
-            client._quic.send_stream_data(stream_id, b"", end_stream=True)
-            print(f"[i] Esperando confirmación final del receptor para '{filename}'...")
-            while True:
-                try:
-                    if client._quic._streams.get(stream_id) is None:
-                        break
-                    if (client._quic._loss.bytes_in_flight == 0 and
-                        getattr(client._quic._streams.get(stream_id), "send_state", 0) in (3, 4)):
-                        break
-                except:
-                    pass
-                await asyncio.sleep(0.1)
-            print(f"[+] COMPLETADO! '{filename}' enviado 100 % a {ip} (QUIC)")
-            return
+            with tracing.span("steady_state"):
+                sent = await stream_file(client, stream_id, filepath, sizer, priority, ip, tracker,
+                                         f"'{filename}' → {ip}")
+            log.info("[i] Esperando confirmación final del receptor para '%s'...", filename)
+            # Incluye verificación + fsync del receptor (quic-file/2)
+            with tracing.span("ack_wait", acked=with_ack):
+                if with_ack:
+                    await confirm_ack(client, stream_id, sent, meta["sha256"])
+                # Receptor legado: sin ACK, solo queda mirar el estado interno del stream
+                while not with_ack:
+                    try:
+                        if client._quic._streams.get(stream_id) is None:
+                            break
+                        if (client._quic._loss.bytes_in_flight == 0 and
+                            getattr(client._quic._streams.get(stream_id), "send_state", 0) in (3, 4)):
+                            break
+                    except:
+                        pass
+                    await asyncio.sleep(0.1)
+            throughput, rtt = sizer.summary(sent)
+            learned = tuning.profiles.learn(ip, throughput, rtt, sizer.chunk)
+            log.info("[+] COMPLETADO! '%s' enviado 100 %% a %s (QUIC, handshake %s) %.1f Mbit/s, RTT %.0f ms, chunk %s KiB",
+                     filename, ip, client.handshake, throughput * 8 / 1e6, rtt * 1000, learned['chunk'] // 1024)
+            tracker.done()
+            return True
+    except (admission.Rejected, Nacked) as e:
+        if tracker:
+            tracker.fail(e)
+        raise
     except Exception as e:
-        print(f"[!] Error QUIC a {ip}: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        print("[i] Intentando fallback TCP...")
+        log.exception("[!] Error QUIC a %s: %s: %s", ip, type(e).__name__, str(e))
+        if tracker:
+            tracker.fail(e)
+    return False
 
+
+async def _send_via_tcp(ip, filepath, meta, priority):
+    """
+    TCP plano con el header legado, sin confirmación: True solo dice que los
+    bytes salieron. No está en TRANSPORTS (ver arriba).
+    """
+    filename = meta["name"]
+    file_size = meta["size"]
+    
+    tracker = TransferTracker(bus, "send", ip, filename, total=file_size, transport="tcp")
     try:
-        with socket.create_connection((ip, 9999), timeout=30) as s:
+        with socket.create_connection((ip, PEER_TCP_PORT), timeout=30) as s:
             try:
                 s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 256 * 1024)
             except Exception:
@@ -501,23 +1231,181 @@ async def send_file_to_ip(ip: str, filepath: str, filename: str = None):
                 s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             except Exception:
                 pass
-            s.sendall(filename.encode('utf-8', errors='ignore') + b'\x00')
+            s.sendall(filemeta.to_legacy_name(meta).encode('utf-8', errors='ignore') + b'\x00')
             sent = 0
             report_step = 10 * 1024 * 1024
             next_report = report_step
             with open(filepath, "rb") as f:
                 while True:
+                    await qos.scheduler.await_turn(priority, ip)
                     chunk = f.read(65536)
                     if not chunk:
                         break
                     s.sendall(chunk)
                     sent += len(chunk)
+                    tracker.update(len(chunk))
                     if sent >= next_report:
-                        print(f"[=] {ip} :: {sent/1024/1024:.1f} MB enviados (TCP)")
+                        log.debug("[=] %s :: %.1f MB enviados (TCP)", ip, sent/1024/1024)
                         next_report += report_step
-        print(f"[+] COMPLETADO! '{filename}' enviado 100 % a {ip} (TCP fallback)")
+        log.info("[~] '%s' escrito por TCP a %s (sin confirmación del receptor)", filename, ip)
+        tracker.done()
+        return True
     except Exception as tcp_e:
-        print(f"[!] Error enviando '{filename}' por TCP a {ip}: {tcp_e}")
+        log.error("[!] Error enviando '%s' por TCP a %s: %s", filename, ip, tcp_e)
+        tracker.fail(tcp_e)
+        return False
+
+
+_SENDERS = {"http": _send_via_http, "quic": _send_via_quic, "tcp": _send_via_tcp}
+
+# Streams de archivo en paralelo dentro de una sesión de lote
+BATCH_STREAMS = 8
+# Nombre de lote sin carpeta raíz: los archivos van directo a Descargas
+BATCH_NO_ROOT = "."
+
+async def send_batch_to_ip(ip, items, batch_name=BATCH_NO_ROOT, priority=qos.BULK):
+    """
+    Envía varios archivos en UNA conexión quic-file/2: un stream manifest y
+    hasta BATCH_STREAMS streams de archivo en paralelo, cada uno con su ACK.
+    items: [(ruta local, meta)] con meta["name"] = ruta relativa ("sub/a.pdf")
+    y size/sha256 ya calculados (build_send_meta).
+    Lo que no se pudo enviar en el lote (o todo, si el peer no soporta
+    quic-file/2) se reenvía archivo por archivo con send_file_to_ip; en ese
+    camino no hay carpetas y los archivos llegan con su nombre base.
+    """
+    pending = {meta["name"]: (path, meta) for path, meta in items}
+    total = sum(meta["size"] for _, meta in items)
+    label = batch_name if batch_name != BATCH_NO_ROOT else f"{len(items)} archivos"
+    log.info("[>] Enviando lote '%s' (%s archivos, %.1f MB) a %s ...", label, len(items), total / 1024 / 1024, ip)
+    tracker = None
+    rejected = 0
+    with qos.scheduler.transfer(priority, ip):
+        try:
+            profile = tuning.profiles.get(ip)
+            config = tuning.client_configuration(config_client, profile)
+            config.alpn_protocols = [filemeta.ALPN_V2]  # los lotes necesitan ACK por archivo
+            resume = _resumption_args(ip, config)
+            async with udpio.connect(ip, PEER_QUIC_PORT, configuration=config, create_protocol=FileSenderProtocol,
+                                     **resume) as client:
+                tracker = TransferTracker(bus, "send", ip, label, total=total, transport="quic-batch")
+                sizer = tuning.ChunkSizer(profile)
+                batch_id = uuid.uuid4().hex
+                
+                # Manifest primero: el receptor crea la carpeta antes de los archivos
+                manifest = json.dumps(
+                    {"files": [{"path": meta["name"], "size": meta["size"]} for _, meta in items]}
+                ).encode("utf-8")
+                stream_id = client._quic.get_next_available_stream_id()
+                header = filemeta.encode_header({"name": batch_name, "batch": batch_id, "kind": "manifest"})
+                client._quic.send_stream_data(stream_id, header + manifest, end_stream=True)
+                client.transmit()
+                await confirm_ack(client, stream_id, len(manifest), None)
+                
+                slots = asyncio.Semaphore(BATCH_STREAMS)
+                sent_total = 0
+                
+                async def send_one(path, meta):
+                    nonlocal sent_total
+                    async with slots:
+                        # Sin await entre pedir el id y enviar el header: el id queda tomado
+                        sid = client._quic.get_next_available_stream_id()
+                        client._quic.send_stream_data(sid, filemeta.encode_header(dict(meta, batch=batch_id)), end_stream=False)
+                        sent = await stream_file(client, sid, path, sizer, priority, ip, tracker, f"{meta['name']} → {ip}")
+                        await confirm_ack(client, sid, sent, meta["sha256"])
+                        sent_total += sent
+                        del pending[meta["name"]]
+                
+                results = await asyncio.gather(*(send_one(path, meta) for path, meta in items), return_exceptions=True)
+                for (path, meta), result in zip(items, results):
+                    if isinstance(result, admission.Rejected):
+                        # Rechazado por admisión: reenviarlo suelto tendría la misma respuesta
+                        log.warning("[⛔] %s rechazó '%s': %s", ip, meta["name"], result.reason)
+                        pending.pop(meta["name"], None)
+                        rejected += 1
+                    elif isinstance(result, Nacked):
+                        # El receptor ya lo recibió y falló del otro lado: no se reenvía
+                        log.error("[❌] %s respondió NACK a '%s': %s", ip, meta["name"], result.reason)
+                        pending.pop(meta["name"], None)
+                        rejected += 1
+                    elif isinstance(result, Exception):
+                        log.warning("[!] Lote '%s' → %s: %s: %s", label, ip, type(result).__name__, result)
+                
+                throughput, rtt = sizer.summary(sent_total)
+                tuning.profiles.learn(ip, throughput, rtt, sizer.chunk)
+                log.info("[+] Lote '%s' → %s: %s/%s archivos en una sesión, %.1f Mbit/s",
+                         label, ip, len(items) - len(pending), len(items), throughput * 8 / 1e6)
+        except admission.Rejected as e:
+            log.warning("[⛔] %s rechazó el lote '%s': %s", ip, label, e.reason)
+            if tracker:
+                tracker.fail(e)
+            return
+        except Exception as e:
+            log.warning("[!] Lote QUIC a %s no disponible: %s: %s", ip, type(e).__name__, e)
+        
+        if not pending:
+            if tracker and rejected:
+                tracker.fail(f"{rejected} archivos rechazados por el receptor")
+            elif tracker:
+                tracker.done(files=len(items))
+            return
+        if tracker:
+            tracker.fail(f"{len(pending)} archivos sin enviar en el lote")
+        log.info("[i] Reenviando %s archivos de '%s' a %s uno por uno...", len(pending), label, ip)
+        for path, meta in list(pending.values()):
+            await send_file_to_ip(ip, path, meta=dict(meta, name=os.path.basename(meta["name"])), priority=priority)
+
+def start_batch_send(files, video_action, video_time, video_days):
+    """
+    Lote desde el formulario (varios archivos o una carpeta). Con carpeta,
+    el navegador manda la ruta relativa como filename ("slides/a.pdf") y el
+    primer componente es el nombre del lote.
+    """
+    staging = tempfile.mkdtemp(prefix="lote_")
+    items = []
+    for file in files:
+        try:
+            rel = filemeta.safe_relpath(file.filename)
+        except ValueError as e:
+            log.warning("[!] Se omite %r: %s", file.filename, e)
+            continue
+        path = os.path.join(staging, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file.save(path)
+        items.append((path, rel.replace(os.sep, "/")))
+    
+    batch_name = BATCH_NO_ROOT
+    tops = {rel.split("/", 1)[0] for _, rel in items}
+    if len(tops) == 1 and all("/" in rel for _, rel in items):
+        batch_name = tops.pop()
+        items = [(path, rel.split("/", 1)[1]) for path, rel in items]
+    
+    ips = get_tailscale_ips()
+    if not items or not ips:
+        shutil.rmtree(staging, ignore_errors=True)
+        flash("No hay archivos válidos o peers Tailscale online para enviar.", "error")
+        return redirect("/")
+    
+    def run():
+        # Hash una sola vez por archivo, fuera del request
+        metas = []
+        for path, rel in items:
+            is_video = any(rel.lower().endswith(ext) for ext in VIDEO_EXTENSIONS)
+            meta = filemeta.from_form(rel, video_action, video_time, video_days) if is_video else {"name": rel}
+            metas.append((path, build_send_meta(path, meta=meta)))
+        threads = [
+            threading.Thread(target=lambda ip=ip: asyncio.run(send_batch_to_ip(ip, metas, batch_name)), daemon=True)
+            for ip in ips
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        shutil.rmtree(staging, ignore_errors=True)
+    
+    threading.Thread(target=run, daemon=True).start()
+    destino = f"la carpeta '{batch_name}'" if batch_name != BATCH_NO_ROOT else "Descargas"
+    flash(f"{len(items)} archivos enviándose a {len(ips)} dispositivo(s) en {destino}.", "success")
+    return redirect("/")
 
 # ✅ HTTP/3 ahora handled directamente en aioquic.serve() con HTTP/3 support
 # No necesitamos rutas Flask separadas
@@ -528,11 +1416,21 @@ async def send_file_to_ip(ip: str, filepath: str, filename: str = None):
 @app.route("/", methods=["GET", "POST"])
 def index():
     if request.method == "POST":
-        file = request.files.get("file")
-        if not file or file.filename == "":
+        files = [f for f in request.files.getlist("file") if f and f.filename]
+        if not files:
             flash("No seleccionaste archivo", "error")
             return redirect("/")
         
+        # Varios archivos o una carpeta: una sola sesión por peer
+        if len(files) > 1 or "/" in files[0].filename.replace("\\", "/"):
+            return start_batch_send(
+                files,
+                request.form.get("videoAction", "silent").strip().lower(),
+                request.form.get("videoTime", "").strip(),
+                ",".join(request.form.getlist("videoDays")),
+            )
+        file = files[0]
+        
         # Obtener opciones de programación del video
         video_action = request.form.get("videoAction", "silent").strip().lower()  # now, schedule, silent
         video_time = request.form.get("videoTime", "").strip()
@@ -543,47 +1441,47 @@ def index():
         filename_lower = file.filename.lower()
         is_video = any(filename_lower.endswith(ext) for ext in {'.mp4', '.webm', '.mkv', '.avi', '.mov', '.flv', '.m4v', '.ts', '.m3u8'})
         
-        # Determinar el nombre final del archivo con flag de acción si es un video
+        # La acción viaja como metadata (header quic-file/2 o campos del form),
+        # no como flags en el nombre
         if is_video:
-            if video_action == "schedule" and video_time and video_days:
-                # Agregar flag de programación: video.mp4.SCHED_14:30_mon,wed,fri
-                final_filename = f"{file.filename}.SCHED_{video_time}_{video_days}"
+            meta = filemeta.from_form(file.filename, video_action, video_time, video_days)
+            if meta.get("action") == "schedule":
                 action_text = f"programado para {video_time}"
-            elif video_action == "silent":
-                # Agregar flag silent: video.mp4.SILENT
-                final_filename = f"{file.filename}.SILENT"
+            elif meta.get("action") == "silent":
                 action_text = "descargándose silenciosamente"
             else:  # now (default)
-                # Dejar nombre normal
-                final_filename = file.filename
                 action_text = "reproducirá al llegar"
         else:
-            final_filename = file.filename
+            meta = {"name": file.filename}
             action_text = ""
         
         # Guardar archivo temporalmente en memoria para enviarlo
-        import tempfile
         with tempfile.NamedTemporaryFile(delete=False) as tmp:
             file.save(tmp.name)
             tmp_filepath = tmp.name
         
         ips = get_tailscale_ips()
-        print(f"[DEBUG INDEX] get_tailscale_ips() retornó: {ips}")
+        log.debug("[DEBUG INDEX] get_tailscale_ips() retornó: %s", ips)
         
         if not ips:
-            print("[!] No hay peers online")
+            log.warning("[!] No hay peers online")
             flash("No hay peers Tailscale online para enviar.", "error")
             os.remove(tmp_filepath)
             return redirect("/")
         
-        print(f"[+] Enviando a {len(ips)} peers: {ips}")
-        for ip in ips:
-            print(f"[THREAD] Iniciando hilo de envío para {ip}")
-            # Pasar el nombre final con flags, no el temporal
-            threading.Thread(
-                target=lambda ip=ip, tmpfile=tmp_filepath, finalname=final_filename: asyncio.run(send_file_to_ip(ip, tmpfile, finalname)),
-                daemon=True,
-            ).start()
+        log.info("[+] Enviando a %s peers: %s", len(ips), ips)
+        
+        def send_to_all(meta=meta, tmpfile=tmp_filepath):
+            # El hash se calcula una sola vez, fuera del request
+            meta = build_send_meta(tmpfile, meta=meta)
+            for ip in ips:
+                log.debug("[THREAD] Iniciando hilo de envío para %s", ip)
+                threading.Thread(
+                    target=lambda ip=ip: asyncio.run(send_file_to_ip(ip, tmpfile, meta=meta)),
+                    daemon=True,
+                ).start()
+        
+        threading.Thread(target=send_to_all, daemon=True).start()
         
         # Limpiar archivo temporal después de un tiempo
         threading.Timer(30.0, lambda: os.remove(tmp_filepath) if os.path.exists(tmp_filepath) else None).start()
@@ -598,29 +1496,38 @@ def api_upload():
     ✅ Endpoint HTTP/1.1 para recibir archivos desde Android/Cronet (UDP puerto 9999 TCP)
     Idéntico a la ruta POST "/" pero devuelve JSON en lugar de HTML redirect
     """
+    # Admisión con el Content-Length, antes de que Werkzeug lea el body
+    try:
+        ticket = admission.controller.admit(get_downloads_folder(), request.remote_addr, request.content_length)
+    except admission.Rejected as e:
+        log.warning("[⛔] Upload rechazado de %s: %s", request.remote_addr, e.reason)
+        return jsonify({"error": e.reason, "rejected": True}), e.status
     try:
         file = request.files.get("file")
         if not file or file.filename == "":
+            ticket.release()
             return jsonify({"error": "No file provided"}), 400
         
         # Obtener metadata del video desde formulario (igual que ruta web)
-        video_action = request.form.get("videoAction", "silent").strip().lower()
+        video_action = request.form.get("videoAction")
         video_time = request.form.get("videoTime", "").strip()
         video_days_str = request.form.get("videoDays", "").strip()
         sender_ip = request.remote_addr
         
+        # Guardar con nombre ORIGINAL; la acción va al sidecar .meta
+        meta = filemeta.apply_form(filemeta.from_legacy_name(os.path.basename(file.filename)),
+                                   video_action, video_time, video_days_str)
+        meta["sender"] = sender_ip
+        final_filename = meta["name"]
+        
         # Detectar si es video
-        filename_lower = file.filename.lower()
+        filename_lower = final_filename.lower()
         is_video = any(filename_lower.endswith(ext) for ext in {'.mp4', '.webm', '.mkv', '.avi', '.mov', '.flv', '.m4v', '.ts', '.m3u8'})
         
-        # Guardar con nombre ORIGINAL (sin flags en el archivo)
-        # Los flags son solo meta-información para el comportamiento
-        final_filename = file.filename
-        
         if is_video:
-            if video_action == "schedule" and video_time and video_days_str:
-                action_desc = f"programado para {video_time}"
-            elif video_action == "silent":
+            if meta["action"] == "schedule":
+                action_desc = f"programado para {meta['schedule']['time']}"
+            elif meta["action"] == "silent":
                 action_desc = "descargándose silenciosamente"
             else:  # now
                 action_desc = "reproducirá al llegar"
@@ -640,11 +1547,37 @@ def api_upload():
             final_filename = f"{base}_{counter}{ext}"
             full_path = os.path.join(download_dir, final_filename)
         
-        file.save(full_path)
-        os.chmod(full_path, 0o666)
+        trace = tracing.start("receive", final_filename, sender_ip)
+        with tracing.activate(trace):
+            tracker = TransferTracker(bus, "receive", sender_ip, final_filename,
+                                      total=request.content_length, transport="http")
+            tmp_path = handoff.partial_path(full_path)
+            parse_started = time.monotonic()
+            try:
+                with tracing.span("multipart_save"):
+                    file.save(tmp_path)
+                file_size = os.path.getsize(tmp_path)
+                ticket.grow(file_size)  # sin Content-Length se controla acá
+                with tracing.span("sha256", bytes=file_size):
+                    meta.update(size=file_size, sha256=filemeta.sha256_file(tmp_path))
+                with open(tmp_path, "rb+") as f:
+                    meta = commit_received(tmp_path, full_path, meta, f)
+            except Exception as e:
+                handoff.discard(tmp_path)
+                tracker.fail(e)
+                if trace is not None:
+                    trace.finish("error")
+                raise
+            metrics.upload_parse.observe(time.monotonic() - parse_started, transport="http")
+        ticket.commit()
+        if trace is not None:
+            trace.finish("ok")
+        announce_committed(meta, "http")
         
-        file_size = os.path.getsize(full_path)
-        print(f"[✅] HTTP/3 UDP EXITOSO: '{final_filename}' ({file_size} bytes) desde {sender_ip} {action_desc}", flush=True)
+        tracker.update(file_size)
+        tracker.done()
+        log.info("[✅] HTTP/3 UDP EXITOSO: '%s' (%s bytes) desde %s %s",
+                 final_filename, file_size, sender_ip, action_desc)
         
         return jsonify({
             "status": "success",
@@ -654,10 +1587,13 @@ def api_upload():
             "action": action_desc
         }), 200
         
+    except admission.Rejected as e:
+        ticket.release()
+        log.warning("[⛔] Upload rechazado de %s: %s", request.remote_addr, e.reason)
+        return jsonify({"error": e.reason, "rejected": True}), e.status
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        print(f"[❌] Error en /api/upload: {e}", flush=True)
+        ticket.release()
+        log.exception("[❌] Error en /api/upload: %s", e)
         return jsonify({"error": str(e)}), 500
 
 # ...existing code...
@@ -673,9 +1609,11 @@ def stream_video(filename):
     if not any(filename.lower().endswith(ext) for ext in video_extensions):
         return "Not a video file", 400
     
-    # Buscar en Descargas
+    # Buscar en Descargas (o su .partial si aún se está recibiendo)
     downloads_dir = get_downloads_folder()
     filepath = os.path.join(downloads_dir, filename)
+    if not os.path.exists(filepath):
+        filepath = handoff.partial_path(filepath)
     
     # Validar que el archivo existe y está en la carpeta de descargas
     if not os.path.exists(filepath) or not os.path.isfile(filepath):
@@ -747,6 +1685,8 @@ def watch_video(filename):
     
     downloads_dir = get_downloads_folder()
     filepath = os.path.join(downloads_dir, filename)
+    if not os.path.exists(filepath):
+        filepath = handoff.partial_path(filepath)
     
     if not os.path.exists(filepath):
         return "Video not found", 404
@@ -904,51 +1844,175 @@ def videos_page():
     """Página para ver videos recibidos."""
     return render_template("videos.html")
 
+_video_index = None
+_video_index_lock = threading.Lock()
+
+def get_video_index():
+    """Índice de videos compartido, creado y arrancado en el primer uso"""
+    global _video_index
+    with _video_index_lock:
+        if _video_index is None:
+            _video_index = VideoIndex(get_downloads_folder(), listener=bus.publish).start()
+        return _video_index
+
 @app.route("/api/videos")
 def api_videos():
-    """API JSON para listar videos en descargas."""
-    video_extensions = {'.mp4', '.webm', '.mkv', '.avi', '.mov', '.flv', '.m3u8', '.ts', '.m4v'}
+    """
+    API JSON para listar videos en descargas (desde el índice en memoria).
+    Query: offset, limit (paginación) y wait=segundos para long-polling:
+    si el ETag de If-None-Match sigue vigente se espera a un cambio antes
+    de responder 304.
+    """
+    try:
+        offset = max(0, int(request.args.get("offset", 0)))
+        limit = request.args.get("limit")
+        limit = max(0, int(limit)) if limit else None
+        wait = min(max(0.0, float(request.args.get("wait", 0))), 30.0)
+    except ValueError:
+        return jsonify({"error": "offset/limit/wait inválidos"}), 400
     
-    downloads_dir = get_downloads_folder()
-    videos = []
+    index = get_video_index()
+    client_etag = request.headers.get("If-None-Match")
     
+    if client_etag and client_etag == index.etag and wait:
+        index.wait_for_change(client_etag, wait)
+    
+    version, etag, total, body = index.snapshot(offset, limit)
+    if client_etag == etag:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, status=200, mimetype="application/json")
+    response.headers["ETag"] = etag
+    response.headers["X-Index-Version"] = str(version)
+    response.headers["X-Total-Count"] = str(total)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/api/events")
+def api_events():
+    """
+    Server-Sent Events: transfer_started/progress/completed/failed y
+    video_indexed/updated/removed. Soporta Last-Event-ID al reconectar.
+    """
+    get_video_index()
+    last_id = request.headers.get("Last-Event-ID")
     try:
-        if os.path.exists(downloads_dir):
-            for filename in sorted(os.listdir(downloads_dir), key=lambda x: os.path.getmtime(os.path.join(downloads_dir, x)), reverse=True):
-                if any(filename.lower().endswith(ext) for ext in video_extensions):
-                    filepath = os.path.join(downloads_dir, filename)
-                    if os.path.isfile(filepath):
-                        size = os.path.getsize(filepath)
-                        size_mb = size / (1024 * 1024)
-                        mtime = os.path.getmtime(filepath)
-                        videos.append({
-                            "name": filename,
-                            "size": f"{size_mb:.1f} MB",
-                            "path": filepath,
-                            "mtime": mtime
-                        })
-    except Exception as e:
-        print(f"Error listing videos: {e}")
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        last_id = None
+    subscription = bus.subscribe(last_id)
+    
+    def stream():
+        try:
+            yield "retry: 2000\n\n"
+            while True:
+                try:
+                    event = subscription.get(timeout=15)
+                except queue.Empty:
+                    # Comentario keep-alive para proxies y detección de desconexión
+                    yield ": ping\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            bus.unsubscribe(subscription)
     
-    return json.dumps(videos)
+    response = Response(stream_with_context(stream()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route("/api/qos")
+def api_qos():
+    """Envíos activos por prioridad, pausados y latencia de alertas (p50/p95)"""
+    return jsonify(qos.scheduler.stats())
+
+@app.route("/healthz")
+def healthz():
+    """Health check del supervisor (tier HTTP)"""
+    return jsonify({"status": "ok", "pid": os.getpid(), "loop": loops.current()})
+
+# Contadores de E/S UDP de los workers QUIC (llegan con sus latidos)
+_worker_udp = {}
+
+def udp_stats():
+    """Syscalls / datagramas UDP de este proceso más los de los workers QUIC"""
+    return udpio.merge([udpio.stats()] + [stats for stats in _worker_udp.values() if stats])
+
+@app.route("/api/udp")
+def api_udp():
+    """E/S UDP del receptor: syscalls, datagramas y bytes por sentido, caminos en uso (GSO, mmsg...)"""
+    return jsonify(udp_stats())
+
+def _udp_samples():
+    stats = udp_stats()
+    return [({"direction": "send"}, stats["send_syscalls"]), ({"direction": "recv"}, stats["recv_syscalls"])]
+
+@app.route("/api/resumption")
+def api_resumption():
+    """Handshakes completos / reanudados / 0-RTT y tickets TLS guardados"""
+    return jsonify({
+        "enabled": resumption.ENABLED,
+        "handshakes": resumption.handshakes(),
+        "server_tickets": resumption.server_tickets.stats(),
+        "client_tickets": resumption.client_tickets.stats(),
+    })
+
+def _handshake_samples():
+    return [({"side": side, "mode": handshake}, count)
+            for side, counts in resumption.handshakes().items() for handshake, count in counts.items()]
+
+@app.route("/api/admission")
+def api_admission():
+    """Espacio admisible, reservas en curso, uso por emisor y rechazos"""
+    return jsonify(admission.controller.stats(get_downloads_folder()))
+
+@app.route("/metrics")
+def api_metrics():
+    """Métricas en formato de exposición de Prometheus"""
+    return Response(metrics.REGISTRY.expose(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/trace")
+def api_traces():
+    """Trazas recientes (QUIC_TRACE=1 | profile) con el resumen de spans"""
+    return jsonify({"enabled": tracing.ENABLED, "profile": tracing.PROFILE, "traces": tracing.recent()})
+
+@app.route("/api/trace/<transfer_id>")
+def api_trace(transfer_id):
+    """
+    Traza de una transferencia (id de traza o transfer_id de los eventos).
+    ?format=chrome (default): JSON para chrome://tracing / Perfetto.
+    ?format=folded: muestras del perfilador para flamegraph.pl / speedscope.
+    """
+    trace = tracing.get(transfer_id)
+    if trace is None:
+        return jsonify({"error": "traza no encontrada", "enabled": tracing.ENABLED}), 404
+    if request.args.get("format") == "folded":
+        response = Response(trace.folded(), mimetype="text/plain")
+        ext = "folded"
+    else:
+        response = Response(json.dumps(trace.to_chrome()), mimetype="application/json")
+        ext = "trace.json"
+    response.headers["Content-Disposition"] = f'attachment; filename="{trace.id}.{ext}"'
+    return response
 
 @app.route("/send-notification", methods=["POST"])
 def send_notification():
     """Envía una notificación de alerta a todos los receptores como archivo .msg con repeticiones."""
-    print("[*] RUTA: /send-notification - Notificación POST recibida")
+    log.debug("[*] RUTA: /send-notification - Notificación POST recibida")
     
     message = request.form.get("message", "").strip()
     repetitions = request.form.get("repetitions", "1").strip()
+    priority = request.form.get("priority", "normal").strip().lower()
     
-    print(f"[DEBUG] Mensaje recibido: '{message}'")
-    print(f"[DEBUG] Repeticiones: '{repetitions}'")
+    log.debug("[DEBUG] Mensaje recibido: '%s'", message)
+    log.debug("[DEBUG] Repeticiones: '%s'", repetitions)
     
     if not message:
-        print("[!] Mensaje vacío")
+        log.warning("[!] Mensaje vacío")
         return jsonify({"status": "error", "message": "El mensaje no puede estar vacío"}), 400
     
     if len(message) > 500:
-        print("[!] Mensaje muy largo")
+        log.warning("[!] Mensaje muy largo")
         return jsonify({"status": "error", "message": "El mensaje es muy largo (máximo 500 caracteres)"}), 400
     
     # Validar y convertir repeticiones
@@ -959,93 +2023,210 @@ def send_notification():
     except ValueError:
         repetitions = 1
     
+    if priority not in ("alta", "normal"):
+        priority = "normal"
+    
     # Crear archivo .msg temporal con formato: repeticiones|mensaje
     temp_filename = f"ALERTA_{uuid.uuid4().hex[:8]}_{int(time.time())}.msg"
     temp_filepath = os.path.join("/tmp", temp_filename)
     
     try:
-        # Formato: repeticiones|mensaje
-        alert_content = f"{repetitions}|{message}"
+        # Formato: repeticiones|mensaje (o repeticiones|alta|mensaje si es prioritaria)
+        if priority == "alta":
+            alert_content = f"{repetitions}|alta|{message}"
+        else:
+            alert_content = f"{repetitions}|{message}"
         with open(temp_filepath, "w", encoding="utf-8") as f:
             f.write(alert_content)
-        print(f"[+] Archivo de alerta creado: {temp_filepath}")
-        print(f"[+] Contenido: {alert_content}")
+        log.debug("[+] Archivo de alerta creado: %s", temp_filepath)
+        log.debug("[+] Contenido: %s", alert_content)
     except Exception as e:
-        print(f"[!] Error creando archivo de alerta: {e}")
+        log.error("[!] Error creando archivo de alerta: %s", e)
         return jsonify({"status": "error", "message": "Error al crear el archivo de alerta"}), 500
     
     # Obtener IPs de receptores
-    print("[*] Obteniendo peers...")
+    log.debug("[*] Obteniendo peers...")
     peers = get_tailscale_ips()
-    print(f"[DEBUG] Peers detectados: {peers}")
+    log.debug("[DEBUG] Peers detectados: %s", peers)
     
     if not peers:
-        print("[!] No hay peers disponibles")
+        log.warning("[!] No hay peers disponibles")
         return jsonify({"status": "error", "message": "❌ No hay receptores conectados"}), 400
     
-    print(f"[+] Enviando alerta a {len(peers)} peers usando protocolo QUIC")
+    log.info("[+] Enviando alerta a %s peers usando protocolo QUIC", len(peers))
+    
+    queued_at = time.monotonic()
+    
+    # Enviar la alerta a todos los peers en paralelo con prioridad máxima:
+    # los envíos bulk en curso hacia cada peer ceden el enlace hasta que
+    # termine la alerta a ESE peer
+    def send_to_peer(peer):
+        log.debug("[*] THREAD: Enviando alerta a %s", peer)
+        try:
+            # Usar la MISMA función que envia archivos
+            asyncio.run(send_file_to_ip(peer, temp_filepath, priority=qos.ALERT))
+            latency = time.monotonic() - queued_at
+            qos.scheduler.record_alert_latency(latency)
+            metrics.alert_delivery.observe(latency)
+            log.info("[✅] ALERTA enviada a %s en %.0f ms", peer, latency * 1000)
+        except Exception as e:
+            log.exception("[!] THREAD ERROR enviando alerta a %s: %s", peer, e)
     
-    # Enviar archivo de alerta a todos los peers de forma asíncrona (igual que archivos normales)
     def send_alerts():
-        print(f"[*] THREAD: Iniciando envío de alertas a {len(peers)} peers")
-        for peer in peers:
-            print(f"[*] THREAD: Enviando alerta a {peer}")
-            try:
-                # Usar la MISMA función que envia archivos
-                asyncio.run(send_file_to_ip(peer, temp_filepath))
-                print(f"[✅] ALERTA enviada a {peer}")
-            except Exception as e:
-                print(f"[!] THREAD ERROR enviando alerta a {peer}: {e}")
-                import traceback
-                traceback.print_exc()
+        log.debug("[*] THREAD: Iniciando envío de alertas a %s peers", len(peers))
+        threads = [threading.Thread(target=send_to_peer, args=(peer,), daemon=True) for peer in peers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
         
         # Limpiar archivo temporal después de enviar
         try:
             os.remove(temp_filepath)
-            print(f"[+] Archivo temporal eliminado: {temp_filepath}")
+            log.debug("[+] Archivo temporal eliminado: %s", temp_filepath)
         except Exception as e:
-            print(f"[!] Error eliminando temporal: {e}")
+            log.warning("[!] Error eliminando temporal: %s", e)
     
     threading.Thread(target=send_alerts, daemon=True).start()
     return jsonify({"status": "success", "message": f"🚨 Alerta enviada a {len(peers)} receptores", "count": len(peers)}), 200
 
+def _qos_samples():
+    stats = qos.scheduler.stats()
+    samples = [({"priority": name}, n) for name, n in stats["active"].items()]
+    return samples + [({"priority": "paused"}, stats["paused"])]
+
+def start_metrics():
+    """
+    Alimenta /metrics: eventos de transferencia del bus SSE, estado del
+    scheduler QoS y latencia de alertas que reportan los monitores del host
+    por el bus local (tópico "alert_delivered").
+    """
+    metrics.watch_bus(bus)
+    metrics.REGISTRY.gauge("quic_qos_sends", "Envíos en curso por prioridad (y pausados)",
+                           ("priority",), function=_qos_samples)
+    metrics.REGISTRY.gauge("quic_udp_syscalls", "Syscalls de E/S UDP del camino QUIC por sentido",
+                           ("direction",), function=_udp_samples)
+    metrics.REGISTRY.gauge("quic_tls_handshakes", "Handshakes QUIC por lado y modo (full / resumed / early_data)",
+                           ("side", "mode"), function=_handshake_samples)
+
+    def on_alert(topic, data):
+        metrics.monitor_alert_latency.observe(float(data.get("latency", 0)),
+                                              priority=data.get("priority", "normal"))
+
+    get_local_bus().subscribe(["alert_delivered"], on_alert)
+
 def run_flask():
     """
     ✅ Flask escucha en:
     - 127.0.0.1:8080 → localhost (navegador local)
     - 0.0.0.0:9999 → todos los interfaces (Android/Tailscale TCP)
     """
+    # Indexar Descargas antes de aceptar peticiones
+    get_video_index()
+    admission.controller.start(get_downloads_folder())
+    start_metrics()
     # Escuchar en 0.0.0.0:9999 para recibir desde Android/Cronet
     app.run(host="0.0.0.0", port=9999, debug=False, use_reloader=False)
 
-async def run_quic_server():
-    """Ejecutar servidor QUIC asincronamente con soporte HTTP/3 + protocolo binario"""
-    print("[*] run_quic_server() iniciado", flush=True)
+async def run_quic_server(worker=0, workers=1):
+    """
+    Ejecutar servidor QUIC asincronamente con soporte HTTP/3 + protocolo binario.
+    Con workers > 1 este proceso es uno de los receptores en SO_REUSEPORT (ver sharding).
+    """
+    log.debug("[*] run_quic_server() iniciado")
     try:
-        print("[*] Cargando configuración QUIC...", flush=True)
+        log.debug("[*] Cargando configuración QUIC...")
         config = QuicConfiguration(
             is_client=False,
-            alpn_protocols=["h3", "quic-file"],  # ✅ Añadido "h3" para HTTP/3
+            alpn_protocols=["h3", filemeta.ALPN_V2, filemeta.ALPN_LEGACY],  # ✅ "h3" para HTTP/3
             idle_timeout=1800,
             max_data=20 * 1024**3,
             max_stream_data=20 * 1024**3
         )
-        print("[*] Cargando certificados...", flush=True)
+        log.debug("[*] Cargando certificados...")
         config.load_cert_chain("certs/cert.pem", "certs/key.pem")
-        print("[✓] Certificados cargados correctamente", flush=True)
+        log.debug("[✓] Certificados cargados correctamente")
+        # Tickets de sesión: los peers que vuelven reanudan TLS y mandan 0-RTT
+        tickets = {}
+        if resumption.ENABLED:
+            tickets = {"session_ticket_fetcher": resumption.server_tickets.pop,
+                       "session_ticket_handler": resumption.server_tickets.add}
         
-        print("[*] Iniciando servidor QUIC en 0.0.0.0:9999...", flush=True)
-        print("[*] Soportando ALPN protocols: h3 (HTTP/3 Android), quic-file (protocolo binario laptops)", flush=True)
-        await serve("0.0.0.0", 9999, configuration=config, create_protocol=FileServerProtocol)
-        print("[+] Servidor QUIC escuchando en 0.0.0.0:9999", flush=True)
+        # Escaneo de reproducidos en su hilo antes de la primera admisión
+        admission.controller.start(get_downloads_folder())
+        log.info("[*] Iniciando servidor QUIC en 0.0.0.0:9999 (loop %s, UDP %s)...", loops.current(), udpio.MODE)
+        log.debug("[*] Soportando ALPN protocols: h3 (HTTP/3 Android), quic-file (protocolo binario laptops)")
+        if workers > 1:
+            await sharding.serve("0.0.0.0", 9999, worker=worker, workers=workers,
+                                 configuration=config, create_protocol=FileServerProtocol, **tickets)
+        else:
+            await udpio.serve("0.0.0.0", 9999, configuration=config, create_protocol=FileServerProtocol, **tickets)
+        log.info("[+] Servidor QUIC escuchando en 0.0.0.0:9999")
     except Exception as e:
-        print(f"[❌] Error en servidor QUIC: {e}", flush=True)
-        import traceback
-        traceback.print_exc()
+        log.exception("[❌] Error en servidor QUIC: %s", e)
     
-    # Keep the event loop running indefinitely
+    # Mantener el loop vivo sin despertarlo: solo corren los timers de aioquic
+    await asyncio.get_running_loop().create_future()
+
+def relay_worker_events(path, worker):
+    """
+    Worker QUIC (proceso aparte): reenvía los eventos de su bus SSE y sus
+    trazas terminadas al proceso de Flask por el bus local privado del
+    supervisor.
+    """
+    q = bus.subscribe()
+    client = localbus.BusClient(path)
+    # finish() corre en el event loop: no esperar al socket
+    tracing.on_finish(lambda trace: client.publish_nowait("worker_trace", trace.snapshot()))
+
+    def run():
+        while True:
+            event = q.get()
+            client.publish("worker_event", {"worker": worker, "type": event["type"], "data": event["data"]})
+
+    threading.Thread(target=run, name="worker-events", daemon=True).start()
+
+def import_worker_events(path):
+    """
+    Proceso de Flask: publica en el bus SSE los eventos de los workers QUIC,
+    guarda sus trazas terminadas (/api/trace) y los contadores UDP que traen
+    sus latidos (/api/udp).
+    """
+    def on_event(topic, data):
+        if topic == "heartbeat":
+            _worker_udp[data["name"]] = data.get("udp")
+        elif topic == "worker_trace":
+            tracing.restore(data)
+        else:
+            bus.publish(data["type"], **data["data"])
+
+    localbus.BusClient(path).subscribe(["worker_event", "heartbeat", "worker_trace"], on_event)
+
+# Latido de los workers QUIC hacia el supervisor (health check)
+HEARTBEAT_INTERVAL = 2.0
+
+async def _heartbeat(path, name):
+    """Late desde el event loop: si el loop se bloquea, el supervisor deja de oírlo"""
+    client = localbus.BusClient(path)
+    loop = asyncio.get_running_loop()
     while True:
-        await asyncio.sleep(1)
+        await loop.run_in_executor(None, client.publish, "heartbeat", {"name": name, "udp": udpio.stats()})
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+def run_quic_worker(worker, workers, events_path):
+    """Punto de entrada de un worker QUIC lanzado por el supervisor de run.py"""
+    relay_worker_events(events_path, worker)
+
+    async def main():
+        asyncio.ensure_future(_heartbeat(events_path, f"quic-{worker}"))
+        await run_quic_server(worker, workers)
+
+    asyncio.run(main())
+
+def run_http_process(events_path):
+    """Tier HTTP (Flask) en su propio proceso, con los eventos de los workers QUIC"""
+    import_worker_events(events_path)
+    run_flask()
 
 @app.route("/peers", methods=["GET"])
 def get_peers_list():
@@ -1069,10 +2250,10 @@ def get_peers_list():
 if __name__ == "__main__":
     # ✅ Flask daemon thread: localhost:8080 (navegador local únicamente)
     # ✅ QUIC main thread: 0.0.0.0:9999 UDP (laptops protocolo binario + Android HTTP/3)
-    print("[✅] Iniciando servidor...")
-    print("[*] → Flask en 127.0.0.1:8080 (localhost, navegador local)")
-    print("[*] → aioquic en 0.0.0.0:9999 UDP (Tailscale)")
-    print("[*]   ├─ Protocolo binario (laptops P2P)")
-    print("[*]   └─ HTTP/3 endpoint (Android Cronet)")
+    log.info("[✅] Iniciando servidor...")
+    log.info("[*] → Flask en 127.0.0.1:8080 (localhost, navegador local)")
+    log.info("[*] → aioquic en 0.0.0.0:9999 UDP (Tailscale)")
+    log.info("[*]   ├─ Protocolo binario (laptops P2P)")
+    log.info("[*]   └─ HTTP/3 endpoint (Android Cronet)")
     threading.Thread(target=run_flask, daemon=True).start()
     asyncio.run(run_quic_server())
\ No newline at end of file
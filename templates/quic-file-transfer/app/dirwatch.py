@@ -0,0 +1,248 @@
+"""
+Vigilancia de un directorio (Descargas) sin escanearlo en bucle.
+
+En Linux usa inotify vía ctypes (sin dependencias externas); en el resto de
+sistemas, o si inotify no está disponible, compara snapshots de os.scandir
+cada `poll_interval` segundos.
+
+Solo usa la librería estándar: lo importan tanto la app del contenedor como
+los monitores del host (msg-monitor.py, video-monitor.py).
+"""
+import os
+import sys
+import errno
+import logging
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+log = logging.getLogger("envio.dirwatch")
+
+# Tipos de evento entregados al callback(kind, name)
+CREATED = "created"      # apareció un archivo (puede estar escribiéndose)
+MODIFIED = "modified"    # cambió tamaño/mtime
+CLOSED = "closed"        # se cerró tras escribir → contenido completo
+MOVED_IN = "moved_in"    # renombrado hacia el directorio (completo)
+DELETED = "deleted"      # borrado o renombrado fuera del directorio
+RESCAN = "rescan"        # se perdieron eventos: el consumidor debe re-escanear
+
+# Constantes de <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+DEFAULT_MASK = IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+_libc = _load_libc()
+
+
+def inotify_available():
+    """True si este sistema puede usar inotify"""
+    return _libc is not None
+
+
+def _translate(mask):
+    """Convierte una máscara inotify en el tipo de evento público"""
+    if mask & IN_CLOSE_WRITE:
+        return CLOSED
+    if mask & IN_MOVED_TO:
+        return MOVED_IN
+    if mask & (IN_DELETE | IN_MOVED_FROM):
+        return DELETED
+    if mask & IN_CREATE:
+        return CREATED
+    if mask & IN_MODIFY:
+        return MODIFIED
+    return None
+
+
+class DirWatcher:
+    """
+    Entrega eventos de un directorio a `callback(kind, name)` desde un hilo propio.
+
+    - mask: eventos inotify a vigilar (añadir IN_MODIFY solo si se necesita,
+      genera un evento por cada write del receptor)
+    - poll_interval: periodo del fallback por scandir
+    - name_filter: función opcional name -> bool para descartar archivos
+    """
+
+    def __init__(self, path, callback, mask=DEFAULT_MASK, poll_interval=1.0,
+                 name_filter=None, force_polling=False):
+        self.path = path
+        self.callback = callback
+        self.mask = mask
+        self.poll_interval = poll_interval
+        self.name_filter = name_filter
+        self.force_polling = force_polling
+        self.backend = None
+        self.ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, ready_timeout=2.0):
+        """
+        Arranca el hilo y espera a que la vigilancia esté activa, para que un
+        escaneo inicial hecho después no pierda archivos intermedios.
+        """
+        self._thread = threading.Thread(target=self.run, name="dirwatch", daemon=True)
+        self._thread.start()
+        self.ready.wait(ready_timeout)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+
+    def run(self):
+        """Bucle bloqueante; usar start() para correrlo en segundo plano"""
+        while not self._stop.is_set():
+            if not os.path.isdir(self.path):
+                self._stop.wait(self.poll_interval)
+                continue
+            if self.backend != "polling" and not self.force_polling and inotify_available():
+                try:
+                    self.backend = "inotify"
+                    self._run_inotify()
+                    # El directorio desapareció/se movió: volver a vigilarlo
+                    continue
+                except OSError as e:
+                    log.info("[dirwatch] inotify no disponible (%s), usando polling", e)
+            self.backend = "polling"
+            self._run_polling()
+
+    def _mark_ready(self):
+        # Tras re-vigilar (directorio recreado, cambio de backend) pudo
+        # perderse algo: pedir un re-escaneo al consumidor
+        if self.ready.is_set():
+            self._emit(RESCAN, None)
+        self.ready.set()
+
+    def _emit(self, kind, name):
+        if name is not None and self.name_filter and not self.name_filter(name):
+            return
+        try:
+            self.callback(kind, name)
+        except Exception as e:
+            log.exception("[dirwatch] Error en callback (%s, %s): %s", kind, name, e)
+
+    def _run_inotify(self):
+        fd = _libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        try:
+            wd = _libc.inotify_add_watch(fd, os.fsencode(self.path),
+                                         self.mask | IN_DELETE_SELF | IN_MOVE_SELF)
+            if wd < 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+            self._mark_ready()
+
+            while not self._stop.is_set():
+                ready, _, _ = select.select([fd], [], [], 0.5)
+                if not ready:
+                    continue
+                try:
+                    buf = os.read(fd, 64 * 1024)
+                except OSError as e:
+                    if e.errno in (errno.EAGAIN, errno.EINTR):
+                        continue
+                    raise
+
+                offset = 0
+                while offset + _EVENT_HEADER.size <= len(buf):
+                    _wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+                    offset += _EVENT_HEADER.size
+                    raw_name = buf[offset:offset + length].rstrip(b"\0")
+                    offset += length
+
+                    if mask & IN_Q_OVERFLOW:
+                        self._emit(RESCAN, None)
+                        continue
+                    if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                        return
+                    if mask & IN_ISDIR or not raw_name:
+                        continue
+                    kind = _translate(mask)
+                    if kind:
+                        self._emit(kind, os.fsdecode(raw_name))
+        finally:
+            os.close(fd)
+
+    def _scan(self):
+        entries = {}
+        try:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    if self.name_filter and not self.name_filter(entry.name):
+                        continue
+                    try:
+                        if not entry.is_file():
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries[entry.name] = (st.st_ino, st.st_size, st.st_mtime_ns)
+        except OSError:
+            pass
+        return entries
+
+    def _run_polling(self):
+        """
+        Fallback portable: diff de snapshots. Un archivo se considera cerrado
+        cuando su tamaño/mtime no cambia entre dos pasadas.
+        """
+        previous = self._scan()
+        self._mark_ready()
+        pending = set()
+        while not self._stop.wait(self.poll_interval):
+            if not os.path.isdir(self.path):
+                self._emit(RESCAN, None)
+                return
+            current = self._scan()
+
+            for name in previous.keys() - current.keys():
+                pending.discard(name)
+                self._emit(DELETED, name)
+
+            for name, sig in current.items():
+                old = previous.get(name)
+                if old is None:
+                    pending.add(name)
+                    self._emit(CREATED, name)
+                elif old != sig:
+                    pending.add(name)
+                    self._emit(MODIFIED, name)
+                elif name in pending:
+                    pending.discard(name)
+                    self._emit(CLOSED, name)
+
+            previous = current
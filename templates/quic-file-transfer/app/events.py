@@ -0,0 +1,133 @@
+"""
+Bus de eventos en proceso para empujar estado a las páginas web (SSE).
+
+Publican el receptor QUIC (hilo del event loop), los hilos de envío y el
+índice de videos; cada cliente SSE se suscribe con su propia cola acotada.
+Un suscriptor lento pierde eventos en vez de frenar a quien publica.
+"""
+import json
+import time
+import uuid
+import queue
+import threading
+from collections import deque
+
+from . import tracing
+
+# Cada cuánto como máximo se publica progreso de una misma transferencia
+PROGRESS_INTERVAL = 0.5
+
+
+class EventBus:
+    def __init__(self, history=200, subscriber_queue=500):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._history = deque(maxlen=history)
+        self._next_id = 1
+        self._subscriber_queue = subscriber_queue
+
+    def publish(self, event_type, **data):
+        """Publica un evento; seguro desde cualquier hilo y sin bloquear"""
+        with self._lock:
+            event = {"id": self._next_id, "type": event_type, "ts": time.time(), "data": data}
+            self._next_id += 1
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                pass
+        return event
+
+    def subscribe(self, last_event_id=None):
+        """
+        Devuelve una cola con los eventos nuevos. Si se pasa `last_event_id`
+        (reconexión SSE) se reinyectan los eventos posteriores aún en historial.
+        """
+        q = queue.Queue(maxsize=self._subscriber_queue)
+        with self._lock:
+            if last_event_id is not None:
+                for event in self._history:
+                    if event["id"] > last_event_id:
+                        q.put_nowait(event)
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+
+def format_sse(event):
+    """Serializa un evento al formato text/event-stream"""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+class TransferTracker:
+    """
+    Publica transfer_started / transfer_progress / transfer_completed /
+    transfer_failed para una transferencia. update() es barato: solo publica
+    cada PROGRESS_INTERVAL segundos.
+    """
+
+    def __init__(self, bus, direction, peer, filename, total=None, transport=None):
+        self.bus = bus
+        self.id = uuid.uuid4().hex[:12]
+        self.direction = direction  # "send" | "receive"
+        self.peer = peer
+        self.filename = filename
+        self.total = total
+        self.transport = transport
+        self.bytes = 0
+        self.started = time.monotonic()
+        self._last_publish = self.started
+        self._last_bytes = 0
+        self._finished = False
+        # Con QUIC_TRACE, la traza activa también se encuentra por este id
+        tracing.link(tracing.current(), self.id)
+        bus.publish("transfer_started", **self._base())
+
+    def _base(self):
+        return {
+            "transfer_id": self.id,
+            "direction": self.direction,
+            "peer": self.peer,
+            "filename": self.filename,
+            "total": self.total,
+            "transport": self.transport,
+        }
+
+    def update(self, nbytes):
+        self.bytes += nbytes
+        now = time.monotonic()
+        if now - self._last_publish < PROGRESS_INTERVAL:
+            return
+        rate = (self.bytes - self._last_bytes) / (now - self._last_publish)
+        self._last_publish = now
+        self._last_bytes = self.bytes
+        self.bus.publish("transfer_progress", bytes=self.bytes, bytes_per_second=rate, **self._base())
+
+    def done(self, **extra):
+        if self._finished:
+            return
+        self._finished = True
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        self.bus.publish(
+            "transfer_completed",
+            bytes=self.bytes,
+            seconds=elapsed,
+            bytes_per_second=self.bytes / elapsed,
+            **self._base(),
+            **extra,
+        )
+
+    def fail(self, error):
+        if self._finished:
+            return
+        self._finished = True
+        self.bus.publish("transfer_failed", bytes=self.bytes, error=str(error), **self._base())
+
+
+# Bus compartido por todo el proceso
+bus = EventBus()
@@ -0,0 +1,374 @@
+"""
+Metadata estructurada de archivos transferidos.
+
+1) Header binario versionado del protocolo quic-file (ALPN "quic-file/2"):
+
+    +-----------+---------+--------------+-----------------------+
+    | \\xffQF    | versión | longitud     | campos TLV            |
+    | 3 bytes   | 1 byte  | 2 bytes BE   | `longitud` bytes      |
+    +-----------+---------+--------------+-----------------------+
+
+   Cada campo es tipo (1 byte) + longitud (2 bytes BE) + valor. Los tipos
+   desconocidos se ignoran, así se pueden agregar campos sin romper peers;
+   un cambio incompatible sube la versión (y el ALPN). 0xFF nunca inicia un
+   nombre UTF-8, así que no se confunde con el header legado "nombre\\0".
+
+   Lotes (carpetas / varios archivos en una sola conexión): primero un
+   stream "manifest" (T_KIND=1, T_BATCH=id, nombre = carpeta raíz) con la
+   lista de archivos en JSON tras el header; después un stream por archivo
+   con el mismo T_BATCH y el nombre como ruta relativa ("sub/a.pdf").
+
+   Con quic-file/2 el receptor responde por el mismo stream, después del
+   fsync, con un ACK en el mismo formato: estado, tamaño y sha256 de lo que
+   quedó en disco (o el error). Si el receptor no admite el archivo
+   (tamaño, cuota, espacio) responde apenas lee el header, con estado
+   ACK_REJECTED, y el emisor deja de enviar.
+
+2) Sidecar `.<nombre>.meta` (JSON) junto al archivo recibido: los monitores
+   y /api/videos leen acción, programación y emisor de ahí, sin parsear
+   flags en el nombre.
+
+Solo usa la librería estándar (lo importan también los monitores del host).
+"""
+import os
+import json
+import struct
+import hashlib
+
+ALPN_V2 = "quic-file/2"
+ALPN_LEGACY = "quic-file"
+
+MAGIC = b"\xffQF"
+VERSION = 1
+_PREFIX = struct.Struct("!3sBH")
+_TLV = struct.Struct("!BH")
+
+T_NAME = 1
+T_SIZE = 2
+T_SHA256 = 3
+T_ACTION = 4
+T_SCHEDULE = 5
+T_SENDER = 6
+T_STATUS = 7
+T_ERROR = 8
+T_BATCH = 9
+T_KIND = 10
+
+ACK_OK = 0
+ACK_FAILED = 1
+# Rechazo de admisión (tamaño, cuota, disco): el emisor no reintenta este peer
+ACK_REJECTED = 2
+
+ACTIONS = ["now", "silent", "schedule"]
+KINDS = ["file", "manifest"]
+DAY_NAMES = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+SIDECAR_SUFFIX = ".meta"
+
+
+# ---------------------------------------------------------------------------
+# Header binario
+# ---------------------------------------------------------------------------
+
+def _days_to_mask(days):
+    mask = 0
+    for day in days:
+        day = day.strip().lower()[:3]
+        for i, name in enumerate(DAY_NAMES):
+            if day and name.startswith(day):
+                mask |= 1 << i
+    return mask
+
+
+def _mask_to_days(mask):
+    return [name for i, name in enumerate(DAY_NAMES) if mask & (1 << i)]
+
+
+def _pack(fields):
+    body = b"".join(_TLV.pack(field_type, len(value)) + value for field_type, value in fields)
+    return _PREFIX.pack(MAGIC, VERSION, len(body)) + body
+
+
+def encode_header(meta):
+    """meta (dict) → bytes del header v1"""
+    fields = []
+
+    def add(field_type, value):
+        fields.append((field_type, value))
+
+    add(T_NAME, meta["name"].encode("utf-8"))
+    if meta.get("size") is not None:
+        add(T_SIZE, struct.pack("!Q", meta["size"]))
+    if meta.get("sha256"):
+        add(T_SHA256, bytes.fromhex(meta["sha256"]))
+    if meta.get("action"):
+        add(T_ACTION, bytes([ACTIONS.index(meta["action"])]))
+    schedule = meta.get("schedule")
+    if schedule:
+        hour, minute = (int(x) for x in schedule["time"].split(":"))
+        add(T_SCHEDULE, bytes([hour, minute, _days_to_mask(schedule.get("days", []))]))
+    if meta.get("sender"):
+        add(T_SENDER, meta["sender"].encode("utf-8"))
+    if meta.get("batch"):
+        add(T_BATCH, meta["batch"].encode("utf-8"))
+    if meta.get("kind") and meta["kind"] != "file":
+        add(T_KIND, bytes([KINDS.index(meta["kind"])]))
+    return _pack(fields)
+
+
+def encode_ack(ok, size, sha256=None, error=None, rejected=False):
+    """ACK del receptor: el archivo quedó (o no) persistido en disco"""
+    status = ACK_OK if ok else ACK_REJECTED if rejected else ACK_FAILED
+    fields = [(T_STATUS, bytes([status])), (T_SIZE, struct.pack("!Q", size))]
+    if sha256:
+        fields.append((T_SHA256, bytes.fromhex(sha256)))
+    if error:
+        fields.append((T_ERROR, str(error).encode("utf-8")[:1024]))
+    return _pack(fields)
+
+
+# Campos de longitud fija (el resto: longitud libre dentro del header)
+_FIXED_LENGTHS = {T_SIZE: 8, T_SHA256: 32, T_ACTION: 1, T_SCHEDULE: 3, T_STATUS: 1, T_KIND: 1}
+
+
+def has_magic(buf):
+    return buf[:len(MAGIC)] == MAGIC
+
+
+def _decode(buf):
+    if len(buf) < _PREFIX.size:
+        return None
+    magic, version, length = _PREFIX.unpack_from(buf)
+    if magic != MAGIC:
+        raise ValueError("no es un header quic-file/2")
+    if version != VERSION:
+        raise ValueError(f"versión de header no soportada: {version}")
+    end = _PREFIX.size + length
+    if len(buf) < end:
+        return None
+
+    meta = {}
+    offset = _PREFIX.size
+    while offset < end:
+        if offset + _TLV.size > end:
+            raise ValueError("campo TLV truncado")
+        field_type, field_len = _TLV.unpack_from(buf, offset)
+        offset += _TLV.size
+        if offset + field_len > end:
+            raise ValueError(f"campo {field_type} truncado")
+        expected = _FIXED_LENGTHS.get(field_type)
+        if expected is not None and field_len != expected:
+            raise ValueError(f"campo {field_type} con longitud inválida: {field_len}")
+        value = bytes(buf[offset:offset + field_len])
+        offset += field_len
+        if field_type == T_NAME:
+            meta["name"] = value.decode("utf-8")
+        elif field_type == T_SIZE:
+            meta["size"] = struct.unpack("!Q", value)[0]
+        elif field_type == T_SHA256:
+            meta["sha256"] = value.hex()
+        elif field_type == T_ACTION:
+            meta["action"] = ACTIONS[value[0]] if value[0] < len(ACTIONS) else None
+        elif field_type == T_SCHEDULE:
+            if value[0] > 23 or value[1] > 59:
+                raise ValueError("hora de programación inválida")
+            meta["schedule"] = {"time": f"{value[0]:02d}:{value[1]:02d}", "days": _mask_to_days(value[2])}
+        elif field_type == T_SENDER:
+            meta["sender"] = value.decode("utf-8")
+        elif field_type == T_STATUS:
+            meta["ok"] = value[0] == ACK_OK
+            meta["rejected"] = value[0] == ACK_REJECTED
+        elif field_type == T_ERROR:
+            meta["error"] = value.decode("utf-8", errors="replace")
+        elif field_type == T_BATCH:
+            meta["batch"] = value.decode("utf-8")
+        elif field_type == T_KIND:
+            meta["kind"] = KINDS[value[0]] if value[0] < len(KINDS) else None
+        # tipos desconocidos: se ignoran (campos de versiones futuras)
+    return meta, end
+
+
+def parse_header(buf):
+    """
+    Intenta parsear el header al inicio de `buf`.
+    Devuelve (meta, bytes_consumidos) o None si aún faltan bytes.
+    Lanza ValueError si el header es inválido (campos truncados o de
+    longitud incorrecta, UTF-8 inválido) o de una versión no soportada.
+    """
+    parsed = _decode(buf)
+    if parsed is None:
+        return None
+    if not parsed[0].get("name"):
+        raise ValueError("header sin nombre de archivo")
+    return parsed
+
+
+def parse_ack(buf):
+    """ACK completo → dict con ok, rejected, size, sha256 y error (ValueError si es inválido)"""
+    parsed = _decode(buf)
+    if parsed is None or "ok" not in parsed[0]:
+        raise ValueError("ACK incompleto o inválido")
+    return parsed[0]
+
+
+def parse_manifest(body):
+    """
+    Manifest de un lote ({"files": [{"path", "size"}, ...]}) → lista de
+    archivos. Lanza ValueError si el JSON no tiene esa forma, si un tamaño no
+    es un entero >= 0 o si una ruta no es relativa.
+    """
+    manifest = json.loads(bytes(body).decode("utf-8"))
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("files", []), list):
+        raise ValueError("manifest sin lista de archivos")
+    files = manifest.get("files", [])
+    for item in files:
+        if not isinstance(item, dict) or not isinstance(item.get("path"), str):
+            raise ValueError(f"entrada de manifest inválida: {item!r}")
+        size = item.get("size", 0)
+        if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            raise ValueError(f"tamaño inválido en manifest: {size!r}")
+        safe_relpath(item["path"])
+    return files
+
+
+def safe_relpath(name):
+    """
+    Ruta relativa enviada por el peer → ruta segura bajo la carpeta destino.
+    Acepta "/" o "\\" como separador; rechaza rutas absolutas y "..".
+    """
+    parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".")]
+    if not parts or name.startswith(("/", "\\")) or ".." in parts or ":" in parts[0]:
+        raise ValueError(f"ruta no permitida: {name!r}")
+    return os.path.join(*parts)
+
+
+# ---------------------------------------------------------------------------
+# Construcción de metadata
+# ---------------------------------------------------------------------------
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def from_form(name, video_action=None, video_time="", video_days=""):
+    """Metadata a partir de los campos del formulario web / Android"""
+    meta = {"name": name}
+    action = (video_action or "").strip().lower()
+    if isinstance(video_days, str):
+        video_days = [d for d in video_days.split(",") if d.strip()]
+    if action == "schedule" and video_time and video_days:
+        meta["action"] = "schedule"
+        meta["schedule"] = {"time": video_time, "days": _mask_to_days(_days_to_mask(video_days))}
+    elif action in ("now", "silent"):
+        meta["action"] = action
+    return meta
+
+
+def apply_form(meta, video_action=None, video_time="", video_days="", default_action="silent"):
+    """
+    Campos del formulario sobre la metadata de from_legacy_name(). Los
+    emisores viejos mandan videoAction=silent fijo junto con los flags en el
+    nombre: un campo ausente o igual al valor por defecto no pisa el nombre.
+    """
+    action = (video_action or "").strip().lower()
+    if not action or action == default_action:
+        if "action" not in meta:
+            meta["action"] = default_action
+        return meta
+    form = from_form(meta["name"], action, video_time, video_days)
+    if "action" in form:
+        meta.pop("schedule", None)
+        meta.update(form)
+    return meta
+
+
+def from_legacy_name(filename):
+    """
+    Único lugar donde se parsean los flags viejos en el nombre
+    (video.mp4.SILENT, video.mp4.SCHED_14:30_monday,wed y el
+    video.mp4.PLAYED_... que deja video-monitor al reproducirlo). Devuelve la
+    metadata con el nombre limpio; "played" marca los ya reproducidos.
+    """
+    if filename.endswith(".SILENT"):
+        return {"name": filename[:-len(".SILENT")], "action": "silent"}
+    for marker in (".SCHED_", ".PLAYED_"):
+        if marker in filename:
+            base, flag = filename.split(marker, 1)
+            parts = flag.split("_", 1)
+            meta = from_form(base, "schedule", parts[0], parts[1] if len(parts) > 1 else "")
+            if marker == ".PLAYED_":
+                meta["played"] = True
+            return meta
+    return {"name": filename}
+
+
+def to_legacy_name(meta):
+    """Nombre con flags para receptores que solo entienden el protocolo viejo"""
+    name = meta["name"]
+    if meta.get("action") == "silent":
+        return f"{name}.SILENT"
+    if meta.get("action") == "schedule" and meta.get("schedule"):
+        return f"{name}.SCHED_{meta['schedule']['time']}_{','.join(meta['schedule']['days'])}"
+    return name
+
+
+def to_form(meta):
+    """Campos de formulario equivalentes (para /api/upload)"""
+    data = {"videoAction": meta.get("action") or "now"}
+    if meta.get("schedule"):
+        data["videoTime"] = meta["schedule"]["time"]
+        data["videoDays"] = ",".join(meta["schedule"]["days"])
+    return data
+
+
+# ---------------------------------------------------------------------------
+# Sidecar
+# ---------------------------------------------------------------------------
+
+def sidecar_path(full_path):
+    directory, name = os.path.split(full_path)
+    return os.path.join(directory, f".{name}{SIDECAR_SUFFIX}")
+
+
+def write_sidecar(full_path, meta):
+    """Escritura atómica; llamar ANTES de publicar el archivo"""
+    path = sidecar_path(full_path)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, separators=(",", ":"))
+    os.chmod(tmp, 0o666)
+    os.replace(tmp, path)
+
+
+def read_sidecar(full_path):
+    try:
+        with open(sidecar_path(full_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def update_sidecar(full_path, **changes):
+    meta = read_sidecar(full_path) or {"name": os.path.basename(full_path)}
+    meta.update(changes)
+    write_sidecar(full_path, meta)
+    return meta
+
+
+def remove_sidecar(full_path):
+    try:
+        os.remove(sidecar_path(full_path))
+    except OSError:
+        pass
+
+
+def load(full_path):
+    """Metadata de un archivo en disco: sidecar si existe, si no flags legados"""
+    return read_sidecar(full_path) or from_legacy_name(os.path.basename(full_path))
@@ -0,0 +1,48 @@
+"""
+Entrega de archivos completos a los monitores.
+
+Los receptores escriben en un nombre oculto `.<nombre>.partial` y al terminar
+(fsync + chmod) lo renombran atómicamente al nombre final. Así msg-monitor y
+video-monitor solo ven archivos completos (IN_MOVED_TO), sin adivinar con
+sleeps si la escritura terminó.
+"""
+import os
+
+PARTIAL_PREFIX = "."
+PARTIAL_SUFFIX = ".partial"
+
+
+def partial_path(full_path):
+    """Ruta temporal oculta en el mismo directorio (el rename es atómico)"""
+    directory, name = os.path.split(full_path)
+    return os.path.join(directory, f"{PARTIAL_PREFIX}{name}{PARTIAL_SUFFIX}")
+
+
+def is_partial_name(name):
+    return name.startswith(PARTIAL_PREFIX) and name.endswith(PARTIAL_SUFFIX)
+
+
+def final_name(name):
+    """`.video.mp4.partial` → `video.mp4`"""
+    return name[len(PARTIAL_PREFIX):-len(PARTIAL_SUFFIX)]
+
+
+def commit(partial, final, fileobj=None):
+    """
+    Publica un archivo recibido: fsync (si se pasa el archivo abierto),
+    permisos públicos y rename atómico al nombre final.
+    """
+    if fileobj is not None:
+        fileobj.flush()
+        os.fsync(fileobj.fileno())
+        fileobj.close()
+    os.chmod(partial, 0o666)
+    os.replace(partial, final)
+
+
+def discard(partial):
+    """Borra una recepción incompleta"""
+    try:
+        os.remove(partial)
+    except OSError:
+        pass
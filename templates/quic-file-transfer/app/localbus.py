@@ -0,0 +1,285 @@
+"""
+Bus de eventos local entre procesos (receptores → monitores).
+
+Un broker escucha en un socket Unix; los receptores publican y los monitores
+se suscriben por tópico. Protocolo con frames compactos:
+
+    +---------+------+-------------+------------------+
+    | versión | tipo | longitud    | payload JSON     |
+    | 1 byte  | 1 B  | 4 bytes BE  | `longitud` bytes |
+    +---------+------+-------------+------------------+
+
+Tipos: SUBSCRIBE {"topics": [...]} (cliente → broker), PUBLISH
+{"topic", "data"} (cliente → broker) y EVENT {"seq", "topic", "data"}
+(broker → suscriptor). El tópico "*" recibe todo.
+
+Solo usa la librería estándar: lo importan la app del contenedor, los
+monitores del host y el daemon event-bus.py. El bus es una optimización:
+si el broker no está, publish() devuelve False y los monitores siguen con
+DirWatcher.
+"""
+import os
+import sys
+import json
+import logging
+import time
+import socket
+import queue
+import struct
+import threading
+
+log = logging.getLogger("envio.localbus")
+
+VERSION = 1
+T_SUBSCRIBE = 1
+T_PUBLISH = 2
+T_EVENT = 3
+
+HEADER = struct.Struct("!BBI")
+MAX_FRAME = 1024 * 1024
+
+SOCKET_NAME = ".envio-bus.sock"
+
+# Sin broker, no reintentar conectar en cada publish
+RECONNECT_INTERVAL = 5.0
+# Eventos en espera de publish_nowait(); si el broker no los drena se descartan
+PUBLISH_QUEUE = 1000
+# Un suscriptor que no vacía su socket en este tiempo se desconecta
+SEND_TIMEOUT = 1.0
+
+
+def available():
+    return hasattr(socket, "AF_UNIX")
+
+
+def default_socket_path(downloads_dir):
+    """ENVIO_BUS_SOCKET o un socket oculto en Descargas (compartida con Docker)"""
+    return os.environ.get("ENVIO_BUS_SOCKET") or os.path.join(downloads_dir, SOCKET_NAME)
+
+
+def _set_send_timeout(sock, seconds):
+    """
+    SO_SNDTIMEO: limita sendall() sin poner timeout a las lecturas
+    (settimeout() afecta a ambos sentidos)
+    """
+    if sys.platform == "win32":
+        value = struct.pack("I", int(seconds * 1000))
+    else:
+        value = struct.pack("ll", int(seconds), int((seconds % 1) * 1_000_000))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, value)
+
+
+def encode_frame(frame_type, payload):
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    if len(body) > MAX_FRAME:
+        raise ValueError(f"frame demasiado grande: {len(body)} bytes")
+    return HEADER.pack(VERSION, frame_type, len(body)) + body
+
+
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("conexión cerrada")
+        buf += chunk
+    return bytes(buf)
+
+
+def read_frame(sock):
+    """Lee un frame completo → (tipo, payload)"""
+    version, frame_type, length = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    if version != VERSION:
+        raise ConnectionError(f"versión de protocolo no soportada: {version}")
+    if length > MAX_FRAME:
+        raise ConnectionError(f"frame demasiado grande: {length}")
+    return frame_type, json.loads(_recv_exact(sock, length).decode("utf-8"))
+
+
+class BusBroker:
+    """Broker del bus: un hilo por conexión, reenvío a suscriptores por tópico"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._subscribers = {}  # socket → (tópicos, lock de envío)
+        self._seq = 0
+        self._server = None
+
+    def _remove_stale_socket(self):
+        if not os.path.exists(self.path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except OSError:
+            os.remove(self.path)  # socket huérfano de un broker muerto
+            return
+        finally:
+            probe.close()
+        raise RuntimeError(f"ya hay un broker escuchando en {self.path}")
+
+    def serve_forever(self):
+        self._remove_stale_socket()
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        os.chmod(self.path, 0o666)  # el contenedor corre como root, los monitores no
+        self._server.listen(64)
+        log.info("[BUS] Escuchando en %s", self.path)
+        try:
+            while True:
+                conn, _ = self._server.accept()
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            self._server.close()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def _handle(self, conn):
+        try:
+            while True:
+                frame_type, payload = read_frame(conn)
+                if frame_type == T_SUBSCRIBE:
+                    topics = set(payload.get("topics") or ["*"])
+                    # Solo el envío tiene límite: un suscriptor colgado no frena
+                    # al broker, uno callado sigue suscrito
+                    _set_send_timeout(conn, SEND_TIMEOUT)
+                    with self._lock:
+                        self._subscribers[conn] = (topics, threading.Lock())
+                elif frame_type == T_PUBLISH:
+                    self.broadcast(payload.get("topic", ""), payload.get("data"))
+        except (OSError, ConnectionError, ValueError):
+            pass
+        finally:
+            with self._lock:
+                self._subscribers.pop(conn, None)
+            conn.close()
+
+    def broadcast(self, topic, data):
+        with self._lock:
+            self._seq += 1
+            frame = encode_frame(T_EVENT, {"seq": self._seq, "topic": topic, "data": data})
+            targets = [(c, lock) for c, (topics, lock) in self._subscribers.items()
+                       if topic in topics or "*" in topics]
+        for conn, lock in targets:
+            try:
+                with lock:
+                    conn.sendall(frame)
+            except OSError:
+                with self._lock:
+                    self._subscribers.pop(conn, None)
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)  # despierta al hilo que lee de él
+                except OSError:
+                    pass
+                conn.close()
+
+
+class BusClient:
+    """Cliente del bus; publish() nunca lanza ni bloquea si el broker no está"""
+
+    def __init__(self, path):
+        self.path = path
+        self._sock = None
+        self._lock = threading.Lock()
+        self._last_attempt = 0.0
+        self._queue = None
+        self._queue_lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(2.0)
+        sock.connect(self.path)
+        return sock
+
+    def publish(self, topic, data):
+        """Publica un evento. True si llegó al broker"""
+        if not available():
+            return False
+        frame = encode_frame(T_PUBLISH, {"topic": topic, "data": data})
+        with self._lock:
+            for _ in range(2):  # un reintento si el broker se reinició
+                if self._sock is None:
+                    now = time.monotonic()
+                    if now - self._last_attempt < RECONNECT_INTERVAL:
+                        return False
+                    self._last_attempt = now
+                    try:
+                        self._sock = self._connect()
+                    except OSError:
+                        return False
+                try:
+                    self._sock.sendall(frame)
+                    return True
+                except OSError:
+                    self._sock.close()
+                    self._sock = None
+                    self._last_attempt = 0.0
+            return False
+
+    def publish_nowait(self, topic, data):
+        """
+        publish() desde un hilo propio, para llamarlo desde un event loop: no
+        espera al socket. False si el evento se descartó (cola llena, sin AF_UNIX).
+        """
+        if not available():
+            return False
+        if self._queue is None:
+            with self._queue_lock:
+                if self._queue is None:
+                    self._queue = queue.Queue(PUBLISH_QUEUE)
+                    threading.Thread(target=self._drain, name="localbus-pub", daemon=True).start()
+        try:
+            self._queue.put_nowait((topic, data))
+            return True
+        except queue.Full:
+            return False
+
+    def _drain(self):
+        while True:
+            topic, data = self._queue.get()
+            try:
+                self.publish(topic, data)
+            except ValueError as e:
+                log.warning("⚠️ Evento '%s' descartado: %s", topic, e)
+
+    def subscribe(self, topics, callback, on_connect=None):
+        """
+        Hilo que entrega callback(topic, data) por cada evento y reconecta
+        solo. on_connect() se llama tras cada (re)conexión: los eventos
+        perdidos mientras tanto se recuperan re-escaneando.
+        """
+        def run():
+            connected_before = False
+            while True:
+                try:
+                    sock = self._connect()
+                except OSError:
+                    time.sleep(1.0)
+                    continue
+                try:
+                    sock.settimeout(None)
+                    sock.sendall(encode_frame(T_SUBSCRIBE, {"topics": list(topics)}))
+                    if on_connect:
+                        on_connect(connected_before)
+                    connected_before = True
+                    while True:
+                        frame_type, payload = read_frame(sock)
+                        if frame_type == T_EVENT:
+                            try:
+                                callback(payload.get("topic"), payload.get("data"))
+                            except Exception as e:
+                                log.exception("[BUS] Error en callback: %s", e)
+                except (OSError, ConnectionError, ValueError):
+                    pass
+                finally:
+                    sock.close()
+                time.sleep(1.0)
+
+        if not available():
+            return None
+        thread = threading.Thread(target=run, name="localbus-sub", daemon=True)
+        thread.start()
+        return thread
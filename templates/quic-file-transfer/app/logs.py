@@ -0,0 +1,153 @@
+"""
+Logging estructurado con niveles para la app y los monitores del host.
+
+- Nivel con LOG_LEVEL (DEBUG / INFO / WARNING / ERROR; INFO por defecto) y
+  formato con LOG_FORMAT=text|json (json: una línea por registro, con los
+  campos de `extra=` incluidos).
+- Quien loguea solo encola (QueueHandler); la escritura a stdout / archivo
+  corre en un hilo aparte (QueueListener), así el event loop QUIC no se
+  bloquea en stdout ni en el log driver de Docker.
+- Límite por mensaje: cada plantilla (el msg SIN formatear) emite como mucho
+  LOG_RATE_BURST líneas cada LOG_RATE_INTERVAL segundos; lo que sobra se
+  descarta antes de formatear y la siguiente línea que pasa lleva la cuenta
+  (`suppressed`). `extra={"sample": N}` deja pasar 1 de cada N.
+
+Usar el estilo %: log.debug("Stream %d: %d bytes", sid, n) — con el nivel
+apagado no se formatea nada y la plantilla agrupa los mensajes repetidos.
+
+Solo usa la librería estándar: lo importan la app del contenedor y los
+monitores del host.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+RATE_BURST = int(os.environ.get("LOG_RATE_BURST", "20"))
+RATE_INTERVAL = float(os.environ.get("LOG_RATE_INTERVAL", "1.0"))
+# Cota de plantillas distintas que se siguen (mensajes con f-string = únicos)
+RATE_MAX_KEYS = 2048
+
+ROOT = "envio"
+
+# Atributos propios de LogRecord: lo demás vino por extra= y va al JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+_INTERNAL = {"sample", "suppressed"}
+
+_lock = threading.Lock()
+_listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    """Límite de líneas por (logger, plantilla) y muestreo 1 de N"""
+
+    def __init__(self, burst=RATE_BURST, interval=RATE_INTERVAL):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._windows = {}  # (logger, plantilla) → [inicio, emitidos, suprimidos, vistos]
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                if len(self._windows) >= RATE_MAX_KEYS:
+                    self._windows.clear()
+                window = self._windows[key] = [now, 0, 0, 0]
+            window[3] += 1
+            sample = getattr(record, "sample", 1)
+            if sample > 1 and (window[3] - 1) % sample:
+                return False
+            if now - window[0] >= self.interval:
+                window[0] = now
+                window[1] = 0
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+            if window[2]:
+                record.suppressed = window[2]
+                window[2] = 0
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(message)s", "%Y-%m-%d %H:%M:%S")
+
+    def format(self, record):
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            line += f" (+{suppressed} similares suprimidos)"
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in _INTERNAL:
+                entry[key] = value
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup(logfile=None, level=None, fmt=None, stream=None):
+    """
+    Configura el logger raíz de la app (una sola vez por proceso).
+    `logfile` agrega un archivo además de stdout (los monitores del host).
+    `stream` reemplaza a stdout (bench.py loguea a stderr: su stdout es JSONL).
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return logging.getLogger(ROOT)
+        level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+        fmt = (fmt or os.environ.get("LOG_FORMAT", "text")).lower()
+        formatter = JsonFormatter() if fmt == "json" else TextFormatter()
+
+        handlers = [logging.StreamHandler(stream or sys.stdout)]
+        if logfile:
+            handlers.append(logging.FileHandler(logfile, encoding="utf-8"))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        q = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(q)
+        queue_handler.addFilter(RateLimitFilter())
+
+        for name in (ROOT, "werkzeug"):
+            logger = logging.getLogger(name)
+            logger.setLevel(getattr(logging, level, logging.INFO))
+            logger.addHandler(queue_handler)
+            logger.propagate = False
+
+        _listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+        return logging.getLogger(ROOT)
+
+
+def get_logger(name):
+    """
+    Logger hijo de la app. No configura nada: cada punto de entrada (app,
+    monitores, broker) llama a setup() al arrancar.
+    """
+    return logging.getLogger(f"{ROOT}.{name}")
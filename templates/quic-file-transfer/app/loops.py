@@ -0,0 +1,87 @@
+"""
+Event loop de asyncio elegible por configuración (QUIC_LOOP).
+
+- auto (default): uvloop si está instalado, si no el loop estándar;
+- uvloop: igual que auto, pero avisa si uvloop no está;
+- asyncio: siempre el loop estándar (para comparar o descartar uvloop).
+
+install() fija la política del proceso, así que aplica a todo loop que se
+cree después: el asyncio.run() del servidor QUIC, el de cada envío por
+peer (un loop por hilo) y los loops del benchmark. client lo llama al
+importarse; uvloop es opcional (no existe en Windows).
+"""
+import os
+import asyncio
+import logging
+
+log = logging.getLogger("envio.loops")
+
+MODE = os.environ.get("QUIC_LOOP", "auto").strip().lower()
+
+_installed = None
+
+
+def install(mode=None):
+    """Instala la política de event loop pedida; devuelve "uvloop" o "asyncio" """
+    global _installed
+    mode = (mode or MODE).lower()
+    if mode not in ("auto", "uvloop", "asyncio"):
+        log.warning("[LOOP] QUIC_LOOP=%s desconocido, se usa auto", mode)
+        mode = "auto"
+    if mode == "asyncio":
+        asyncio.set_event_loop_policy(None)
+        _installed = "asyncio"
+        return _installed
+    try:
+        import uvloop
+    except ImportError:
+        if mode == "uvloop":
+            log.warning("[LOOP] QUIC_LOOP=uvloop pero uvloop no está instalado: loop estándar")
+        _installed = "asyncio"
+        return _installed
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    _installed = "uvloop"
+    return _installed
+
+
+def current():
+    """Loop en uso en este proceso"""
+    return _installed or "asyncio"
+
+
+class PacedTimers:
+    """
+    Mixin para los QuicConnectionProtocol de la app (va antes en las bases).
+
+    uvloop (libuv) cuenta los timers en ms y uno a menos de 1 ms dispara
+    enseguida: un call_at a +200 µs corre a los ~4 µs. aioquic toma
+    max(timer_at, loop.time()) en _handle_timer, pero el transmit() que
+    sigue le pregunta al pacer con loop.time(): todavía es temprano, no sale
+    nada, se re-arma el mismo timer y el loop gira (más CPU por GB y menos
+    throughput que con el loop estándar). Acá transmit() usa el instante del
+    timer que lo disparó. Con asyncio, que dispara tarde, no cambia nada.
+    """
+    _timer_now = None
+
+    def _handle_timer(self):
+        self._timer_now = self._timer_at
+        try:
+            super()._handle_timer()
+        finally:
+            self._timer_now = None
+
+    def transmit(self):
+        """transmit() de aioquic 0.9.9 con now = max(loop.time(), instante del timer)"""
+        self._transmit_task = None
+        now = self._loop.time()
+        if self._timer_now is not None and self._timer_now > now:
+            now = self._timer_now
+        for data, addr in self._quic.datagrams_to_send(now=now):
+            self._transport.sendto(data, addr)
+        timer_at = self._quic.get_timer()
+        if self._timer is not None and self._timer_at != timer_at:
+            self._timer.cancel()
+            self._timer = None
+        if self._timer is None and timer_at is not None:
+            self._timer = self._loop.call_at(timer_at, self._handle_timer)
+        self._timer_at = timer_at
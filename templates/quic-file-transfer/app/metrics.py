@@ -0,0 +1,205 @@
+"""
+Métricas en proceso con formato de exposición de Prometheus (/metrics).
+
+Registro mínimo sin dependencias: Counter, Gauge e Histogram con labels.
+Las transferencias no tocan métricas por chunk: un hilo consume los eventos
+del bus (transfer_started / progress / completed / failed, que ya salen
+como mucho cada 0.5 s por transferencia) y acumula bytes, duraciones y
+transferencias activas. El resto se observa en el punto donde ocurre
+(fallbacks, parseo de uploads, latencia de alertas).
+"""
+import math
+import threading
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, value in self._samples():
+            lines.append(f"{name}{_labels_text(self.labelnames, key)} {_number(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), function=None):
+        super().__init__(name, help_text, labels)
+        self._function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        if self._function is None:
+            return super()._samples()
+        # Gauge calculado al exponer: function() → {labels (dict): valor}
+        return [(self.name, self._key(labels), value) for labels, value in self._function()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, ([*s[0]], s[1], s[2])) for key, s in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels_text(self.labelnames, key, [le])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels_text(self.labelnames, key)} {count}")
+        return "\n".join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=(), function=None):
+        return self.register(Gauge(name, help_text, labels, function))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def expose(self):
+        return "\n".join(metric.expose() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+transfer_bytes = REGISTRY.counter(
+    "quic_transfer_bytes_total", "Bytes transferidos", ("direction", "transport", "peer"))
+transfers = REGISTRY.counter(
+    "quic_transfers_total", "Transferencias terminadas", ("direction", "transport", "result"))
+transfer_duration = REGISTRY.histogram(
+    "quic_transfer_duration_seconds", "Duración de transferencias completadas", ("direction", "transport"))
+active_transfers = REGISTRY.gauge(
+    "quic_active_transfers", "Transferencias en curso (streams / uploads abiertos)", ("direction", "transport"))
+fallbacks = REGISTRY.counter(
+    "quic_send_fallbacks_total", "Envíos que pasaron al siguiente transporte", ("from_transport", "to_transport"))
+upload_parse = REGISTRY.histogram(
+    "quic_upload_parse_seconds", "Tiempo de parseo/guardado de uploads multipart", ("transport",),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30, 120))
+alert_delivery = REGISTRY.histogram(
+    "quic_alert_delivery_seconds", "Desde /send-notification hasta el ACK de cada peer")
+monitor_alert_latency = REGISTRY.histogram(
+    "msg_monitor_alert_latency_seconds", "Desde que el .msg quedó en Descargas hasta la primera notificación",
+    ("priority",))
+
+
+def watch_bus(bus):
+    """Hilo que convierte los eventos de transferencia del bus en métricas"""
+    q = bus.subscribe()
+    seen = {}  # transfer_id → bytes ya contados
+
+    def run():
+        while True:
+            event = q.get()
+            kind, data = event["type"], event["data"]
+            if not kind.startswith("transfer_"):
+                continue
+            labels = {"direction": data.get("direction"), "transport": data.get("transport")}
+            transfer_id = data.get("transfer_id")
+            if kind == "transfer_started":
+                seen[transfer_id] = 0
+                active_transfers.inc(**labels)
+                continue
+            if transfer_id not in seen:
+                continue
+            delta = data.get("bytes", 0) - seen[transfer_id]
+            if delta > 0:
+                transfer_bytes.inc(delta, peer=data.get("peer"), **labels)
+                seen[transfer_id] += delta
+            if kind == "transfer_completed":
+                transfer_duration.observe(data.get("seconds", 0), **labels)
+                transfers.inc(result="ok", **labels)
+            elif kind == "transfer_failed":
+                transfers.inc(result="error", **labels)
+            if kind in ("transfer_completed", "transfer_failed"):
+                del seen[transfer_id]
+                active_transfers.dec(**labels)
+
+    thread = threading.Thread(target=run, name="metrics-bus", daemon=True)
+    thread.start()
+    return thread
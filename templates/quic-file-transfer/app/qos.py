@@ -0,0 +1,145 @@
+"""
+Prioridades entre envíos concurrentes.
+
+Cada envío se registra con una clase y su peer destino: alerta (.msg) >
+video programado > bulk. Mientras haya un envío de clase más alta en curso
+hacia el MISMO peer, los de clase más baja dejan de encolar datos (ceden el
+enlace) y siguen cuando termina. Los envíos a otros peers no se pausan: una
+alerta a un peer inalcanzable no frena el bulk hacia los demás.
+
+Cada envío usa su propia conexión (un event loop por hilo) y aioquic no
+expone prioridades de stream, así que la prioridad se aplica en el emisor,
+entre chunks: es el punto donde se decide qué entra al enlace.
+"""
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+ALERT = 0
+SCHEDULED = 1
+BULK = 2
+
+CLASS_NAMES = {ALERT: "alert", SCHEDULED: "scheduled", BULK: "bulk"}
+
+# Un envío pausado nunca espera más que esto seguido (no romper por idle)
+MAX_PAUSE = 30.0
+
+
+def classify(meta):
+    """Clase de prioridad según la metadata del envío"""
+    if meta["name"].lower().endswith(".msg"):
+        return ALERT
+    if meta.get("action") == "schedule":
+        return SCHEDULED
+    return BULK
+
+
+class TransferScheduler:
+    def __init__(self, max_pause=MAX_PAUSE, latency_samples=100):
+        self._lock = threading.Lock()
+        self._active = {}  # peer → {clase: envíos en curso}
+        self._paused = 0
+        # (loop, asyncio.Event) de cada await_turn() pausado; se despiertan
+        # desde el hilo del envío que termina
+        self._waiters = set()
+        self._max_pause = max_pause
+        self._alert_latency = deque(maxlen=latency_samples)
+
+    @contextmanager
+    def transfer(self, cls, peer):
+        """Registra un envío en curso de la clase dada hacia `peer`"""
+        with self._lock:
+            counts = self._active.setdefault(peer, dict.fromkeys(CLASS_NAMES, 0))
+            counts[cls] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                counts[cls] -= 1
+                if not any(counts.values()):
+                    del self._active[peer]
+                waiters = list(self._waiters)
+            for loop, event in waiters:
+                try:
+                    loop.call_soon_threadsafe(event.set)
+                except RuntimeError:
+                    pass  # loop ya cerrado
+
+    def must_yield(self, cls, peer):
+        """True si hay envíos de mayor prioridad en curso hacia `peer` (lectura sin lock)"""
+        counts = self._active.get(peer)
+        return bool(counts) and any(counts[c] for c in range(cls))
+
+    async def await_turn(self, cls, peer):
+        """
+        Espera, sin bloquear el loop (ACKs, keepalive), a que no haya envíos
+        de mayor prioridad hacia `peer`. Devuelve segundos pausado
+        """
+        if not self.must_yield(cls, peer):
+            return 0.0
+        loop, wake = asyncio.get_running_loop(), asyncio.Event()
+        start = time.monotonic()
+        deadline = start + self._max_pause
+        with self._lock:
+            self._paused += 1
+            self._waiters.add((loop, wake))
+        try:
+            while True:
+                # clear() antes de mirar: un fin de envío posterior vuelve a despertarnos
+                wake.clear()
+                left = deadline - time.monotonic()
+                if left <= 0 or not self.must_yield(cls, peer):
+                    break
+                try:
+                    await asyncio.wait_for(wake.wait(), left)
+                except asyncio.TimeoutError:
+                    break
+        finally:
+            with self._lock:
+                self._paused -= 1
+                self._waiters.discard((loop, wake))
+        return time.monotonic() - start
+
+    async def paced(self, chunks, cls, peer):
+        """
+        Itera `chunks` cediendo el turno antes de cada uno: para clientes
+        (httpx) que leen el cuerpo por su cuenta y no exponen el loop de chunks.
+        """
+        for chunk in chunks:
+            await self.await_turn(cls, peer)
+            yield chunk
+
+    def record_alert_latency(self, seconds):
+        with self._lock:
+            self._alert_latency.append(seconds)
+
+    def stats(self):
+        with self._lock:
+            samples = sorted(self._alert_latency)
+            peers = {peer: {CLASS_NAMES[c]: n for c, n in counts.items() if n}
+                     for peer, counts in self._active.items()}
+            paused = self._paused
+        active = {name: sum(counts.get(name, 0) for counts in peers.values())
+                  for name in CLASS_NAMES.values()}
+
+        def pct(p):
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 1)
+
+        return {
+            "active": active,
+            "peers": peers,
+            "paused": paused,
+            "alert_latency_ms": {
+                "count": len(samples),
+                "p50": pct(0.50),
+                "p95": pct(0.95),
+                "max": round(samples[-1] * 1000, 1) if samples else None,
+            },
+        }
+
+
+scheduler = TransferScheduler()
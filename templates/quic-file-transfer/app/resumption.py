@@ -0,0 +1,147 @@
+"""
+Reanudación de sesiones TLS 1.3 y 0-RTT entre peers.
+
+Sin tickets cada conexión QUIC hace el handshake completo (certificado
+incluido) y el primer byte del archivo sale recién después de un RTT. Con
+un ticket de una conexión anterior al mismo peer el cliente reanuda la
+sesión y, para archivos chicos, manda header y contenido en paquetes 0-RTT
+junto con el ClientHello: una alerta .msg llega con el primer vuelo.
+
+- ServerTickets: tickets que emite el receptor (session_ticket_handler) y
+  que busca al reanudar (session_ticket_fetcher). Cada ticket sirve una
+  sola vez, así que un 0-RTT repetido con el mismo ticket (replay) cae en
+  handshake completo. En memoria y por proceso: con QUIC_WORKERS > 1 solo
+  se reanuda si la conexión cae en el worker que emitió el ticket.
+- ClientTickets: el último ticket de cada peer; se consume al usarlo (el
+  receptor emite uno nuevo en cada conexión).
+
+Solo van en 0-RTT los archivos de hasta EARLY_DATA_MAX bytes. Si el
+receptor no acepta el 0-RTT (reinicio, otro worker), aioquic los da por
+perdidos y los retransmite en 1-RTT: llega igual, con un PTO de demora.
+
+QUIC_RESUMPTION=0 lo desactiva en ambos lados (para comparar).
+"""
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger("envio.resumption")
+
+ENABLED = os.environ.get("QUIC_RESUMPTION", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# Tope de archivo para mandarlo en 0-RTT (alertas, mensajes)
+EARLY_DATA_MAX = 64 * 1024
+MAX_SERVER_TICKETS = 10000
+MAX_CLIENT_TICKETS = 1024
+
+FULL = "full"
+RESUMED = "resumed"
+EARLY_DATA = "early_data"
+
+
+class ServerTickets:
+    """Tickets emitidos por este receptor, de un solo uso"""
+
+    def __init__(self, limit=MAX_SERVER_TICKETS):
+        self._tickets = OrderedDict()
+        self._lock = threading.Lock()
+        self._limit = limit
+        self.issued = 0
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, ticket):
+        """session_ticket_handler de serve()"""
+        with self._lock:
+            self._tickets[ticket.ticket] = ticket
+            self.issued += 1
+            while len(self._tickets) > self._limit:
+                self._tickets.popitem(last=False)
+
+    def pop(self, label):
+        """session_ticket_fetcher de serve(): el ticket deja de valer al usarlo"""
+        with self._lock:
+            ticket = self._tickets.pop(label, None)
+            if ticket is None or not ticket.is_valid:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return ticket
+
+    def stats(self):
+        with self._lock:
+            return {"stored": len(self._tickets), "issued": self.issued, "hits": self.hits, "misses": self.misses}
+
+
+class ClientTickets:
+    """Último ticket recibido de cada peer (ip, puerto)"""
+
+    def __init__(self, limit=MAX_CLIENT_TICKETS):
+        self._tickets = OrderedDict()
+        self._lock = threading.Lock()
+        self._limit = limit
+
+    def handler(self, host, port):
+        """session_ticket_handler de connect() para este peer"""
+        def store(ticket):
+            log.debug("[TLS] 🎟️ Ticket de sesión de %s:%s", host, port)
+            with self._lock:
+                self._tickets[(host, port)] = ticket
+                self._tickets.move_to_end((host, port))
+                while len(self._tickets) > self._limit:
+                    self._tickets.popitem(last=False)
+        return store
+
+    def has(self, host, port):
+        """¿Hay ticket vigente para el peer? (sin consumirlo)"""
+        with self._lock:
+            ticket = self._tickets.get((host, port))
+        return ticket is not None and ticket.is_valid
+
+    def take(self, host, port):
+        """Ticket vigente para el peer, o None; se consume"""
+        with self._lock:
+            ticket = self._tickets.pop((host, port), None)
+        if ticket is None or not ticket.is_valid:
+            return None
+        return ticket
+
+    def stats(self):
+        with self._lock:
+            return {"stored": len(self._tickets)}
+
+
+def mode(event):
+    """full / resumed / early_data de un evento HandshakeCompleted"""
+    if event.early_data_accepted:
+        return EARLY_DATA
+    if event.session_resumed:
+        return RESUMED
+    return FULL
+
+
+_counts_lock = threading.Lock()
+_counts = {}
+
+
+def record(side, event):
+    """Cuenta el handshake de una conexión (side: client / server); devuelve el modo"""
+    handshake = mode(event)
+    with _counts_lock:
+        key = (side, handshake)
+        _counts[key] = _counts.get(key, 0) + 1
+    return handshake
+
+
+def handshakes():
+    """{side: {full, resumed, early_data}} de este proceso"""
+    with _counts_lock:
+        result = {side: dict.fromkeys((FULL, RESUMED, EARLY_DATA), 0) for side in ("client", "server")}
+        for (side, handshake), count in _counts.items():
+            result[side][handshake] = count
+    return result
+
+
+server_tickets = ServerTickets()
+client_tickets = ClientTickets()
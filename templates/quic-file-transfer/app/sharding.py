@@ -0,0 +1,204 @@
+"""
+Receptor QUIC repartido en varios procesos (QUIC_WORKERS=N).
+
+Cada worker abre su propio socket UDP en el mismo puerto con SO_REUSEPORT
+y corre su event loop en su propio núcleo; el kernel reparte los
+datagramas por hash de la 4-tupla, así que una conexión cae siempre en el
+mismo worker... mientras la dirección del peer no cambie. Para que una
+migración (NAT rebinding, el laptop cambia de red) no parta la conexión,
+los connection IDs que emite cada worker llevan su número en el primer
+byte: si llega un paquete con el CID de otro worker, se reenvía al dueño
+por un socket Unix de datagramas junto con la dirección de origen, y el
+dueño responde desde su propio socket (mismo puerto, el peer no nota nada).
+
+Los Initial y 0-RTT llevan un CID elegido por el cliente y se atienden
+donde caen: el handshake no migra.
+
+Para etiquetar los CIDs se tocan campos internos de QuicConnection
+(_host_cids, _replenish_connection_ids) de aioquic 0.9.9; si cambian, los
+workers siguen andando con el reparto por 4-tupla solamente.
+
+El estado en memoria (reservas de admisión, trazas, perfiles de tuning)
+es de cada worker; los eventos de transferencia llegan al proceso de Flask
+por un bus local privado (ver client.relay_worker_events).
+"""
+import os
+import socket
+import struct
+import asyncio
+import logging
+import tempfile
+
+from aioquic.asyncio.server import QuicServer
+from aioquic.buffer import Buffer
+from aioquic.quic.connection import QuicConnection
+from aioquic.quic.packet import PACKET_TYPE_INITIAL, PACKET_TYPE_ZERO_RTT, pull_quic_header
+
+from . import udpio
+
+log = logging.getLogger("envio.sharding")
+
+WORKERS = max(1, int(os.environ.get("QUIC_WORKERS", "1")))
+# El número de worker ocupa el primer byte del CID
+MAX_WORKERS = 256
+
+# Reenvío entre workers: largo de la IP, puerto, IP (ASCII) y el datagrama
+_ADDR = struct.Struct("!BH")
+
+_CAN_TAG = hasattr(QuicConnection, "_replenish_connection_ids")
+
+
+def inbox_path(port, worker):
+    """Socket Unix por el que el worker recibe paquetes reenviados"""
+    return os.path.join(tempfile.gettempdir(), f"envio-quic-{port}-{worker}.sock")
+
+
+def events_path(port):
+    """Bus local privado entre los workers y el proceso de Flask"""
+    return os.path.join(tempfile.gettempdir(), f"envio-quic-{port}-events.sock")
+
+
+def admission_path(port):
+    """Ledger de admisión compartido por Flask y los workers (QUIC_ADMISSION_DB)"""
+    return os.path.join(tempfile.gettempdir(), f"envio-quic-{port}-admission.db")
+
+
+def tag_cid(cid, worker):
+    return bytes([worker]) + cid[1:]
+
+
+def tag_connection(connection, worker):
+    """
+    Pone el número de worker en los CIDs que emite `connection`: el inicial
+    (antes de que se envíe nada) y los que se generan después para
+    NEW_CONNECTION_ID. Re-etiquetar es idempotente.
+    """
+    if not _CAN_TAG:
+        return False
+    first = connection._host_cids[0]
+    first.cid = tag_cid(first.cid, worker)
+    connection.host_cid = first.cid
+    connection._local_initial_source_connection_id = first.cid
+    replenish = connection._replenish_connection_ids
+
+    def replenish_tagged():
+        replenish()
+        for connection_id in connection._host_cids:
+            connection_id.cid = tag_cid(connection_id.cid, worker)
+
+    connection._replenish_connection_ids = replenish_tagged
+    return True
+
+
+class ShardedQuicServer(QuicServer):
+    """QuicServer que reenvía al worker dueño los paquetes con CID ajeno"""
+
+    def __init__(self, *, worker, workers, port, **kwargs):
+        super().__init__(**kwargs)
+        self.worker = worker
+        self.workers = workers
+        self.port = port
+        self.forwarded = 0
+        self.dropped = 0
+        self._outbox = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._outbox.setblocking(False)
+
+    def datagram_received(self, data, addr):
+        owner = self._owner(data)
+        if owner is None:
+            super().datagram_received(data, addr)
+        else:
+            self._forward(owner, data, addr)
+
+    def forwarded_received(self, data, addr):
+        """Paquete que otro worker recibió para una conexión de este"""
+        super().datagram_received(data, addr)
+
+    def _owner(self, data):
+        """Worker al que hay que reenviar el paquete, o None si se procesa acá"""
+        try:
+            header = pull_quic_header(Buffer(data=data),
+                                      host_cid_length=self._configuration.connection_id_length)
+        except ValueError:
+            return None
+        cid = header.destination_cid
+        if not cid or cid in self._protocols:
+            return None
+        if header.is_long_header and header.packet_type in (PACKET_TYPE_INITIAL, PACKET_TYPE_ZERO_RTT):
+            return None
+        owner = cid[0]
+        if owner == self.worker or owner >= self.workers:
+            return None
+        return owner
+
+    def _forward(self, owner, data, addr):
+        host = addr[0].encode("ascii")
+        try:
+            self._outbox.sendto(_ADDR.pack(len(host), addr[1]) + host + data, inbox_path(self.port, owner))
+            self.forwarded += 1
+        except OSError:
+            # Worker caído o cola llena: el peer retransmite
+            self.dropped += 1
+
+    def close(self):
+        super().close()
+        self._outbox.close()
+
+
+class _Inbox:
+    """
+    Lee los paquetes reenviados con add_reader sobre el socket Unix: no
+    depende del soporte de AF_UNIX en create_datagram_endpoint, que varía
+    entre el loop estándar y uvloop.
+    """
+
+    def __init__(self, server, sock):
+        self._server = server
+        self._sock = sock
+
+    def on_readable(self):
+        while True:
+            try:
+                frame = self._sock.recv(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            host_len, port = _ADDR.unpack_from(frame)
+            start = _ADDR.size + host_len
+            self._server.forwarded_received(frame[start:], (frame[_ADDR.size:start].decode("ascii"), port))
+
+
+async def serve(host, port, *, worker, workers, configuration, create_protocol, **kwargs):
+    """
+    Como aioquic.asyncio.serve, pero con SO_REUSEPORT, CIDs etiquetados con
+    `worker` y el socket Unix que recibe los paquetes reenviados. `kwargs`
+    va a QuicServer (p. ej. session_ticket_fetcher / session_ticket_handler).
+    """
+    if workers > MAX_WORKERS:
+        raise ValueError(f"QUIC_WORKERS máximo {MAX_WORKERS}")
+    if not _CAN_TAG:
+        log.warning("[SHARD] Esta versión de aioquic no permite etiquetar CIDs: "
+                    "solo reparto por 4-tupla (una migración puede cortar la conexión)")
+    loop = asyncio.get_event_loop()
+
+    def create(connection, **kwargs):
+        tag_connection(connection, worker)
+        return create_protocol(connection, **kwargs)
+
+    _, server = await udpio.create_endpoint(
+        lambda: ShardedQuicServer(worker=worker, workers=workers, port=port,
+                                  configuration=configuration, create_protocol=create, **kwargs),
+        local_addr=(host, port),
+        reuse_port=True,
+    )
+
+    path = inbox_path(port, worker)
+    try:
+        os.remove(path)  # socket de una ejecución anterior de este worker
+    except OSError:
+        pass
+    inbox = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    inbox.bind(path)
+    inbox.setblocking(False)
+    loop.add_reader(inbox.fileno(), _Inbox(server, inbox).on_readable)
+    log.info("[SHARD] Worker %s/%s escuchando en %s:%s", worker, workers, host, port)
+    return server
@@ -0,0 +1,174 @@
+"""
+Supervisor de los procesos de la app (run.py).
+
+Cada hijo se lanza con multiprocessing en contexto "spawn": importa la app
+desde cero, sin heredar del padre hilos (logging, bus) ni sockets. Si un
+hijo termina se relanza con backoff exponencial (RESTART_DELAY, hasta
+RESTART_MAX_DELAY; vuelve al mínimo si el hijo duró más de STABLE_AFTER).
+SIGTERM / SIGINT terminan a todos los hijos antes de salir.
+
+Health checks: un hijo vivo pero colgado (event loop bloqueado, Flask sin
+responder) se mata y se relanza tras HEALTH_FAILURES chequeos fallidos
+seguidos, cada HEALTH_INTERVAL y pasado HEALTH_GRACE desde que arrancó.
+El chequeo es una función por hijo: http_check() para el tier HTTP o
+heartbeat_check() para los que laten por el bus privado (beat()).
+"""
+import os
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+import urllib.request
+
+log = logging.getLogger("envio.supervisor")
+
+RESTART_DELAY = 0.5
+RESTART_MAX_DELAY = 30.0
+STABLE_AFTER = 60.0
+POLL_INTERVAL = 0.5
+STOP_TIMEOUT = 5.0
+
+HEALTH_INTERVAL = float(os.environ.get("SUPERVISOR_HEALTH_INTERVAL", "2.0"))
+HEALTH_FAILURES = 3
+HEALTH_GRACE = 15.0
+HEARTBEAT_TIMEOUT = 10.0
+
+_mp = multiprocessing.get_context("spawn")
+
+
+def http_check(url, timeout=2.0):
+    """Chequeo que pasa si `url` responde 2xx"""
+    def check():
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                return 200 <= response.status < 300
+        except OSError:
+            return False
+    return check
+
+
+class Child:
+    def __init__(self, name, target, args, health=None):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.health = health
+        self.process = None
+        self.started = 0.0
+        self.restarts = 0
+        self.delay = RESTART_DELAY
+        self.restart_at = None
+        self.failures = 0
+        self.unhealthy_kills = 0
+
+    def start(self):
+        self.process = _mp.Process(target=self.target, args=self.args, name=self.name, daemon=True)
+        self.process.start()
+        self.started = time.monotonic()
+        self.restart_at = None
+        self.failures = 0
+        log.info("[SUP] ▶️ %s (pid %s)", self.name, self.process.pid)
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def stats(self):
+        return {
+            "pid": self.process.pid if self.process else None,
+            "alive": self.alive(),
+            "restarts": self.restarts,
+            "unhealthy_kills": self.unhealthy_kills,
+            "uptime": round(time.monotonic() - self.started, 1) if self.alive() else 0,
+        }
+
+
+class Supervisor:
+    def __init__(self):
+        self._children = {}
+        self._stopping = threading.Event()
+        self._beats = {}
+        self._last_health = 0.0
+
+    def add(self, name, target, *args, health=None):
+        """
+        Registra un hijo: target(*args) debe ser importable (spawn).
+        health() → bool se evalúa cada HEALTH_INTERVAL (None = sin chequeo).
+        """
+        self._children[name] = Child(name, target, args, health)
+
+    def beat(self, name):
+        """Latido de un hijo (p. ej. recibido por el bus privado)"""
+        self._beats[name] = time.monotonic()
+
+    def heartbeat_check(self, name, timeout=HEARTBEAT_TIMEOUT):
+        """Chequeo que pasa si `name` latió en los últimos `timeout` segundos"""
+        def check():
+            child = self._children[name]
+            last = max(self._beats.get(name, 0.0), child.started)
+            return time.monotonic() - last < timeout
+        return check
+
+    def start(self):
+        for child in self._children.values():
+            child.start()
+
+    def _check(self, child):
+        if child.alive():
+            return
+        now = time.monotonic()
+        if child.restart_at is None:
+            if now - child.started > STABLE_AFTER:
+                child.delay = RESTART_DELAY
+            log.error("[SUP] 💥 %s terminó (código %s); se relanza en %.1fs",
+                      child.name, child.process.exitcode, child.delay)
+            child.restart_at = now + child.delay
+            child.delay = min(child.delay * 2, RESTART_MAX_DELAY)
+        elif now >= child.restart_at:
+            child.restarts += 1
+            child.start()
+
+    def _check_health(self, child):
+        if child.health is None or not child.alive() or time.monotonic() - child.started < HEALTH_GRACE:
+            return
+        if child.health():
+            child.failures = 0
+            return
+        child.failures += 1
+        log.warning("[SUP] 🩺 %s no responde (%s/%s)", child.name, child.failures, HEALTH_FAILURES)
+        if child.failures >= HEALTH_FAILURES:
+            log.error("[SUP] 💀 %s colgado: se mata para relanzarlo", child.name)
+            child.unhealthy_kills += 1
+            child.process.kill()
+            child.process.join(STOP_TIMEOUT)
+
+    def run_forever(self):
+        """Vigila a los hijos hasta SIGTERM / SIGINT (llamar desde el hilo principal)"""
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: self._stopping.set())
+        try:
+            while not self._stopping.wait(POLL_INTERVAL):
+                check_health = time.monotonic() - self._last_health >= HEALTH_INTERVAL
+                if check_health:
+                    self._last_health = time.monotonic()
+                for child in self._children.values():
+                    if check_health:
+                        self._check_health(child)
+                    self._check(child)
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._stopping.set()
+        children = [c for c in self._children.values() if c.alive()]
+        for child in children:
+            child.process.terminate()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for child in children:
+            child.process.join(max(0.0, deadline - time.monotonic()))
+            if child.process.is_alive():
+                os.kill(child.process.pid, signal.SIGKILL)
+        log.info("[SUP] ⏹️ %s procesos detenidos", len(children))
+
+    def stats(self):
+        return {name: child.stats() for name, child in self._children.items()}
@@ -0,0 +1,312 @@
+"""
+Trazas por transferencia (opt-in) para ver dónde se va el tiempo.
+
+QUIC_TRACE=1 registra spans por transferencia: handshake, primer byte,
+régimen (steady-state), espera del ACK en el emisor, parseo multipart,
+verificación y fsync/commit en el receptor, y el tiempo acumulado dentro de
+quic_event_received. QUIC_TRACE=profile además muestrea cada
+PROFILE_INTERVAL las pilas de los hilos que tocan la transferencia
+(perfilador por muestreo; formato "folded" de flamegraph.pl / speedscope).
+
+La traza activa viaja en un ContextVar: el emisor la abre en
+send_file_to_ip y los spans anidados (transporte, handshake, ACK) la
+encuentran sin pasarla por parámetro. El receptor (callbacks del event
+loop) guarda la suya por stream y la activa al llamar a código compartido
+como commit_received.
+
+Se exportan en formato Trace Event de Chrome (chrome://tracing, Perfetto)
+desde /api/trace/<transfer_id>. Se guardan las últimas MAX_TRACES; sin
+QUIC_TRACE todas las llamadas son no-ops.
+
+Con el supervisor cada worker QUIC guarda sus trazas; al terminar, cada
+una viaja como snapshot() por el bus privado al proceso de Flask, que la
+sirve en /api/trace con las suyas (restore). Las que siguen en curso en un
+worker no se ven hasta que terminan.
+
+Nota: el loop del receptor es compartido, así que con varias recepciones
+simultáneas las muestras del perfilador se atribuyen a todas.
+"""
+import os
+import sys
+import time
+import uuid
+import threading
+import contextvars
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+MODE = os.environ.get("QUIC_TRACE", "").strip().lower()
+ENABLED = MODE in ("1", "true", "yes", "on", "profile")
+PROFILE = MODE == "profile"
+
+MAX_TRACES = 200
+PROFILE_INTERVAL = float(os.environ.get("QUIC_TRACE_INTERVAL", "0.005"))
+MAX_STACK_DEPTH = 64
+# Pilas distintas que viajan en un snapshot (el frame del bus es de 1 MiB)
+SNAPSHOT_MAX_STACKS = 500
+
+_current = contextvars.ContextVar("quic_trace", default=None)
+
+
+class Trace:
+    def __init__(self, kind, name, peer):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind  # "send" | "receive"
+        self.name = name
+        self.peer = peer
+        self.started = time.time()
+        self.pid = os.getpid()
+        self.aliases = set()
+        self.counters = Counter()
+        self.samples = Counter()
+        self.threads = set()
+        self.result = None
+        self.finished = False
+        self.perf_start = time.perf_counter()
+        self._events = []
+        self._marks = set()
+        self._lock = threading.Lock()
+
+    def _us(self, perf):
+        return (perf - self.perf_start) * 1e6
+
+    def add_span(self, name, start, end, **args):
+        """Span entre dos instantes de time.perf_counter()"""
+        tid = threading.get_ident()
+        with self._lock:
+            self.threads.add(tid)
+            self._events.append({"ph": "X", "name": name, "ts": self._us(start),
+                                 "dur": max(0.0, (end - start) * 1e6), "tid": tid, "args": args})
+
+    @contextmanager
+    def span(self, name, **args):
+        start = time.perf_counter()
+        with self._lock:
+            self.threads.add(threading.get_ident())
+        try:
+            yield self
+        finally:
+            self.add_span(name, start, time.perf_counter(), **args)
+
+    def mark(self, name, once=False, **args):
+        """Evento instantáneo (p. ej. first_byte); once=True solo la primera vez"""
+        with self._lock:
+            if once:
+                if name in self._marks:
+                    return
+                self._marks.add(name)
+            self._events.append({"ph": "i", "s": "t", "name": name, "ts": self._us(time.perf_counter()),
+                                 "tid": threading.get_ident(), "args": args})
+
+    def add(self, counter, value=1):
+        self.counters[counter] += value
+
+    def finish(self, result="ok"):
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+            self.result = result
+            self._events.append({"ph": "i", "s": "g", "name": f"finish:{result}",
+                                 "ts": self._us(time.perf_counter()), "tid": threading.get_ident(), "args": {}})
+        _sampler.untrack(self)
+        for callback in _finish_listeners:
+            callback(self)
+
+    def summary(self):
+        with self._lock:
+            spans = {}
+            for event in self._events:
+                if event["ph"] == "X":
+                    spans[event["name"]] = spans.get(event["name"], 0.0) + event["dur"] / 1000
+            samples = sum(self.samples.values())
+        return {
+            "id": self.id,
+            "aliases": sorted(self.aliases),
+            "kind": self.kind,
+            "name": self.name,
+            "peer": self.peer,
+            "started": self.started,
+            "finished": self.finished,
+            "result": self.result,
+            "spans_ms": {name: round(ms, 3) for name, ms in spans.items()},
+            "counters": dict(self.counters),
+            "samples": samples,
+        }
+
+    def snapshot(self):
+        """Traza terminada como dict JSON, para pasarla a otro proceso (restore)"""
+        with self._lock:
+            events = list(self._events)
+            samples = self.samples.most_common(SNAPSHOT_MAX_STACKS)
+        return {"id": self.id, "aliases": sorted(self.aliases), "kind": self.kind, "name": self.name,
+                "peer": self.peer, "started": self.started, "pid": self.pid, "result": self.result,
+                "counters": dict(self.counters), "samples": samples, "events": events}
+
+    @classmethod
+    def from_snapshot(cls, data):
+        trace = cls(data["kind"], data["name"], data["peer"])
+        trace.id = data["id"]
+        trace.aliases = set(data["aliases"])
+        trace.started = data["started"]
+        trace.pid = data["pid"]
+        trace.result = data["result"]
+        trace.finished = True
+        trace.counters.update(data["counters"])
+        trace.samples.update(dict(data["samples"]))
+        trace._events = data["events"]
+        return trace
+
+    def to_chrome(self):
+        """Formato Trace Event (JSON) de chrome://tracing / Perfetto"""
+        pid = self.pid
+        with self._lock:
+            events = [dict(event, pid=pid) for event in self._events]
+        events.append({"ph": "M", "name": "process_name", "pid": pid, "tid": 0,
+                       "args": {"name": f"{self.kind} {self.name} ({self.peer})"}})
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": dict(self.summary(), counters=dict(self.counters)),
+        }
+
+    def folded(self):
+        """Muestras del perfilador: "frame;frame;frame cantidad" por línea"""
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class _Sampler:
+    """Hilo que muestrea las pilas de los hilos con trazas activas"""
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._active = set()
+        self._thread = None
+
+    def track(self, trace):
+        if not PROFILE:
+            return
+        with self._cond:
+            self._active.add(trace)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-sampler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def untrack(self, trace):
+        with self._cond:
+            self._active.discard(trace)
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._active)
+                active = list(self._active)
+            frames = sys._current_frames()
+            for trace in active:
+                stacks = [_fold(frames[tid]) for tid in list(trace.threads) if tid in frames and tid != own]
+                with trace._lock:
+                    trace.samples.update(stacks)
+            del frames
+            time.sleep(self.interval)
+
+
+def _fold(frame):
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+_lock = threading.Lock()
+_traces = OrderedDict()  # id o alias → Trace
+_sampler = _Sampler()
+_finish_listeners = []
+
+
+def _store(trace):
+    with _lock:
+        _traces[trace.id] = trace
+        for alias in trace.aliases:
+            _traces[alias] = trace
+        while len({id(t) for t in _traces.values()}) > MAX_TRACES:
+            _, evicted = _traces.popitem(last=False)
+            _sampler.untrack(evicted)
+
+
+def start(kind, name, peer):
+    """Nueva traza, o None si QUIC_TRACE no está activo"""
+    if not ENABLED:
+        return None
+    trace = Trace(kind, name, peer)
+    _store(trace)
+    _sampler.track(trace)
+    return trace
+
+
+def on_finish(callback):
+    """callback(trace) al terminar cada traza (en el hilo que la termina)"""
+    _finish_listeners.append(callback)
+
+
+def restore(data):
+    """Guarda la traza de otro proceso (snapshot()) junto a las de este"""
+    _store(Trace.from_snapshot(data))
+
+
+def link(trace, alias):
+    """Permite buscar la traza por otro id (el transfer_id del TransferTracker)"""
+    if trace is None:
+        return
+    trace.aliases.add(alias)
+    with _lock:
+        _traces[alias] = trace
+
+
+def get(trace_id):
+    with _lock:
+        return _traces.get(trace_id)
+
+
+def recent():
+    with _lock:
+        traces = list(OrderedDict((id(t), t) for t in _traces.values()).values())
+    return [trace.summary() for trace in reversed(traces)]
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def activate(trace):
+    """Hace de `trace` la traza activa en este contexto (hilo o tarea)"""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def _noop():
+    yield None
+
+
+def span(name, **args):
+    """Span en la traza activa; no-op si no hay"""
+    trace = _current.get()
+    if trace is None:
+        return _noop()
+    return trace.span(name, **args)
+
+
+def mark(name, once=False, **args):
+    trace = _current.get()
+    if trace is not None:
+        trace.mark(name, once=once, **args)
@@ -0,0 +1,187 @@
+"""
+Ajuste del emisor QUIC según el enlace observado.
+
+- Tamaño de lectura: una fracción de la ventana de congestión actual
+  (cwnd). Con RTT alto y ventana grande se leen bloques grandes; en un
+  enlace lento o con pérdidas, bloques chicos para no encolar de más.
+- Ventanas de control de flujo: ~4×BDP (ancho de banda × RTT) del peer,
+  acotadas, en vez de valores fijos.
+- Perfiles por peer: throughput, RTT y tamaño de lectura de transferencias
+  anteriores (JSON persistente), para arrancar ya ajustado.
+- Backpressure: no se lee más del disco mientras el buffer de envío de la
+  conexión supere un nivel alto (~2×cwnd); la memoria del emisor no crece
+  con el tamaño del archivo.
+- Control de congestión elegible con QUIC_CONGESTION_CONTROL si la versión
+  de aioquic lo soporta (campo congestion_control_algorithm).
+
+Las métricas se leen de `_loss` (estado interno de aioquic): si cambian de
+nombre, el emisor vuelve a los valores por defecto.
+"""
+import os
+import json
+import logging
+import time
+import copy
+import threading
+
+log = logging.getLogger("envio.tuning")
+
+MIN_CHUNK = 16 * 1024
+MAX_CHUNK = 1024 * 1024
+DEFAULT_CHUNK = 64 * 1024
+
+MIN_HIGH_WATER = 1024 * 1024
+MAX_HIGH_WATER = 64 * 1024 * 1024
+
+MIN_WINDOW = 16 * 1024 * 1024
+MAX_WINDOW = 1024 * 1024 * 1024
+
+# Peso de la última transferencia en el perfil (media móvil exponencial)
+PROFILE_ALPHA = 0.3
+
+CONGESTION_CONTROL = os.environ.get("QUIC_CONGESTION_CONTROL", "").strip().lower()
+
+
+def _default_profiles_path():
+    state_dir = os.environ.get("QUIC_STATE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
+    return os.path.join(state_dir, ".peer-profiles.json")
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, int(value)))
+
+
+def link_stats(quic):
+    """(rtt_s, bytes_in_flight, cwnd) de una QuicConnection; 0 si no hay dato"""
+    loss = getattr(quic, "_loss", None)
+    if loss is None:
+        return 0.0, 0, 0
+    rtt = getattr(loss, "_rtt_smoothed", 0.0) or 0.0
+    in_flight = getattr(loss, "bytes_in_flight", 0) or 0
+    cwnd = getattr(loss, "congestion_window", 0) or 0
+    return rtt, in_flight, cwnd
+
+
+def buffered_bytes(quic):
+    """
+    Bytes encolados en los streams de la conexión que el peer todavía no
+    confirmó, o None si esta versión de aioquic guarda el buffer con otro
+    nombre.
+    """
+    total = 0
+    for stream in list(getattr(quic, "_streams", {}).values()):
+        sender = getattr(stream, "sender", None)  # aioquic >= 1.0
+        buf = getattr(sender, "_buffer", None) if sender is not None else getattr(stream, "_send_buffer", None)
+        if buf is None:
+            return None
+        total += len(buf)
+    return total
+
+
+def high_water(quic):
+    """Nivel alto del buffer de envío: ~2 ventanas de congestión"""
+    _, _, cwnd = link_stats(quic)
+    return _clamp(2 * cwnd, MIN_HIGH_WATER, MAX_HIGH_WATER) if cwnd else MIN_HIGH_WATER * 4
+
+
+class PeerProfiles:
+    """Perfiles aprendidos por IP del peer (thread-safe, guardado atómico)"""
+
+    def __init__(self, path=None):
+        self.path = path or _default_profiles_path()
+        self._lock = threading.Lock()
+        self._profiles = None
+
+    def _load(self):
+        if self._profiles is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._profiles = json.load(f)
+            except (OSError, ValueError):
+                self._profiles = {}
+        return self._profiles
+
+    def get(self, peer):
+        with self._lock:
+            return dict(self._load().get(peer, {}))
+
+    def learn(self, peer, throughput, rtt, chunk):
+        """Incorpora el resultado de una transferencia al perfil del peer"""
+        with self._lock:
+            profiles = self._load()
+            old = profiles.get(peer, {})
+
+            def blend(key, value):
+                if not value:
+                    return old.get(key)
+                if old.get(key) is None:
+                    return value
+                return old[key] * (1 - PROFILE_ALPHA) + value * PROFILE_ALPHA
+
+            profiles[peer] = {
+                "throughput": blend("throughput", throughput),
+                "rtt": blend("rtt", rtt),
+                "chunk": _clamp(blend("chunk", chunk) or DEFAULT_CHUNK, MIN_CHUNK, MAX_CHUNK),
+                "updated": time.time(),
+            }
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp = self.path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(profiles, f, separators=(",", ":"))
+                os.replace(tmp, self.path)
+            except OSError as e:
+                log.warning("[TUNING] No se pudo guardar perfiles: %s", e)
+            return profiles[peer]
+
+
+def window_for(profile):
+    """Ventana de control de flujo ≈ 4×BDP del peer"""
+    throughput = profile.get("throughput")
+    rtt = profile.get("rtt")
+    if not throughput or not rtt:
+        return MAX_WINDOW
+    return _clamp(4 * throughput * rtt, MIN_WINDOW, MAX_WINDOW)
+
+
+def client_configuration(base, profile):
+    """Copia de la configuración cliente con ventanas y CC para este peer"""
+    config = copy.copy(base)
+    window = window_for(profile)
+    config.max_data = window
+    config.max_stream_data = window
+    if CONGESTION_CONTROL and hasattr(config, "congestion_control_algorithm"):
+        config.congestion_control_algorithm = CONGESTION_CONTROL
+    return config
+
+
+class ChunkSizer:
+    """Tamaño de la próxima lectura según la cwnd observada"""
+
+    def __init__(self, profile):
+        self.chunk = _clamp(profile.get("chunk") or DEFAULT_CHUNK, MIN_CHUNK, MAX_CHUNK)
+        self._rtt_sum = 0.0
+        self._rtt_count = 0
+        self._started = time.monotonic()
+
+    def next_size(self, quic):
+        rtt, _, cwnd = link_stats(quic)
+        if rtt:
+            self._rtt_sum += rtt
+            self._rtt_count += 1
+        if cwnd:
+            # Un cuarto de ventana por lectura: se rellena la ventana en pocas
+            # vueltas del loop sin encolar mucho más de lo que se puede enviar
+            target = _clamp(cwnd // 4, MIN_CHUNK, MAX_CHUNK)
+            self.chunk = target - target % MIN_CHUNK or MIN_CHUNK
+        return self.chunk
+
+    def summary(self, sent):
+        """(throughput B/s, rtt medio s) de esta transferencia"""
+        elapsed = time.monotonic() - self._started
+        throughput = sent / elapsed if elapsed > 0 else 0
+        rtt = self._rtt_sum / self._rtt_count if self._rtt_count else 0
+        return throughput, rtt
+
+
+profiles = PeerProfiles()
@@ -0,0 +1,524 @@
+"""
+E/S UDP por lotes para el camino de datagramas QUIC (Linux).
+
+El transporte UDP de asyncio hace una syscall por datagrama en cada
+sentido; a alto throughput eso se lleva buena parte de la CPU del
+receptor. BatchedDatagramTransport lo reemplaza en serve() / connect():
+
+- Envío: los datagramas de una misma vuelta del loop (cada transmit() de
+  aioquic genera varios) se encolan y salen juntos al final de la vuelta:
+  * UDP GSO (UDP_SEGMENT, Linux >= 4.18): una sendmsg por tanda de
+    segmentos del mismo tamaño hacia el mismo destino (hasta GSO_SEGMENTS);
+  * si no, sendmmsg: una syscall para hasta SEND_BATCH datagramas;
+  * si no, sendto uno por uno.
+- Recepción: en cada aviso del loop se vacía el socket:
+  * UDP GRO (Linux >= 5.0): cada recvmsg trae varios segmentos
+    coalescidos; el tamaño de segmento viene en el cmsg UDP_GRO;
+  * si no, recvmmsg: hasta RECV_BATCH datagramas por syscall;
+  * si no, recvfrom.
+
+recvmmsg / sendmmsg no están en el módulo socket: se llaman por ctypes a
+la libc. Lo que no existe (macOS, Windows, kernel viejo) se detecta al
+crear el socket, y lo que falla en runtime (p. ej. EIO de GSO en una
+interfaz sin soporte) se apaga para ese socket y se sigue con el camino
+siguiente.
+
+QUIC_UDP_BATCH: auto (default), plain (este transporte con una syscall por
+datagrama: la línea de base del benchmark) u off (transporte de asyncio).
+stats() cuenta syscalls, datagramas y bytes para medir syscalls/GB.
+"""
+import os
+import sys
+import errno
+import socket
+import struct
+import asyncio
+import ctypes
+import ctypes.util
+import ipaddress
+import logging
+import threading
+import contextlib
+import weakref
+from collections import deque
+
+from aioquic.asyncio.server import QuicServer
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.connection import QuicConnection
+
+log = logging.getLogger("envio.udpio")
+
+MODE = os.environ.get("QUIC_UDP_BATCH", "auto").strip().lower()
+
+SOL_UDP = getattr(socket, "SOL_UDP", 17)
+UDP_SEGMENT = 103
+UDP_GRO = 104
+
+GSO_SEGMENTS = 64
+# Tope de una tanda GSO (payload UDP máximo con IPv4 menos margen)
+GSO_MAX_BYTES = 65000
+SEND_BATCH = 64
+RECV_BATCH = 32
+# Buffer por datagrama de recvmmsg (MSG_TRUNC = más grande que esto: se descarta)
+RECV_DATAGRAM = 2048
+GRO_BUFFER = 65535
+MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0x40)
+MSG_TRUNC = getattr(socket, "MSG_TRUNC", 0x20)
+
+_RETRY = (BlockingIOError, InterruptedError)
+# Errores con los que el kernel/la interfaz no soporta GSO (sin offload de
+# checksum, segmento inválido, opción desconocida); el resto es del destino
+_GSO_UNSUPPORTED = (errno.EIO, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOPROTOOPT)
+
+
+# ---------------------------------------------------------------------------
+# recvmmsg / sendmmsg por ctypes
+# ---------------------------------------------------------------------------
+
+class _iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _msghdr), ("msg_len", ctypes.c_uint)]
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None, None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        recvmmsg, sendmmsg = libc.recvmmsg, libc.sendmmsg
+    except (OSError, AttributeError):
+        return None, None
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int]
+    return recvmmsg, sendmmsg
+
+
+_recvmmsg, _sendmmsg = _load_libc()
+
+_SOCKADDR_SIZE = 128  # sockaddr_storage
+
+
+def _oserror():
+    code = ctypes.get_errno()
+    if code in (errno.EAGAIN, errno.EWOULDBLOCK):
+        return BlockingIOError(code, os.strerror(code))
+    if code == errno.EINTR:
+        return InterruptedError(code, os.strerror(code))
+    return OSError(code, os.strerror(code))
+
+
+def _decode_sockaddr(raw):
+    """sockaddr → la misma tupla que devuelve socket.recvfrom"""
+    family = struct.unpack_from("=H", raw)[0]
+    port = struct.unpack_from("!H", raw, 2)[0]
+    if family == socket.AF_INET:
+        return socket.inet_ntop(socket.AF_INET, raw[4:8]), port
+    flowinfo = struct.unpack_from("!I", raw, 4)[0]
+    scope_id = struct.unpack_from("=I", raw, 24)[0]
+    return socket.inet_ntop(socket.AF_INET6, raw[8:24]), port, flowinfo, scope_id
+
+
+def _encode_sockaddr(family, addr):
+    host, port = addr[0], addr[1]
+    if family == socket.AF_INET:
+        return struct.pack("=H", family) + struct.pack("!H", port) + socket.inet_pton(family, host) + bytes(8)
+    if ":" not in host:
+        host = "::ffff:" + host
+    flowinfo = addr[2] if len(addr) > 2 else 0
+    scope_id = addr[3] if len(addr) > 3 else 0
+    return (struct.pack("=H", family) + struct.pack("!HI", port, flowinfo)
+            + socket.inet_pton(family, host) + struct.pack("=I", scope_id))
+
+
+class _RecvBatch:
+    """Buffers fijos de recvmmsg (se crean una vez por socket)"""
+
+    def __init__(self, count=RECV_BATCH, size=RECV_DATAGRAM):
+        self.count = count
+        self.buffers = (ctypes.c_char * (size * count))()
+        self.names = (ctypes.c_char * (_SOCKADDR_SIZE * count))()
+        self.iovecs = (_iovec * count)()
+        self.msgs = (_mmsghdr * count)()
+        base = ctypes.addressof(self.buffers)
+        names = ctypes.addressof(self.names)
+        for i in range(count):
+            self.iovecs[i].iov_base = base + i * size
+            self.iovecs[i].iov_len = size
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_name = names + i * _SOCKADDR_SIZE
+            hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            hdr.msg_iovlen = 1
+        self.size = size
+
+    def recv(self, fd):
+        for i in range(self.count):
+            self.msgs[i].msg_hdr.msg_namelen = _SOCKADDR_SIZE
+        n = _recvmmsg(fd, self.msgs, self.count, MSG_DONTWAIT, None)
+        if n < 0:
+            raise _oserror()
+        got = []
+        for i in range(n):
+            msg = self.msgs[i]
+            if msg.msg_hdr.msg_flags & MSG_TRUNC:
+                continue
+            start = i * self.size
+            name = ctypes.string_at(ctypes.addressof(self.names) + i * _SOCKADDR_SIZE, msg.msg_hdr.msg_namelen)
+            got.append((self.buffers[start:start + msg.msg_len], _decode_sockaddr(name)))
+        return n, got
+
+
+def _sendmmsg_batch(fd, family, items, names):
+    """Envía items [(data, addr)] con una syscall; devuelve cuántos salieron"""
+    count = len(items)
+    msgs = (_mmsghdr * count)()
+    iovecs = (_iovec * count)()
+    keep = []
+    for i, (data, addr) in enumerate(items):
+        name = names.get(addr)
+        if name is None:
+            if len(names) > 1024:
+                names.clear()
+            name = names[addr] = _encode_sockaddr(family, addr)
+        data_buf = ctypes.create_string_buffer(data, len(data))
+        name_buf = ctypes.create_string_buffer(name, len(name))
+        keep.append((data_buf, name_buf))
+        iovecs[i].iov_base = ctypes.addressof(data_buf)
+        iovecs[i].iov_len = len(data)
+        hdr = msgs[i].msg_hdr
+        hdr.msg_name = ctypes.addressof(name_buf)
+        hdr.msg_namelen = len(name)
+        hdr.msg_iov = ctypes.pointer(iovecs[i])
+        hdr.msg_iovlen = 1
+    sent = _sendmmsg(fd, msgs, count, MSG_DONTWAIT)
+    if sent < 0:
+        raise _oserror()
+    return sent
+
+
+# ---------------------------------------------------------------------------
+# Transporte
+# ---------------------------------------------------------------------------
+
+_stats_lock = threading.Lock()
+_closed_stats = {}
+_live = weakref.WeakSet()
+
+_STAT_KEYS = ("send_syscalls", "recv_syscalls", "datagrams_sent", "datagrams_received",
+              "bytes_sent", "bytes_received")
+
+
+def stats():
+    """Totales del proceso: syscalls, datagramas y bytes por sentido, y caminos en uso"""
+    with _stats_lock:
+        total = dict.fromkeys(_STAT_KEYS, 0)
+        for key, value in _closed_stats.items():
+            total[key] += value
+        paths = {}
+        for transport in list(_live):
+            for key in _STAT_KEYS:
+                total[key] += transport.counters[key]
+            path = f"{transport.send_path}/{transport.recv_path}"
+            paths[path] = paths.get(path, 0) + 1
+    total["paths"] = paths
+    total["mode"] = MODE
+    return total
+
+
+def merge(all_stats):
+    """Suma los stats() de varios procesos (workers QUIC)"""
+    total = dict.fromkeys(_STAT_KEYS, 0)
+    paths = {}
+    for stats in all_stats:
+        for key in _STAT_KEYS:
+            total[key] += stats.get(key, 0)
+        for path, count in stats.get("paths", {}).items():
+            paths[path] = paths.get(path, 0) + count
+    total["paths"] = paths
+    total["mode"] = MODE
+    return total
+
+
+class BatchedDatagramTransport(asyncio.DatagramTransport):
+    def __init__(self, loop, sock, protocol, mode=None):
+        super().__init__()
+        self._loop = loop
+        self._sock = sock
+        self._fd = sock.fileno()
+        self._family = sock.family
+        self._protocol = protocol
+        self._pending = deque()
+        self._flush_handle = None
+        self._writing = False
+        self._closing = False
+        self._names = {}
+        self.counters = dict.fromkeys(_STAT_KEYS, 0)
+        self._gso = self._gro = False
+        self._recv_batch = None
+        batched = (mode or MODE) != "plain"
+        if batched and sys.platform.startswith("linux"):
+            try:
+                sock.getsockopt(SOL_UDP, UDP_SEGMENT)
+                self._gso = True
+            except OSError:
+                pass
+            try:
+                sock.setsockopt(SOL_UDP, UDP_GRO, 1)
+                self._gro = True
+            except OSError:
+                pass
+        self._mmsg = batched and _sendmmsg is not None
+        if batched and not self._gro and _recvmmsg is not None:
+            self._recv_batch = _RecvBatch()
+        with _stats_lock:
+            _live.add(self)
+        protocol.connection_made(self)
+        loop.add_reader(self._fd, self._on_readable)
+
+    @property
+    def send_path(self):
+        return "gso" if self._gso else "sendmmsg" if self._mmsg else "sendto"
+
+    @property
+    def recv_path(self):
+        return "gro" if self._gro else "recvmmsg" if self._recv_batch else "recvfrom"
+
+    # -- asyncio.DatagramTransport ------------------------------------------
+
+    def get_extra_info(self, name, default=None):
+        if name == "socket":
+            return self._sock
+        if name == "sockname":
+            return self._sock.getsockname()
+        return default
+
+    def is_closing(self):
+        return self._closing
+
+    def sendto(self, data, addr=None):
+        if self._closing:
+            return
+        self._pending.append((bytes(data), addr))
+        if self._flush_handle is None and not self._writing:
+            # Al final de esta vuelta del loop: junta todo lo de los transmit() de ahora
+            self._flush_handle = self._loop.call_soon(self._flush)
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._flush()
+        self._loop.remove_reader(self._fd)
+        if self._writing:
+            self._loop.remove_writer(self._fd)
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        with _stats_lock:
+            _live.discard(self)
+            for key in _STAT_KEYS:
+                _closed_stats[key] = _closed_stats.get(key, 0) + self.counters[key]
+        self._sock.close()
+        self._loop.call_soon(self._protocol.connection_lost, None)
+
+    def abort(self):
+        self._pending.clear()
+        self.close()
+
+    # -- envío -----------------------------------------------------------------
+
+    def _flush(self):
+        self._flush_handle = None
+        pending = self._pending
+        counters = self.counters
+        while pending:
+            try:
+                count, nbytes = self._send_some(pending)
+            except _RETRY:
+                if not self._writing and not self._closing:
+                    self._writing = True
+                    self._loop.add_writer(self._fd, self._on_writable)
+                return
+            except OSError as e:
+                # Error de un destino (p. ej. inalcanzable): se descarta ese datagrama
+                pending.popleft()
+                counters["send_syscalls"] += 1
+                self._protocol.error_received(e)
+                continue
+            counters["send_syscalls"] += 1
+            counters["datagrams_sent"] += count
+            counters["bytes_sent"] += nbytes
+            for _ in range(count):
+                pending.popleft()
+
+    def _on_writable(self):
+        self._writing = False
+        self._loop.remove_writer(self._fd)
+        self._flush()
+
+    def _send_some(self, pending):
+        """Una syscall; devuelve (datagramas, bytes) enviados"""
+        if self._gso:
+            run = self._gso_run(pending)
+            if len(run) > 1:
+                try:
+                    return self._send_gso(run)
+                except _RETRY:
+                    raise
+                except OSError as e:
+                    if e.errno not in _GSO_UNSUPPORTED:
+                        raise  # p. ej. ECONNREFUSED: error de envío, GSO sigue
+                    log.warning("[UDP] GSO desactivado (%s): sigue %s", e, "sendmmsg" if self._mmsg else "sendto")
+                    self._gso = False
+        if self._mmsg and len(pending) > 1:
+            items = [pending[i] for i in range(min(len(pending), SEND_BATCH))]
+            sent = _sendmmsg_batch(self._fd, self._family, items, self._names)
+            return sent, sum(len(data) for data, _ in items[:sent])
+        data, addr = pending[0]
+        self._sock.sendto(data, addr)
+        return 1, len(data)
+
+    @staticmethod
+    def _gso_run(pending):
+        """Datagramas consecutivos al mismo destino y del mismo tamaño (el último puede ser menor)"""
+        first, addr = pending[0]
+        size = len(first)
+        run = [first]
+        total = size
+        for i in range(1, min(len(pending), GSO_SEGMENTS)):
+            data, other = pending[i]
+            if other != addr or len(data) > size or total + len(data) > GSO_MAX_BYTES:
+                break
+            run.append(data)
+            total += len(data)
+            if len(data) < size:
+                break
+        return run
+
+    def _send_gso(self, run):
+        payload = b"".join(run)
+        addr = self._pending[0][1]
+        self._sock.sendmsg([payload], [(SOL_UDP, UDP_SEGMENT, struct.pack("=H", len(run[0])))], 0, addr)
+        return len(run), len(payload)
+
+    # -- recepción ---------------------------------------------------------------
+
+    def _on_readable(self):
+        counters = self.counters
+        while not self._closing:
+            try:
+                received, datagrams = self._recv_some()
+            except _RETRY:
+                return
+            except OSError as e:
+                self._protocol.error_received(e)
+                return
+            counters["recv_syscalls"] += 1
+            for data, addr in datagrams:
+                counters["datagrams_received"] += 1
+                counters["bytes_received"] += len(data)
+                self._protocol.datagram_received(data, addr)
+            if self._recv_batch is not None and received < self._recv_batch.count:
+                return  # el socket quedó vacío
+
+    def _recv_some(self):
+        if self._gro:
+            data, ancdata, _flags, addr = self._sock.recvmsg(GRO_BUFFER, socket.CMSG_SPACE(4))
+            segment = 0
+            for level, kind, cdata in ancdata:
+                if level == SOL_UDP and kind == UDP_GRO:
+                    segment = struct.unpack("=i", cdata[:4])[0]
+            if not segment or segment >= len(data):
+                return 1, [(data, addr)]
+            return 1, [(data[i:i + segment], addr) for i in range(0, len(data), segment)]
+        if self._recv_batch is not None:
+            return self._recv_batch.recv(self._fd)
+        data, addr = self._sock.recvfrom(GRO_BUFFER)
+        return 1, [(data, addr)]
+
+
+# ---------------------------------------------------------------------------
+# serve() / connect() con este transporte
+# ---------------------------------------------------------------------------
+
+async def create_endpoint(protocol_factory, local_addr, reuse_port=False):
+    """Como loop.create_datagram_endpoint(local_addr=...), con BatchedDatagramTransport"""
+    loop = asyncio.get_event_loop()
+    if MODE == "off":
+        return await loop.create_datagram_endpoint(protocol_factory, local_addr=local_addr,
+                                                   reuse_port=reuse_port or None)
+    family = socket.AF_INET6 if ":" in local_addr[0] else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        if family == socket.AF_INET6:
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(local_addr)
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        raise
+    protocol = protocol_factory()
+    return BatchedDatagramTransport(loop, sock, protocol), protocol
+
+
+async def serve(host, port, *, configuration, create_protocol, reuse_port=False, **kwargs):
+    """aioquic.asyncio.serve con E/S UDP por lotes"""
+    _, server = await create_endpoint(
+        lambda: QuicServer(configuration=configuration, create_protocol=create_protocol, **kwargs),
+        local_addr=(host, port),
+        reuse_port=reuse_port,
+    )
+    return server
+
+
+@contextlib.asynccontextmanager
+async def connect(host, port, *, configuration=None, create_protocol, session_ticket_handler=None,
+                  wait_connected=True, local_port=0):
+    """aioquic.asyncio.connect con E/S UDP por lotes (mismos argumentos)"""
+    loop = asyncio.get_event_loop()
+    local_host = "::"
+    try:
+        ipaddress.ip_address(host)
+        server_name = None
+    except ValueError:
+        server_name = host
+    infos = await loop.getaddrinfo(host, port, type=socket.SOCK_DGRAM)
+    addr = infos[0][4]
+    if len(addr) == 2:
+        if sys.platform == "win32":
+            local_host = "0.0.0.0"
+        else:
+            addr = ("::ffff:" + addr[0], addr[1], 0, 0)
+    if configuration is None:
+        configuration = QuicConfiguration(is_client=True)
+    if server_name is not None:
+        configuration.server_name = server_name
+    connection = QuicConnection(configuration=configuration, session_ticket_handler=session_ticket_handler)
+
+    transport, protocol = await create_endpoint(lambda: create_protocol(connection), (local_host, local_port))
+    try:
+        protocol.connect(addr)
+        if wait_connected:
+            await protocol.wait_connected()
+        try:
+            yield protocol
+        finally:
+            protocol.close()
+        await protocol.wait_closed()
+    finally:
+        transport.close()
@@ -0,0 +1,192 @@
+"""
+Índice en memoria de los videos de Descargas para /api/videos.
+
+Se llena con un único os.scandir al arrancar y después se mantiene con los
+eventos de DirWatcher, así que servir la lista no toca el disco. Cada cambio
+incrementa `version`; el JSON ordenado se cachea por versión y los clientes
+pueden esperar (long-polling) a que la versión cambie.
+"""
+import os
+import json
+import logging
+import time
+import uuid
+import threading
+
+from . import handoff, filemeta
+from .dirwatch import DirWatcher, IN_MODIFY, DEFAULT_MASK, MODIFIED, DELETED, RESCAN
+
+log = logging.getLogger("envio.video_index")
+
+VIDEO_EXTENSIONS = {'.mp4', '.webm', '.mkv', '.avi', '.mov', '.flv', '.m3u8', '.ts', '.m4v'}
+
+# Durante una recepción IN_MODIFY llega por cada write: refrescar como mucho 1/s
+MODIFY_REFRESH_INTERVAL = 1.0
+
+
+def is_video_name(name):
+    """Videos finales y también sus .partial (se pueden ver mientras llegan)"""
+    if handoff.is_partial_name(name):
+        name = handoff.final_name(name)
+    lower = name.lower()
+    return any(lower.endswith(ext) for ext in VIDEO_EXTENSIONS)
+
+
+def _make_entry(name, path, st):
+    partial = handoff.is_partial_name(name)
+    final = handoff.final_name(name) if partial else name
+    # El sidecar se escribe antes del rename, así que ya está al indexar
+    meta = filemeta.read_sidecar(os.path.join(os.path.dirname(path), final)) or {}
+    return {
+        "name": final,
+        "size": f"{st.st_size / (1024 * 1024):.1f} MB",
+        "path": path,
+        "mtime": st.st_mtime,
+        "partial": partial,
+        "action": meta.get("action"),
+        "schedule": meta.get("schedule"),
+        "sender": meta.get("sender"),
+    }
+
+
+class VideoIndex:
+    """Lista de videos ordenada por mtime (más reciente primero), con versión/ETag"""
+
+    def __init__(self, directory, listener=None):
+        """listener(event_type, **data) recibe video_indexed/video_updated/video_removed"""
+        self.directory = directory
+        self.listener = listener
+        self.version = 0
+        self._instance = uuid.uuid4().hex[:8]  # ETags distintos tras reiniciar
+        self._entries = {}
+        self._sorted = None
+        self._json_cache = {}
+        self._last_refresh = {}
+        self._cond = threading.Condition()
+        self._watcher = None
+
+    def start(self):
+        self._watcher = DirWatcher(
+            self.directory,
+            self._on_event,
+            mask=DEFAULT_MASK | IN_MODIFY,
+            poll_interval=2.0,
+            name_filter=is_video_name,
+        ).start()
+        self.rescan()
+        return self
+
+    @property
+    def etag(self):
+        return f'"{self._instance}-{self.version}"'
+
+    def _stat_entry(self, name):
+        path = os.path.join(self.directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        return _make_entry(name, path, st)
+
+    def _bump(self):
+        """Llamar con self._cond tomado"""
+        self.version += 1
+        self._sorted = None
+        self._json_cache.clear()
+        self._cond.notify_all()
+
+    def rescan(self):
+        """Reconstruye el índice completo (arranque o desbordamiento de eventos)"""
+        entries = {}
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not is_video_name(entry.name):
+                        continue
+                    try:
+                        if not entry.is_file():
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries[entry.name] = _make_entry(entry.name, entry.path, st)
+        except OSError as e:
+            log.error("Error listing videos: %s", e)
+        with self._cond:
+            if entries != self._entries:
+                self._entries = entries
+                self._bump()
+
+    def _notify(self, event_type, **data):
+        if self.listener:
+            self.listener(event_type, version=self.version, **data)
+
+    def _on_event(self, kind, name):
+        if kind == RESCAN:
+            self.rescan()
+            self._notify("video_updated", name=None)
+            return
+
+        if kind == DELETED:
+            with self._cond:
+                self._last_refresh.pop(name, None)
+                removed = self._entries.pop(name, None) is not None
+                if removed:
+                    self._bump()
+            if removed:
+                self._notify("video_removed", name=name)
+            return
+
+        now = time.monotonic()
+        if kind == MODIFIED and now - self._last_refresh.get(name, 0) < MODIFY_REFRESH_INTERVAL:
+            return
+        self._last_refresh[name] = now
+
+        entry = self._stat_entry(name)
+        event_type = None
+        with self._cond:
+            previous = self._entries.get(name)
+            if entry is None:
+                if self._entries.pop(name, None) is not None:
+                    self._bump()
+                    event_type = "video_removed"
+            elif previous != entry:
+                self._entries[name] = entry
+                self._bump()
+                event_type = "video_updated" if previous else "video_indexed"
+        if event_type == "video_removed":
+            self._notify(event_type, name=name)
+        elif event_type:
+            self._notify(event_type, name=entry["name"], size=entry["size"],
+                         mtime=entry["mtime"], partial=entry["partial"])
+
+    def _sorted_entries(self):
+        """Llamar con self._cond tomado"""
+        if self._sorted is None:
+            # Un .partial se oculta en cuanto existe el archivo final con su nombre
+            visible = [v for k, v in self._entries.items()
+                       if not (v["partial"] and v["name"] in self._entries)]
+            self._sorted = sorted(visible, key=lambda v: v["mtime"], reverse=True)
+        return self._sorted
+
+    def snapshot(self, offset=0, limit=None):
+        """
+        Devuelve (version, etag, total, json) de la página pedida.
+        El JSON se serializa una vez por versión y página.
+        """
+        with self._cond:
+            key = (offset, limit)
+            cached = self._json_cache.get(key)
+            items = self._sorted_entries()
+            if cached is None:
+                page = items[offset:offset + limit] if limit is not None else items[offset:]
+                cached = json.dumps(page)
+                self._json_cache[key] = cached
+            return self.version, self.etag, len(items), cached
+
+    def wait_for_change(self, etag, timeout):
+        """Bloquea hasta que el ETag deje de ser `etag` o pase `timeout`. True si cambió"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.etag != etag, timeout=timeout)
@@ -0,0 +1,622 @@
+#!/usr/bin/env python3
+"""
+Benchmark de transferencias por loopback (HTTP, QUIC y TCP).
+
+Levanta el receptor real (run_flask + run_quic_server) en un subproceso
+con HOME temporal y envía con send_file_to_ip forzando un transporte por
+vez. Entre emisor y receptor puede ir un proxy que emula latencia y
+pérdida (estilo tc netem, en proceso, sin root).
+
+Por cada combinación transporte × tamaño × concurrencia escribe una línea
+JSON con MB/s, tiempo hasta el primer byte en el receptor, CPU y RSS pico
+de cada lado, para comparar entre commits.
+
+    python3 bench.py --sizes 1K,1M,100M --concurrency 1,4 --out bench.jsonl
+    python3 bench.py --transports quic --sizes 2G --delay-ms 40 --loss 0.01
+
+Notas:
+- Usa los puertos 9999 (UDP y TCP) del receptor: no correr con la app
+  levantada en la misma máquina.
+- TTFB = creación del `.partial` en el receptor (HTTP/QUIC) o primer byte
+  en el sumidero (TCP). Este árbol no tiene receptor TCP plano: "tcp" no
+  está en los transportes por defecto y, pedido a mano (--transports tcp),
+  se mide contra un sumidero que solo cuenta bytes. Es una línea base de
+  throughput crudo, no una entrega: sale con "ok": false y "sent": true.
+- CPU/RSS se leen de /proc (Linux).
+- --log-level se pasa a ambos lados (LOG_LEVEL). Para medir el costo del
+  logging por chunk: --log-level DEBUG con LOG_RATE_BURST=1000000 (una
+  línea por evento, como antes) contra el default INFO.
+- Carga mixta: --probe-ms 20 pide /api/videos al tier HTTP cada 20 ms
+  mientras corren las transferencias y reporta su latencia p50/p95/p99.
+  --layout split levanta el receptor con el supervisor (Flask y QUIC en
+  procesos separados) para compararlo con el default "thread":
+
+    python3 bench.py --transports quic --sizes 1G --probe-ms 20 --layout thread
+    python3 bench.py --transports quic --sizes 1G --probe-ms 20 --layout split
+- --loop asyncio|uvloop elige el event loop de emisor y receptor
+  (QUIC_LOOP). Cada corrida reporta datagramas UDP por segundo (de
+  /proc/net/snmp: todo el host, así que mejor con la máquina en reposo) y
+  segundos de CPU por GB de cada lado:
+
+    python3 bench.py --transports quic --sizes 1G --loop asyncio
+    python3 bench.py --transports quic --sizes 1G --loop uvloop
+- --udp-batch elige la E/S UDP de ambos lados (QUIC_UDP_BATCH): "plain"
+  hace una syscall por datagrama (como el transporte de asyncio) y
+  "auto" agrupa con GSO/GRO o sendmmsg/recvmmsg. Cada corrida reporta las
+  syscalls UDP de cada lado y por GB (con "off" no hay contadores):
+
+    python3 bench.py --transports quic --sizes 1G --udp-batch plain
+    python3 bench.py --transports quic --sizes 1G --udp-batch auto
+- --resumption off desactiva tickets TLS y 0-RTT (QUIC_RESUMPTION). Con
+  archivos chicos repetidos (como las alertas .msg) la primera corrida
+  hace el handshake completo y las siguientes van en 0-RTT; "seconds" es
+  el tiempo de entrega y "handshakes" cuenta full / resumed / early_data:
+
+    python3 bench.py --transports quic --sizes 1K --concurrency 1 --repeat 20 --delay-ms 40 --resumption off
+    python3 bench.py --transports quic --sizes 1K --concurrency 1 --repeat 20 --delay-ms 40 --resumption on
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import itertools
+import socket
+import asyncio
+import argparse
+import tempfile
+import resource
+import threading
+import subprocess
+import contextlib
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RECEIVER_PORT = 9999
+# Puertos de los proxies netem / sumidero TCP del emisor
+PROXY_QUIC_PORT = 19999
+PROXY_HTTP_PORT = 19998
+TCP_SINK_PORT = 19997
+
+
+def parse_size(text):
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    text = text.strip().upper().rstrip("B")
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+# ---------------------------------------------------------------------------
+# /proc: CPU y RSS pico por proceso
+# ---------------------------------------------------------------------------
+
+def proc_cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime y stime son los campos 14 y 15 (índices 11 y 12 tras el nombre)
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def proc_tree(pid):
+    """pid y todos sus descendientes (el receptor supervisado tiene hijos)"""
+    pids = [pid]
+    for current in pids:
+        try:
+            for tid in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{tid}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def tree_cpu_seconds(pid):
+    total = 0.0
+    for child in proc_tree(pid):
+        try:
+            total += proc_cpu_seconds(child)
+        except OSError:
+            pass
+    return total
+
+
+def tree_peak_rss_mb(pid):
+    peaks = []
+    for child in proc_tree(pid):
+        try:
+            peaks.append(proc_peak_rss_mb(child) or 0)
+        except OSError:
+            pass
+    return round(sum(peaks), 1)
+
+
+def proc_peak_rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def udp_datagrams():
+    """Datagramas UDP recibidos + enviados por el host (Linux)"""
+    try:
+        with open("/proc/net/snmp") as f:
+            rows = [line.split() for line in f if line.startswith("Udp:")]
+    except OSError:
+        return None
+    counters = dict(zip(rows[0][1:], (int(v) for v in rows[1][1:])))
+    return counters["InDatagrams"] + counters["OutDatagrams"]
+
+
+def receiver_udp_stats():
+    """Contadores de E/S UDP del receptor (udpio, vía /api/udp)"""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{RECEIVER_PORT}/api/udp", timeout=5) as response:
+            return json.load(response)
+    except (OSError, ValueError):
+        return None
+
+
+def udp_syscalls(before, after):
+    if before is None or after is None:
+        return None
+    return sum(after[k] - before[k] for k in ("send_syscalls", "recv_syscalls"))
+
+
+def reset_peak_rss(pid):
+    """Reinicia VmHWM (Linux >= 4.0); si no se puede, el pico es acumulado"""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+# ---------------------------------------------------------------------------
+# Emulación de red (netem en proceso)
+# ---------------------------------------------------------------------------
+
+class Netem:
+    def __init__(self, delay_ms=0.0, jitter_ms=0.0, loss=0.0):
+        self.delay_ms = delay_ms
+        self.jitter_ms = jitter_ms
+        self.loss = loss
+
+    @property
+    def active(self):
+        return bool(self.delay_ms or self.jitter_ms or self.loss)
+
+    def delay(self):
+        jitter = random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.delay_ms + jitter) / 1000
+
+    def drop(self):
+        return self.loss and random.random() < self.loss
+
+
+class _UdpUpstream(asyncio.DatagramProtocol):
+    def __init__(self, relay, client_addr):
+        self.relay = relay
+        self.client_addr = client_addr
+        self.transport = None
+        # Datagramas que llegan mientras se abre el socket (el 0-RTT va detrás del Initial)
+        self.pending = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.relay.forward(self.relay.transport, data, self.client_addr)
+
+
+class UdpRelay(asyncio.DatagramProtocol):
+    """Proxy UDP con retardo y pérdida en ambos sentidos (QUIC)"""
+
+    def __init__(self, netem, upstream_port):
+        self.netem = netem
+        self.upstream_port = upstream_port
+        self.transport = None
+        self._upstreams = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def forward(self, transport, data, addr):
+        if self.netem.drop():
+            return
+        delay = self.netem.delay()
+        if delay:
+            asyncio.get_event_loop().call_later(delay, transport.sendto, data, addr)
+        else:
+            transport.sendto(data, addr)
+
+    def datagram_received(self, data, addr):
+        upstream = self._upstreams.get(addr)
+        if upstream is None:
+            upstream = _UdpUpstream(self, addr)
+            self._upstreams[addr] = upstream
+            upstream.pending.append(data)
+            asyncio.ensure_future(self._open_upstream(upstream))
+            return
+        if upstream.transport is None:
+            upstream.pending.append(data)
+            return
+        self.forward(upstream.transport, data, None)
+
+    async def _open_upstream(self, upstream):
+        loop = asyncio.get_event_loop()
+        await loop.create_datagram_endpoint(lambda: upstream, remote_addr=("127.0.0.1", self.upstream_port))
+        for data in upstream.pending:
+            self.forward(upstream.transport, data, None)
+        upstream.pending = []
+
+
+async def _tcp_pipe(reader, writer, netem):
+    """Copia con retardo de latencia (no de throughput): cola con hora de entrega"""
+    queue = asyncio.Queue()
+
+    async def pump():
+        while True:
+            data = await reader.read(256 * 1024)
+            await queue.put((time.monotonic() + netem.delay(), data))
+            if not data:
+                return
+
+    async def deliver():
+        while True:
+            due, data = await queue.get()
+            wait = due - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if not data:
+                writer.close()
+                return
+            writer.write(data)
+            await writer.drain()
+
+    try:
+        await asyncio.gather(pump(), deliver())
+    except (ConnectionError, OSError):
+        writer.close()
+
+
+def tcp_relay(netem, upstream_port):
+    async def handle(reader, writer):
+        try:
+            up_reader, up_writer = await asyncio.open_connection("127.0.0.1", upstream_port)
+        except OSError:
+            writer.close()
+            return
+        await asyncio.gather(_tcp_pipe(reader, up_writer, netem), _tcp_pipe(up_reader, writer, netem))
+    return handle
+
+
+class TcpSink:
+    """Sumidero del envío TCP plano ("nombre\\0" + datos): cuenta bytes"""
+
+    def __init__(self):
+        self.first_byte = {}
+        self.received = {}
+        self._ids = itertools.count()
+
+    async def handle(self, reader, writer):
+        start_key = next(self._ids)
+        first = True
+        total = 0
+        while True:
+            data = await reader.read(256 * 1024)
+            if not data:
+                break
+            if first:
+                self.first_byte[start_key] = time.monotonic()
+                first = False
+            total += len(data)
+        self.received[start_key] = total
+        writer.close()
+
+
+class Network:
+    """Loop en un hilo propio con los proxies y el sumidero TCP"""
+
+    def __init__(self, netem):
+        self.netem = netem
+        self.sink = TcpSink()
+        self.loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+        self._ready.wait(10)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._start())
+        self._ready.set()
+        self.loop.run_forever()
+
+    async def _start(self):
+        await asyncio.start_server(self.sink.handle, "127.0.0.1", TCP_SINK_PORT)
+        if self.netem.active:
+            await self.loop.create_datagram_endpoint(
+                lambda: UdpRelay(self.netem, RECEIVER_PORT), local_addr=("127.0.0.1", PROXY_QUIC_PORT))
+            await asyncio.start_server(tcp_relay(self.netem, RECEIVER_PORT), "127.0.0.1", PROXY_HTTP_PORT)
+
+
+# ---------------------------------------------------------------------------
+# Receptor (subproceso)
+# ---------------------------------------------------------------------------
+
+def receiver_main(home, layout):
+    """Modo --receiver: la app real con HOME temporal"""
+    os.environ["HOME"] = home
+    os.environ["QUIC_STATE_DIR"] = os.path.join(home, "state")
+    os.makedirs(os.path.join(home, "Descargas"), exist_ok=True)
+    # Los certificados se cargan con ruta relativa "certs/..."
+    os.chdir(HERE)
+    sys.path.insert(0, HERE)
+    if layout == "split":
+        os.environ["QUIC_SUPERVISE"] = "1"
+        import run
+        run.main()
+        return
+    from app.client import run_flask, run_quic_server
+    threading.Thread(target=run_flask, daemon=True).start()
+    asyncio.run(run_quic_server())
+
+
+def start_receiver(home, log_path, layout="thread"):
+    log = open(log_path, "wb")
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--receiver", home, "--layout", layout],
+        stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"el receptor terminó al iniciar (ver {log_path})")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{RECEIVER_PORT}/api/qos", timeout=1)
+            # El servidor QUIC arranca en paralelo (en otro proceso con --layout split)
+            time.sleep(0.5 if layout == "thread" else 2.0)
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("el receptor no respondió en 30 s")
+
+
+# ---------------------------------------------------------------------------
+# Corridas
+# ---------------------------------------------------------------------------
+
+def make_payload(directory, size):
+    path = os.path.join(directory, f"payload_{size}.bin")
+    if not os.path.exists(path):
+        block = os.urandom(min(size, 4 * 1024 * 1024)) if size else b""
+        with open(path, "wb") as f:
+            left = size
+            while left > 0:
+                f.write(block[:left])
+                left -= len(block)
+    return path
+
+
+class HttpProbe:
+    """Pide `path` al tier HTTP cada `interval` s y guarda la latencia de cada respuesta"""
+
+    def __init__(self, interval, path="/api/videos"):
+        self.interval = interval
+        self.url = f"http://127.0.0.1:{RECEIVER_PORT}{path}"
+        self.latencies = []
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                urllib.request.urlopen(self.url, timeout=10).read()
+                self.latencies.append(time.monotonic() - started)
+            except OSError:
+                self.errors += 1
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        ordered = sorted(self.latencies)
+
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2) if ordered else None
+
+        return {"http_probes": len(ordered), "http_errors": self.errors,
+                "http_p50_ms": pct(0.50), "http_p95_ms": pct(0.95), "http_p99_ms": pct(0.99)}
+
+
+def run_case(client, network, receiver, downloads, payload, size, transport, concurrency, probe_ms=0):
+    from app.dirwatch import DirWatcher
+    from app import handoff
+
+    metas = [client.build_send_meta(payload, f"bench_{transport}_{size}_{i}.bin") for i in range(concurrency)]
+    first_seen = {}
+
+    def on_event(kind, name):
+        if handoff.is_partial_name(name):
+            first_seen.setdefault(handoff.final_name(name), time.monotonic())
+
+    watcher = DirWatcher(downloads, on_event).start()
+    network.sink.first_byte.clear()
+    reset_peak_rss(os.getpid())
+    for pid in proc_tree(receiver.pid):
+        reset_peak_rss(pid)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    receiver_cpu = tree_cpu_seconds(receiver.pid)
+    datagrams = udp_datagrams()
+    sender_udp = client.udpio.stats()
+    handshakes = client.resumption.handshakes()["client"]
+    receiver_udp = receiver_udp_stats()
+    results = [None] * concurrency
+
+    def send(i):
+        results[i] = asyncio.run(client.send_file_to_ip("127.0.0.1", payload, meta=metas[i], transports=(transport,)))
+
+    probe = HttpProbe(probe_ms / 1000) if probe_ms else contextlib.nullcontext()
+    start = time.monotonic()
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(concurrency)]
+    with contextlib.redirect_stdout(io.StringIO()), probe:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    elapsed = time.monotonic() - start
+    watcher.stop()
+
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    if datagrams is not None:
+        datagrams = udp_datagrams() - datagrams
+    sender_syscalls = udp_syscalls(sender_udp, client.udpio.stats())
+    receiver_syscalls = udp_syscalls(receiver_udp, receiver_udp_stats())
+    handshakes = {mode: count - handshakes[mode] for mode, count in client.resumption.handshakes()["client"].items()}
+    if client.udpio.MODE == "off":
+        # Transporte de asyncio: sin contadores
+        sender_syscalls = receiver_syscalls = None
+    sender_cpu = (after.ru_utime + after.ru_stime) - (usage.ru_utime + usage.ru_stime)
+    receiver_cpu = tree_cpu_seconds(receiver.pid) - receiver_cpu
+    firsts = list(network.sink.first_byte.values()) if transport == "tcp" else list(first_seen.values())
+    ttfb = sorted(t - start for t in firsts)
+    sent = all(r == transport for r in results)
+    # Entregado = confirmado por el receptor; TCP no tiene ACK
+    ok = sent and transport in client.TRANSPORTS
+    total = size * concurrency
+    gb = total / 1024 ** 3
+
+    for name in os.listdir(downloads):
+        path = os.path.join(downloads, name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    result = {
+        "transport": transport,
+        "size": size,
+        "concurrency": concurrency,
+        "ok": ok,
+        "sent": sent,
+        "seconds": round(elapsed, 4),
+        "mb_per_s": round(total / (1024 * 1024) / elapsed, 2) if sent and elapsed else None,
+        "ttfb_ms": round(ttfb[len(ttfb) // 2] * 1000, 1) if ttfb else None,
+        "sender_cpu_s": round(sender_cpu, 3),
+        "sender_peak_rss_mb": proc_peak_rss_mb(os.getpid()),
+        "receiver_cpu_s": round(receiver_cpu, 3),
+        "receiver_peak_rss_mb": tree_peak_rss_mb(receiver.pid),
+        "sender_cpu_s_per_gb": round(sender_cpu / gb, 3) if sent and gb else None,
+        "receiver_cpu_s_per_gb": round(receiver_cpu / gb, 3) if sent and gb else None,
+        "udp_datagrams": datagrams,
+        "udp_datagrams_per_s": round(datagrams / elapsed) if datagrams is not None and elapsed else None,
+        "sender_udp_syscalls": sender_syscalls,
+        "receiver_udp_syscalls": receiver_syscalls,
+        "sender_udp_syscalls_per_gb": round(sender_syscalls / gb) if sender_syscalls is not None and sent and gb else None,
+        "receiver_udp_syscalls_per_gb": round(receiver_syscalls / gb) if receiver_syscalls is not None and sent and gb else None,
+        "handshakes": handshakes,
+    }
+    if probe_ms:
+        result.update(probe.summary())
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--transports", default="http,quic",
+                        help="http,quic; tcp = sumidero sin ACK (línea base, no cuenta como entrega)")
+    parser.add_argument("--sizes", default="1K,1M,100M", help="p. ej. 1K,64M,2G")
+    parser.add_argument("--concurrency", default="1,4", help="envíos simultáneos (peers simulados)")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--delay-ms", type=float, default=0.0, help="retardo por sentido")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--loss", type=float, default=0.0, help="pérdida UDP (0-1)")
+    parser.add_argument("--out", default="-", help="archivo JSONL (- = stdout)")
+    parser.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "INFO"),
+                        help="nivel de log de emisor y receptor")
+    parser.add_argument("--probe-ms", type=float, default=0.0,
+                        help="carga mixta: GET /api/videos cada N ms durante cada corrida (0 = no)")
+    parser.add_argument("--layout", choices=("thread", "split"), default="thread",
+                        help="receptor con Flask en un hilo (thread) o en procesos supervisados (split)")
+    parser.add_argument("--loop", choices=("auto", "asyncio", "uvloop"), default=os.environ.get("QUIC_LOOP", "auto"),
+                        help="event loop de emisor y receptor (QUIC_LOOP)")
+    parser.add_argument("--udp-batch", choices=("auto", "plain", "off"), default=os.environ.get("QUIC_UDP_BATCH", "auto"),
+                        help="E/S UDP de emisor y receptor (QUIC_UDP_BATCH)")
+    parser.add_argument("--resumption", choices=("on", "off"), default="on",
+                        help="tickets TLS y 0-RTT en emisor y receptor (QUIC_RESUMPTION)")
+    parser.add_argument("--receiver", metavar="HOME", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    # Antes de importar la app; el receptor lo hereda por el entorno
+    os.environ["LOG_LEVEL"] = args.log_level.upper()
+    os.environ["QUIC_LOOP"] = args.loop
+    os.environ["QUIC_UDP_BATCH"] = args.udp_batch
+    os.environ["QUIC_RESUMPTION"] = "1" if args.resumption == "on" else "0"
+
+    if args.receiver:
+        receiver_main(args.receiver, args.layout)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="quic-bench-")
+    os.environ["QUIC_STATE_DIR"] = os.path.join(workdir, "sender-state")
+    sys.path.insert(0, HERE)
+    # Antes que client (que llama a setup() con stdout): con --out - el
+    # stdout es el JSONL y los logs del emisor van a stderr
+    from app import logs
+    logs.setup(stream=sys.stderr)
+    from app import client
+
+    netem = Netem(args.delay_ms, args.jitter_ms, args.loss)
+    network = Network(netem)
+    client.PEER_TCP_PORT = TCP_SINK_PORT
+    if netem.active:
+        client.PEER_QUIC_PORT = PROXY_QUIC_PORT
+        client.PEER_HTTP_PORT = PROXY_HTTP_PORT
+
+    receiver_home = os.path.join(workdir, "receiver")
+    downloads = os.path.join(receiver_home, "Descargas")
+    receiver = start_receiver(receiver_home, os.path.join(workdir, "receiver.log"), args.layout)
+    out = sys.stdout if args.out == "-" else open(args.out, "a", encoding="utf-8")
+    environment = {"delay_ms": args.delay_ms, "jitter_ms": args.jitter_ms, "loss": args.loss,
+                   "log_level": os.environ["LOG_LEVEL"], "layout": args.layout,
+                   "loop": client.loops.current(), "udp_batch": args.udp_batch,
+                   "resumption": args.resumption,
+                   "python": sys.version.split()[0], "ts": time.time()}
+    try:
+        for size in (parse_size(s) for s in args.sizes.split(",")):
+            payload = make_payload(workdir, size)
+            for concurrency in (int(c) for c in args.concurrency.split(",")):
+                for transport in args.transports.split(","):
+                    for _ in range(args.repeat):
+                        result = run_case(client, network, receiver, downloads, payload,
+                                          size, transport, concurrency, args.probe_ms)
+                        result.update(environment)
+                        out.write(json.dumps(result) + "\n")
+                        out.flush()
+                        # 1K por HTTP redondea a 0.0 MB/s y es un envío válido
+                        speed = "FALLÓ" if result["mb_per_s"] is None else result["mb_per_s"]
+                        print(f"{transport:>5} {size:>12} B ×{concurrency:<3} "
+                              f"{speed:>8} MB/s  ttfb {result['ttfb_ms']} ms"
+                              + ("" if result["ok"] or not result["sent"] else "  (sin ACK)")
+                              + (f"  http p95 {result['http_p95_ms']} ms" if args.probe_ms else ""),
+                              file=sys.stderr)
+    finally:
+        receiver.terminate()
+        receiver.wait(10)
+        if out is not sys.stdout:
+            out.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,55 @@
 import os
 import threading
 import asyncio
-from app.client import run_flask, run_quic_server
+from app import localbus, sharding
+from app.client import run_flask, run_quic_server, run_quic_worker, run_http_process
+from app.supervisor import Supervisor, http_check
+
+QUIC_PORT = 9999
+HTTP_PORT = 9999
+
+# QUIC_SUPERVISE=1 (o QUIC_WORKERS > 1): Flask y QUIC en procesos separados
+SUPERVISE = os.environ.get("QUIC_SUPERVISE", "").lower() in ("1", "true", "yes", "on")
+
+
+def run_supervised(workers):
+    """
+    Tier HTTP (Flask) y N receptores QUIC (SO_REUSEPORT si N > 1) en
+    procesos propios: el parseo de uploads y el procesamiento de paquetes
+    no compiten por el GIL. Comparten estado por un bus local privado
+    (eventos de transferencia → SSE y /metrics del tier HTTP, latidos →
+    supervisor) y la admisión por un ledger SQLite. Un proceso caído o
+    colgado se relanza.
+    """
+    events_path = sharding.events_path(QUIC_PORT)
+    # Admisión contra un solo ledger: los hijos (spawn) heredan el entorno
+    ledger = sharding.admission_path(QUIC_PORT)
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(ledger + suffix)
+        except FileNotFoundError:
+            pass
+    os.environ["QUIC_ADMISSION_DB"] = ledger
+    threading.Thread(target=localbus.BusBroker(events_path).serve_forever, name="worker-bus", daemon=True).start()
+    supervisor = Supervisor()
+    supervisor.add("http", run_http_process, events_path,
+                   health=http_check(f"http://127.0.0.1:{HTTP_PORT}/healthz"))
+    for worker in range(workers):
+        name = f"quic-{worker}"
+        supervisor.add(name, run_quic_worker, worker, workers, events_path,
+                       health=supervisor.heartbeat_check(name))
+    localbus.BusClient(events_path).subscribe(["heartbeat"], lambda topic, data: supervisor.beat(data["name"]))
+    supervisor.start()
+    supervisor.run_forever()
+
+
+def main():
+    if SUPERVISE or sharding.WORKERS > 1:
+        run_supervised(sharding.WORKERS)
+    else:
+        threading.Thread(target=run_flask, daemon=True).start()
+        asyncio.run(run_quic_server())
+
 
 if __name__ == "__main__":
-    threading.Thread(target=run_flask, daemon=True).start()
-    asyncio.run(run_quic_server())
\ No newline at end of file
+    main()
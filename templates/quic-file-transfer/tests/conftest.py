@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los tests importan `app` igual que run.py, desde la carpeta del template
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,32 @@
+import os
+import time
+
+from app import admission, filemeta
+
+
+def _write(directory, name, size=100, mtime=None):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_played_videos_includes_legacy_played_names(tmp_path):
+    old = time.time() - 3600
+    legacy = _write(tmp_path, "video.mp4.PLAYED_14:30_monday", mtime=old)
+    played = _write(tmp_path, "clip.mkv")
+    filemeta.update_sidecar(played, played_at=time.time())
+    _write(tmp_path, "pending.mp4.SCHED_14:30_monday")
+    _write(tmp_path, "fresh.mp4")
+    _write(tmp_path, "notes.txt.PLAYED_14:30_monday")
+
+    found = [path for _, path, _ in admission.played_videos(str(tmp_path))]
+    assert found == [legacy, played]
+
+
+def test_evict_played_reclaims_legacy_played_names(tmp_path):
+    legacy = _write(tmp_path, "video.mp4.PLAYED_14:30_monday", size=1000, mtime=time.time() - 3600)
+    assert admission.evict_played(str(tmp_path), need=500) == 1000
+    assert not os.path.exists(legacy)
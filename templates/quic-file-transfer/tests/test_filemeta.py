@@ -0,0 +1,73 @@
+import io
+import os
+
+import pytest
+
+from app import filemeta
+
+
+LEGACY_SCHED = "video.mp4.SCHED_14:30_monday,wednesday"
+
+
+def test_legacy_sched_round_trip():
+    meta = filemeta.from_legacy_name(LEGACY_SCHED)
+    assert meta == {"name": "video.mp4", "action": "schedule",
+                    "schedule": {"time": "14:30", "days": ["monday", "wednesday"]}}
+    assert filemeta.to_legacy_name(meta) == LEGACY_SCHED
+
+
+@pytest.mark.parametrize("form_action", [None, "", "silent"])
+def test_default_form_keeps_legacy_flags(form_action):
+    # Emisores viejos: nombre con SCHED_ y videoAction=silent (o nada)
+    meta = filemeta.apply_form(filemeta.from_legacy_name(LEGACY_SCHED), form_action)
+    assert meta["action"] == "schedule"
+    assert meta["schedule"] == {"time": "14:30", "days": ["monday", "wednesday"]}
+
+
+def test_explicit_form_overrides_legacy_flags():
+    meta = filemeta.apply_form(filemeta.from_legacy_name(LEGACY_SCHED), "now")
+    assert meta == {"name": "video.mp4", "action": "now"}
+
+
+def test_plain_name_gets_default_action():
+    assert filemeta.apply_form(filemeta.from_legacy_name("video.mp4"), None) == \
+        {"name": "video.mp4", "action": "silent"}
+
+
+def test_upload_keeps_legacy_schedule(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    from app import client
+
+    response = client.app.test_client().post("/api/upload", data={
+        "file": (io.BytesIO(b"x" * 1024), LEGACY_SCHED),
+        "videoAction": "silent",
+    }, content_type="multipart/form-data")
+    assert response.status_code == 200, response.get_json()
+
+    path = os.path.join(client.get_downloads_folder(), "video.mp4")
+    meta = filemeta.load(path)
+    assert meta["action"] == "schedule"
+    assert meta["schedule"] == {"time": "14:30", "days": ["monday", "wednesday"]}
+
+
+def test_parse_manifest():
+    body = b'{"files": [{"path": "a/b.mp4", "size": 10}, {"path": "c.txt", "size": 0}]}'
+    assert filemeta.parse_manifest(body) == [{"path": "a/b.mp4", "size": 10}, {"path": "c.txt", "size": 0}]
+
+
+@pytest.mark.parametrize("body", [
+    b'[{"path": "a", "size": 1}]',
+    b'{"files": {"path": "a"}}',
+    b'{"files": ["a"]}',
+    b'{"files": [{"path": "a", "size": "10"}]}',
+    b'{"files": [{"path": "a", "size": -1}]}',
+    b'{"files": [{"path": "a", "size": true}]}',
+    b'{"files": [{"size": 1}]}',
+    b'{"files": [{"path": "../a", "size": 1}]}',
+    b'{"files": [{"path": "/etc/a", "size": 1}]}',
+    b'\xff',
+    b'{',
+])
+def test_parse_manifest_rejects_malformed(body):
+    with pytest.raises(ValueError):
+        filemeta.parse_manifest(body)
@@ -0,0 +1,62 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from app import localbus
+
+pytestmark = pytest.mark.skipif(not localbus.available(), reason="sin AF_UNIX")
+
+
+@pytest.fixture
+def broker(tmp_path):
+    path = str(tmp_path / "bus.sock")
+    threading.Thread(target=localbus.BusBroker(path).serve_forever, daemon=True).start()
+    deadline = time.monotonic() + 5
+    while not (tmp_path / "bus.sock").exists():
+        assert time.monotonic() < deadline, "el broker no arrancó"
+        time.sleep(0.01)
+    return path
+
+
+def _subscribe(path, topics):
+    received = []
+    connected = threading.Event()
+    got = threading.Event()
+
+    def on_event(topic, data):
+        received.append((topic, data))
+        got.set()
+
+    localbus.BusClient(path).subscribe(topics, on_event, on_connect=lambda again: connected.set())
+    assert connected.wait(5)
+    time.sleep(0.1)  # el SUBSCRIBE llega al broker
+    return received, got
+
+
+def test_idle_subscriber_keeps_receiving(broker):
+    received, got = _subscribe(broker, ["alert"])
+    time.sleep(1.5)  # más que SEND_TIMEOUT sin enviar nada
+    assert localbus.BusClient(broker).publish("alert", {"n": 1})
+    assert got.wait(2)
+    assert received == [("alert", {"n": 1})]
+
+
+def test_stuck_subscriber_does_not_block_others(broker):
+    stuck = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stuck.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    stuck.connect(broker)
+    stuck.sendall(localbus.encode_frame(localbus.T_SUBSCRIBE, {"topics": ["*"]}))
+    received, got = _subscribe(broker, ["alert"])
+
+    publisher = localbus.BusClient(broker)
+    blob = "x" * 64 * 1024
+    started = time.monotonic()
+    for _ in range(64):  # llena el socket del suscriptor que nunca lee
+        publisher.publish("bulk", blob)
+    assert publisher.publish("alert", {"n": 2})
+    assert got.wait(localbus.SEND_TIMEOUT + 3)
+    assert time.monotonic() - started < localbus.SEND_TIMEOUT + 3
+    assert ("alert", {"n": 2}) in received
+    stuck.close()
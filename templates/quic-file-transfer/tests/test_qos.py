@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+
+from app import qos
+
+
+def test_alert_to_other_peer_does_not_pause_bulk():
+    scheduler = qos.TransferScheduler()
+    with scheduler.transfer(qos.ALERT, "100.64.0.1"):
+        assert not scheduler.must_yield(qos.BULK, "100.64.0.2")
+        assert asyncio.run(scheduler.await_turn(qos.BULK, "100.64.0.2")) == 0.0
+        assert scheduler.must_yield(qos.BULK, "100.64.0.1")
+    assert not scheduler.must_yield(qos.BULK, "100.64.0.1")
+
+
+def test_await_turn_wakes_when_alert_ends_without_blocking_loop():
+    scheduler = qos.TransferScheduler()
+    alert_started = threading.Event()
+    release = threading.Event()
+
+    def alert():
+        with scheduler.transfer(qos.ALERT, "peer"):
+            alert_started.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=alert)
+    thread.start()
+    assert alert_started.wait(5)
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        tick_task = asyncio.ensure_future(ticker())
+        asyncio.get_running_loop().call_later(0.3, release.set)
+        paused = await scheduler.await_turn(qos.BULK, "peer")
+        tick_task.cancel()
+        return paused, ticks
+
+    started = time.monotonic()
+    paused, ticks = asyncio.run(main())
+    thread.join()
+    assert 0.25 < paused < 1.0
+    assert time.monotonic() - started < 1.0
+    assert ticks >= 10  # el loop siguió atendiendo otras tareas
+    assert scheduler.stats()["paused"] == 0
+
+
+def test_await_turn_gives_up_after_max_pause():
+    scheduler = qos.TransferScheduler(max_pause=0.2)
+    with scheduler.transfer(qos.ALERT, "peer"):
+        paused = asyncio.run(scheduler.await_turn(qos.BULK, "peer"))
+    assert 0.15 < paused < 1.0
+
+
+def test_paced_yields_every_chunk():
+    scheduler = qos.TransferScheduler()
+
+    async def collect():
+        return [chunk async for chunk in scheduler.paced([b"a", b"b"], qos.BULK, "peer")]
+
+    assert asyncio.run(collect()) == [b"a", b"b"]
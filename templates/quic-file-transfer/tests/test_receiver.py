@@ -0,0 +1,54 @@
+import asyncio
+import os
+
+import pytest
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.connection import QuicConnection
+from aioquic.quic.events import StreamDataReceived, StreamReset
+
+from app import client, filemeta
+
+CERTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "certs")
+
+
+@pytest.fixture
+def protocol():
+    # QuicConnectionProtocol toma el loop del hilo al construirse
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    config = QuicConfiguration(is_client=False)
+    config.load_cert_chain(os.path.join(CERTS, "cert.pem"), os.path.join(CERTS, "key.pem"))
+    proto = client.FileServerProtocol(QuicConnection(configuration=config, original_destination_connection_id=bytes(8)))
+    proto._alpn = filemeta.ALPN_V2
+    proto.acks = []
+    proto._send_ack = lambda stream_id, ok, size, sha256=None, error=None, rejected=False: \
+        proto.acks.append((stream_id, ok, error))
+    yield proto
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def _header():
+    return filemeta.encode_header({"name": "video.mp4", "size": 10})
+
+
+def test_stream_ending_inside_header_is_nacked_and_freed(protocol):
+    protocol._dispatch_event(StreamDataReceived(data=_header()[:5], end_stream=False, stream_id=0))
+    assert 0 in protocol._tmp
+    protocol._dispatch_event(StreamDataReceived(data=b"", end_stream=True, stream_id=0))
+    assert protocol._tmp == {}
+    assert [(sid, ok) for sid, ok, _ in protocol.acks] == [(0, False)]
+
+
+def test_reset_inside_header_is_nacked_and_freed(protocol):
+    protocol._dispatch_event(StreamDataReceived(data=_header()[:5], end_stream=False, stream_id=4))
+    protocol._dispatch_event(StreamReset(error_code=0, stream_id=4))
+    assert protocol._tmp == {}
+    assert [(sid, ok) for sid, ok, _ in protocol.acks] == [(4, False)]
+
+
+def test_legacy_name_without_terminator_is_freed(protocol):
+    protocol._alpn = filemeta.ALPN_LEGACY
+    for stream_id in range(0, 400, 4):
+        protocol._dispatch_event(StreamDataReceived(data=b"video.mp", end_stream=True, stream_id=stream_id))
+    assert protocol._tmp == {}
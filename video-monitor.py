@@ -1,24 +1,55 @@
 #!/usr/bin/env python3
 """
-Monitor de videos que respeta los flags en el nombre del archivo:
-- video.mp4              → Reproducir Ahora (inmediato)
-- video.mp4.SILENT       → Solo Descargar (no abre)
-- video.mp4.SCHED_14:30_mon,wed → Programar para 14:30 en esos días
+Monitor de videos que respeta la acción pedida por el emisor. La acción se
+lee del sidecar `.<video>.meta` que escribe el receptor (ver filemeta.py):
+- action "now" (o sin acción) → Reproducir Ahora (inmediato)
+- action "silent"             → Solo Descargar (no abre)
+- action "schedule"           → Programar para schedule.time en schedule.days
+Sin sidecar se aceptan los flags viejos en el nombre (video.mp4.SILENT,
+video.mp4.SCHED_14:30_mon,wed).
 """
 import os
+import sys
 import time
+import heapq
+import sqlite3
+import queue
+import itertools
 import subprocess
 import platform
-from datetime import datetime
+from datetime import datetime, timedelta
+
+# dirwatch.py se comparte con la app del contenedor (solo usa stdlib)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "quic-file-transfer", "app"))
+from dirwatch import DirWatcher, CLOSED, MOVED_IN, DELETED, RESCAN
+import localbus
+import filemeta
+import logs
+
+log = logs.get_logger("video-monitor")
 
 # Detectar carpeta de descargas
 HOME = os.path.expanduser("~")
 DOWNLOADS_DIR = os.path.join(HOME, "Descargas") if os.path.isdir(os.path.join(HOME, "Descargas")) else os.path.join(HOME, "Downloads")
 
-# Archivo para rastrear videos ya procesados
-PROCESSED_FILE = "/tmp/video-monitor-processed.txt"
+def default_state_dir():
+    """Carpeta persistente para el estado del monitor (sobrevive reinicios)"""
+    if platform.system() == "Windows":
+        base = os.environ.get("LOCALAPPDATA") or os.path.join(HOME, "AppData", "Local")
+    else:
+        base = os.environ.get("XDG_STATE_HOME") or os.path.join(HOME, ".local", "state")
+    return os.path.join(base, "video-monitor")
+
+# Índice de videos ya procesados (persistente, no en /tmp)
+PROCESSED_DB = os.path.join(default_state_dir(), "processed.sqlite3")
 LOCK_FILE = "/tmp/video-monitor.lock"
 
+# Páginas libres (de 4 KiB) a partir de las que compact() hace VACUUM
+VACUUM_MIN_FREE_PAGES = 256
+
+# Máximo que el bucle duerme sin eventos antes de re-calcular vencimientos
+MAX_SLEEP = 300
+
 VIDEO_EXTENSIONS = {'.mp4', '.webm', '.mkv', '.avi', '.mov', '.flv', '.m4v', '.ts', '.m3u8'}
 
 def acquire_lock():
@@ -52,7 +83,7 @@ def is_video(filename):
 def open_video(filepath):
     """Abre video con el reproductor por defecto"""
     filename = os.path.basename(filepath)
-    print(f"🎬 Abriendo: {filename}")
+    log.info("🎬 Abriendo: %s", filename)
     
     try:
         if platform.system() == "Linux":
@@ -62,134 +93,332 @@ def open_video(filepath):
         elif platform.system() == "Windows":
             subprocess.Popen(['start', '', filepath], shell=True)
     except Exception as e:
-        print(f"❌ Error abriendo video: {e}")
+        log.error("❌ Error abriendo video: %s", e)
+
+DAY_NAMES = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
 
-def should_play_scheduled(filename):
+def parse_schedule(filename, meta):
     """
-    Verifica si un video programado debe reproducirse ahora.
-    Formato: video.mp4.SCHED_14:30_monday,wednesday
+    Convierte una sola vez la programación de la metadata
+    ({"time": "14:30", "days": ["monday", "wed"]}).
+    Devuelve (hora, minuto, {días 0=lunes..6=domingo}) o None si no es válido.
     """
-    if '.SCHED_' not in filename:
-        return False
+    schedule = meta.get("schedule")
+    if meta.get("action") != "schedule" or not schedule:
+        return None
     
     try:
-        # Extraer tiempo y días: "video.mp4.SCHED_14:30_monday,wednesday"
-        parts = filename.split('.SCHED_')[1].split('_', 1)
-        scheduled_time = parts[0]  # "14:30"
-        scheduled_days = parts[1] if len(parts) > 1 else ""  # "monday,wednesday"
-        
-        # Obtener hora actual
+        hour, minute = (int(x) for x in schedule["time"].split(':'))
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(f"hora inválida {schedule['time']}")
+        days = set()
+        for day in schedule.get("days", []):
+            day = day.strip().lower()
+            for i, name in enumerate(DAY_NAMES):
+                if day and name.startswith(day[:3]):
+                    days.add(i)
+        return hour, minute, days
+    except Exception as e:
+        log.error("[ERROR] Error parsing scheduled video: %s: %s", filename, e)
+        return None
+
+def next_due(schedule, now=None):
+    """
+    Próximo instante (datetime) en que toca reproducir, o None si no hay días.
+    Si estamos dentro del minuto programado cuenta como "ahora", igual que
+    la comparación HH:MM original.
+    """
+    hour, minute, days = schedule
+    if not days:
+        return None
+    now = now or datetime.now()
+    today_slot = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    for offset in range(8):
+        candidate = today_slot + timedelta(days=offset)
+        if candidate.weekday() not in days:
+            continue
+        if candidate + timedelta(minutes=1) > now:
+            return max(candidate, now)
+    return None
+
+class Scheduler:
+    """
+    Heap de (instante, seq, archivo): el monitor duerme exactamente hasta el
+    próximo vencimiento en vez de revisar cada video programado cada 2 s.
+    """
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._scheduled = {}  # archivo → instante vigente (invalida entradas viejas)
+    
+    def add(self, filename, meta):
+        schedule = parse_schedule(filename, meta)
+        if schedule is None:
+            return None
+        due = next_due(schedule)
+        if due is None:
+            log.warning("[!] %s: programación sin días válidos, se ignora", filename)
+            return None
+        self._scheduled[filename] = due
+        heapq.heappush(self._heap, (due, next(self._seq), filename))
+        return due
+    
+    def discard(self, filename):
+        self._scheduled.pop(filename, None)
+    
+    def seconds_until_next(self):
+        """Segundos hasta el próximo vencimiento válido (None si no hay)"""
+        while self._heap:
+            due, _, filename = self._heap[0]
+            if self._scheduled.get(filename) != due:
+                heapq.heappop(self._heap)
+                continue
+            return max(0.0, (due - datetime.now()).total_seconds())
+        return None
+    
+    def pop_due(self):
+        """Extrae los archivos cuyo instante ya llegó"""
         now = datetime.now()
-        current_time = now.strftime('%H:%M')
-        day_num = now.weekday()
-        days_en = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-        current_day = days_en[day_num]
-        
-        print(f"[DEBUG] Checando programación: {filename}")
-        print(f"[DEBUG] Hora actual: {current_time}, Hora programada: {scheduled_time}")
-        print(f"[DEBUG] Día actual: {current_day}, Días programados: {scheduled_days}")
+        due_files = []
+        while self._heap and self._heap[0][0] <= now:
+            due, _, filename = heapq.heappop(self._heap)
+            if self._scheduled.get(filename) == due:
+                del self._scheduled[filename]
+                due_files.append(filename)
+        return due_files
+
+class ProcessedIndex:
+    """
+    Videos ya procesados en SQLite, con clave (dispositivo, inodo, tamaño,
+    mtime): renombrar un archivo (.SCHED_ → .PLAYED_) no lo hace parecer
+    nuevo, y un archivo distinto con el mismo nombre sí lo es.
+    compact() elimina las filas de archivos que ya no existen.
+    `created` indica que la base es nueva (primera ejecución o actualización
+    desde /tmp/video-monitor-processed.txt): ver seed().
+    """
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.created = not os.path.exists(path)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS processed ("
+            " dev INTEGER NOT NULL, ino INTEGER NOT NULL,"
+            " size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,"
+            " name TEXT NOT NULL, processed_at REAL NOT NULL,"
+            " PRIMARY KEY (dev, ino, size, mtime_ns)) WITHOUT ROWID"
+        )
+        self.db.commit()
+    
+    @staticmethod
+    def _key(st):
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    
+    def contains(self, st):
+        row = self.db.execute(
+            "SELECT 1 FROM processed WHERE dev=? AND ino=? AND size=? AND mtime_ns=?",
+            self._key(st),
+        ).fetchone()
+        return row is not None
+    
+    def mark(self, st, name):
+        self.db.execute(
+            "INSERT OR REPLACE INTO processed VALUES (?, ?, ?, ?, ?, ?)",
+            self._key(st) + (name, time.time()),
+        )
+        self.db.commit()
+    
+    def seed(self, directory, name_filter):
+        """
+        Marca como procesados los videos que ya están en `directory`. Con la
+        base recién creada no se sabe cuáles abrió la versión anterior (su
+        índice "nombre:tamaño" en /tmp), y abrir de nuevo todo Descargas es
+        peor que perder un video llegado con el monitor parado. Las
+        programaciones pendientes se re-agendan igual en el escaneo inicial.
+        """
+        rows = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file() and name_filter(entry.name):
+                            rows.append(self._key(entry.stat()) + (entry.name, time.time()))
+                    except OSError:
+                        continue
+        except OSError:
+            return 0
+        self.db.executemany("INSERT OR REPLACE INTO processed VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.db.commit()
+        return len(rows)
+    
+    def compact(self, directory):
+        """Borra entradas cuyo archivo ya no está (o cambió) en `directory`"""
+        alive = set()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file():
+                            alive.add(self._key(entry.stat()))
+                    except OSError:
+                        continue
+        except OSError:
+            return 0
         
-        # Comparar
-        if current_time == scheduled_time:
-            # Verificar si el día coincide (nombres completos)
-            if current_day in scheduled_days:
-                return True
-    except Exception as e:
-        print(f"[ERROR] Error parsing scheduled video: {e}")
+        stale = [row for row in self.db.execute("SELECT dev, ino, size, mtime_ns FROM processed")
+                 if tuple(row) not in alive]
+        if stale:
+            self.db.executemany(
+                "DELETE FROM processed WHERE dev=? AND ino=? AND size=? AND mtime_ns=?", stale
+            )
+            self.db.commit()
+            self._maybe_vacuum()
+        return len(stale)
     
-    return False
+    def _maybe_vacuum(self):
+        """VACUUM solo si las páginas libres pasan VACUUM_MIN_FREE_PAGES y un cuarto de la base"""
+        free = self.db.execute("PRAGMA freelist_count").fetchone()[0]
+        total = self.db.execute("PRAGMA page_count").fetchone()[0]
+        if free >= VACUUM_MIN_FREE_PAGES and free * 4 >= total:
+            self.db.execute("VACUUM")
 
-def get_processed_videos():
-    """Lee videos ya procesados"""
-    if os.path.exists(PROCESSED_FILE):
-        with open(PROCESSED_FILE, 'r') as f:
-            return set(line.strip() for line in f if line.strip())
-    return set()
+def play_scheduled(filename):
+    """
+    Marca el video como reproducido y lo abre: played_at en el sidecar, o
+    rename .SCHED_ → .PLAYED_ si llegó con el nombre legado.
+    """
+    filepath = os.path.join(DOWNLOADS_DIR, filename)
+    if not os.path.isfile(filepath):
+        return
+    try:
+        if '.SCHED_' in filename:
+            new_path = os.path.join(DOWNLOADS_DIR, filename.replace('.SCHED_', '.PLAYED_'))
+            os.rename(filepath, new_path)
+        else:
+            filemeta.update_sidecar(filepath, played_at=time.time())
+            new_path = filepath
+        log.info("⏰ Reproduciendo programado: %s", filename)
+        open_video(new_path)
+    except Exception as e:
+        log.error("❌ Error reproduciendo programado: %s", e)
+
+def handle_video(filename, processed, scheduler):
+    """Procesa un video completo según su acción (una sola vez por archivo)"""
+    filepath = os.path.join(DOWNLOADS_DIR, filename)
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return
+    
+    meta = filemeta.load(filepath)
+    action = meta.get("action")
+    
+    if processed.contains(st):
+        # Ya visto en una ejecución anterior: solo re-agendar si sigue pendiente
+        if action == "schedule" and not meta.get("played_at"):
+            scheduler.add(filename, meta)
+        return
+    
+    log.info("📥 Video nuevo: %s", filename)
+    
+    # Procesar según la acción
+    if action == "silent":
+        log.info("🤐 Solo descargado (sin reproducción)")
+    elif action == "schedule":
+        due = scheduler.add(filename, meta)
+        if due:
+            log.info("📌 Programado para %s", due.strftime('%Y-%m-%d %H:%M'))
+    else:
+        # Reproducir ahora
+        log.info("▶️ Reproduciendo ahora")
+        open_video(filepath)
+    
+    processed.mark(st, filename)
 
-def mark_as_processed(video_id):
-    """Marca un video como procesado"""
-    with open(PROCESSED_FILE, 'a') as f:
-        f.write(f"{video_id}\n")
+def is_candidate(filename):
+    """
+    Filtro para el watcher: videos visibles que no se reprodujeron ya.
+    Las recepciones en curso (`.<nombre>.partial`) son ocultas y quedan fuera;
+    el video aparece por rename (MOVED_IN) ya completo.
+    """
+    return not filename.startswith('.') and '.PLAYED_' not in filename and is_video(filename)
 
 def monitor_videos():
-    """Monitorea la carpeta de descargas"""
-    print(f"📁 Monitoreando: {DOWNLOADS_DIR}")
-    print("⏳ Esperando videos nuevos...")
-    print("")
+    """
+    Monitorea la carpeta de descargas por eventos: el watcher avisa cuando
+    un video termina de escribirse y el Scheduler despierta al vencer la
+    próxima programación. Sin eventos ni vencimientos, el hilo duerme.
+    """
+    log.info("📁 Monitoreando: %s", DOWNLOADS_DIR)
+    log.info("⏳ Esperando videos nuevos...")
+    
+    processed = ProcessedIndex(PROCESSED_DB)
+    if processed.created:
+        seeded = processed.seed(DOWNLOADS_DIR, is_candidate)
+        log.info("🗂️ Índice nuevo: %s videos existentes marcados como procesados", seeded)
+    scheduler = Scheduler()
+    events = queue.Queue()
     
-    processed = get_processed_videos()
+    def on_event(kind, filename):
+        events.put((kind, filename))
+    
+    os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+    watcher = DirWatcher(DOWNLOADS_DIR, on_event, poll_interval=2.0, name_filter=is_candidate).start()
+    
+    # Bus local (event-bus.py): aviso inmediato con metadata del receptor.
+    # El watcher queda de respaldo; un aviso duplicado ya está en el índice.
+    def on_bus_event(topic, data):
+        # Archivos de un lote dentro de una subcarpeta: no se monitorean
+        if os.path.dirname(data.get("path", "")):
+            return
+        name = os.path.basename(data.get("name", ""))
+        if is_candidate(name):
+            events.put((MOVED_IN, name))
+    
+    localbus.BusClient(localbus.default_socket_path(DOWNLOADS_DIR)).subscribe(["file_committed"], on_bus_event)
+    
+    # Estado inicial: un único escaneo (después solo eventos)
+    events.put((RESCAN, None))
     
     while True:
         try:
-            if not os.path.isdir(DOWNLOADS_DIR):
-                time.sleep(2)
-                continue
+            timeout = scheduler.seconds_until_next()
+            # Tope para re-sincronizar con el reloj de pared (NTP, suspensión)
+            timeout = MAX_SLEEP if timeout is None else min(timeout, MAX_SLEEP)
+            try:
+                kind, filename = events.get(timeout=timeout)
+            except queue.Empty:
+                kind = None
             
-            for filename in os.listdir(DOWNLOADS_DIR):
-                # Ignorar archivos especiales
-                if filename.endswith('.PLAYED_') or filename.startswith('.'):
-                    continue
-                
-                filepath = os.path.join(DOWNLOADS_DIR, filename)
-                if not os.path.isfile(filepath):
-                    continue
-                
-                # Verificar si es un video
-                if not is_video(filename):
-                    continue
-                
-                # ID único: nombre + tamaño
-                file_size = os.path.getsize(filepath)
-                video_id = f"{filename}:{file_size}"
-                
-                # Si ya fue procesado, revisar si es programado y debe reproducirse
-                if video_id in processed:
-                    if '.SCHED_' in filename and should_play_scheduled(filename):
-                        # Renombrar para marcar como reproducido
-                        new_name = filename.replace('.SCHED_', '.PLAYED_')
-                        new_path = os.path.join(DOWNLOADS_DIR, new_name)
-                        try:
-                            os.rename(filepath, new_path)
-                            open_video(new_path)
-                        except:
-                            pass
-                    continue
-                
-                # Nuevo video detectado
-                time.sleep(2)  # Esperar a que termine de escribirse
-                
-                if not os.path.exists(filepath):
-                    continue
-                
-                print(f"📥 Video nuevo: {filename}")
-                
-                # Procesar según el flag
-                if '.SILENT' in filename:
-                    print(f"🤐 Solo descargado (sin reproducción)")
-                elif '.SCHED_' in filename:
-                    scheduled_time = filename.split('.SCHED_')[1].split('_')[0]
-                    scheduled_days = filename.split('_', 1)[1] if '_' in filename.split('.SCHED_')[1] else ""
-                    print(f"📌 Programado para {scheduled_time} ({scheduled_days})")
-                else:
-                    # Reproducir ahora
-                    print(f"▶️ Reproduciendo ahora")
-                    open_video(filepath)
-                
-                mark_as_processed(video_id)
-                processed.add(video_id)
+            if kind == RESCAN:
+                removed = processed.compact(DOWNLOADS_DIR)
+                if removed:
+                    log.info("🧹 Índice compactado: %s videos que ya no existen", removed)
+                for entry in os.scandir(DOWNLOADS_DIR):
+                    if entry.is_file() and is_candidate(entry.name):
+                        handle_video(entry.name, processed, scheduler)
+            elif kind in (CLOSED, MOVED_IN):
+                handle_video(filename, processed, scheduler)
+            elif kind == DELETED:
+                scheduler.discard(filename)
+                filemeta.remove_sidecar(os.path.join(DOWNLOADS_DIR, filename))
             
-            time.sleep(2)
+            for due_file in scheduler.pop_due():
+                play_scheduled(due_file)
         
         except KeyboardInterrupt:
-            print("\n✓ Monitor detenido")
+            log.info("✓ Monitor detenido")
+            watcher.stop()
             break
         except Exception as e:
-            print(f"❌ Error: {e}")
+            log.error("❌ Error: %s", e)
             time.sleep(2)
 
 if __name__ == "__main__":
+    logs.setup()
     if not acquire_lock():
-        print("❌ Monitor ya ejecutándose")
+        log.error("❌ Monitor ya ejecutándose")
         exit(1)
     
     try: